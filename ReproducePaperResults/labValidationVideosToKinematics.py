@@ -105,6 +105,11 @@ poseDetectors = ['OpenPose']
 # cameraSetups = ['2-cameras', '3-cameras', '5-cameras']
 cameraSetups = ['2-cameras']
 
+# Set to True to process all camera configurations at once (validation mode of
+# main): pose detection and synchronization then run once with all cameras,
+# and all configurations are triangulated in one pass.
+processCameraSetupsTogether = False
+
 # Select the resolution at which you would like to use OpenPose. More details
 # about the options in Examples/reprocessSessions. In the paper, we compared 
 # 'default' and '1x1008_4scales'.
@@ -185,7 +190,8 @@ def process_trial(trial_name=None, session_name=None, isDocker=False,
                   imageUpsampleFactor=4, poseDetector='OpenPose',
                   resolutionPoseDetection='default', scaleModel=False,
                   bbox_thr=0.8, augmenter_model='v0.2', benchmark=False,
-                  calibrationOptions=None, offset=True, dataDir=None):
+                  calibrationOptions=None, offset=True, dataDir=None,
+                  cameraSubsets=None):
 
     # Run main processing pipeline.
     main(session_name, trial_name, trial_name, cam2Use, intrinsicsFinalFolder,
@@ -194,7 +200,7 @@ def process_trial(trial_name=None, session_name=None, isDocker=False,
           resolutionPoseDetection=resolutionPoseDetection,
           scaleModel=scaleModel, bbox_thr=bbox_thr,
           augmenter_model=augmenter_model, benchmark=benchmark, offset=offset,
-          dataDir=dataDir)
+          dataDir=dataDir, cameraSubsets=cameraSubsets)
 
     return
 
@@ -228,29 +234,32 @@ for count, sessionName in enumerate(sessionNames):
                 trials.append(trial)
     
     for poseDetector in poseDetectors:
-        for cameraSetup in cameraSetups:
-            cam2Use = cam2sUse[cameraSetup]
-            
-            # The second sessions (<>_1) have no static trial for scaling the
-            # model. The static trials were collected as part of the first
-            # session for each subject (<>_0). We here copy the Model folder
-            # from the first session to the second session.
-            if sessionName[-1] == '1':
-                sessionDir = os.path.join(dataDir, 'Data', sessionName)
-                sessionDir_0 = sessionDir[:-1] + '0'
-                camDir_0 = os.path.join(
-                    sessionDir_0, 'OpenSimData', 
-                    poseDetector + '_' + resolutionPoseDetection, cameraSetup)
-                modelDir_0 = os.path.join(camDir_0, 'Model')
-                camDir_1 = os.path.join(
-                    sessionDir, 'OpenSimData', 
-                    poseDetector + '_' + resolutionPoseDetection, cameraSetup)
-                modelDir_1 = os.path.join(camDir_1, 'Model')
-                os.makedirs(modelDir_1, exist_ok=True)
-                for file in os.listdir(modelDir_0):
-                    pathFile = os.path.join(modelDir_0, file)
-                    pathFileEnd = os.path.join(modelDir_1, file)
-                    shutil.copy2(pathFile, pathFileEnd)
+        if processCameraSetupsTogether:
+            cameraSetupGroups = [cameraSetups]
+        else:
+            cameraSetupGroups = [[cameraSetup] for cameraSetup in cameraSetups]
+        for cameraSetupGroup in cameraSetupGroups:
+            for cameraSetup in cameraSetupGroup:
+                # The second sessions (<>_1) have no static trial for scaling the
+                # model. The static trials were collected as part of the first
+                # session for each subject (<>_0). We here copy the Model folder
+                # from the first session to the second session.
+                if sessionName[-1] == '1':
+                    sessionDir = os.path.join(dataDir, 'Data', sessionName)
+                    sessionDir_0 = sessionDir[:-1] + '0'
+                    camDir_0 = os.path.join(
+                        sessionDir_0, 'OpenSimData', 
+                        poseDetector + '_' + resolutionPoseDetection, cameraSetup)
+                    modelDir_0 = os.path.join(camDir_0, 'Model')
+                    camDir_1 = os.path.join(
+                        sessionDir, 'OpenSimData', 
+                        poseDetector + '_' + resolutionPoseDetection, cameraSetup)
+                    modelDir_1 = os.path.join(camDir_1, 'Model')
+                    os.makedirs(modelDir_1, exist_ok=True)
+                    for file in os.listdir(modelDir_0):
+                        pathFile = os.path.join(modelDir_0, file)
+                        pathFileEnd = os.path.join(modelDir_1, file)
+                        shutil.copy2(pathFile, pathFileEnd)
                     
             # Process trial.
             for trial in trials:                
@@ -274,14 +283,26 @@ for count, sessionName in enumerate(sessionNames):
                 else:
                     intrinsicsFinalFolder = 'Deployed_720_60fps'                    
                     
+                # Camera configurations.
+                if processCameraSetupsTogether:
+                    cam2Use = ['all']
+                    markerDataFolderNameSuffix = None
+                    cameraSubsets = {cameraSetup: cam2sUse[cameraSetup]
+                                     for cameraSetup in cameraSetupGroup}
+                else:
+                    cam2Use = cam2sUse[cameraSetupGroup[0]]
+                    markerDataFolderNameSuffix = cameraSetupGroup[0]
+                    cameraSubsets = None
+                    
                 process_trial(trial,
                               session_name=sessionName,
                               cam2Use=cam2Use, 
                               intrinsicsFinalFolder=intrinsicsFinalFolder,
                               extrinsicsTrial=extrinsicsTrial,
-                              markerDataFolderNameSuffix=cameraSetup,
+                              markerDataFolderNameSuffix=markerDataFolderNameSuffix,
                               poseDetector=poseDetector,
                               resolutionPoseDetection=resolutionPoseDetection,
                               scaleModel=scaleModel, 
                               augmenter_model=augmenter_model,
-                              dataDir=dataDir)
\ No newline at end of file
+                              dataDir=dataDir,
+                              cameraSubsets=cameraSubsets)
\ No newline at end of file
@@ -21,6 +21,7 @@ from utilsChecker import isCheckerboardUpsideDown
 from utilsChecker import autoSelectExtrinsicSolution
 from utilsChecker import synchronizeVideos
 from utilsChecker import triangulateMultiviewVideo
+from utilsChecker import triangulateMultiviewVideoSubsets
 from utilsChecker import writeTRCfrom3DKeypoints
 from utilsChecker import popNeutralPoseImages
 from utilsChecker import rotateIntrinsics
@@ -37,7 +38,9 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
          scaleModel=False, bbox_thr=0.8, augmenter_model='v0.3',
          genericFolderNames=False, offset=True, benchmark=False,
          dataDir=None, overwriteAugmenterModel=False,
-         filter_frequency='default', overwriteFilterFrequency=False):
+         filter_frequency='default', overwriteFilterFrequency=False,
+         cameraSubsets=None, useSyncLagPrior=False, syncMethod='keypoints',
+         useSyncMetadataLagWindow=False):
 
     # %% High-level settings.
     # Camera calibration.
@@ -78,6 +81,25 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
         runMarkerAugmentation = False
         runOpenSimPipeline = False
         
+    # %% Validation mode.
+    # cameraSubsets is a dict of lists of cameras, e.g., {'2-cameras': 
+    # ['Cam1', 'Cam3'], '3-cameras': ['Cam1', 'Cam2', 'Cam3']}. Pose detection
+    # and synchronization then run once with all the cameras of the subsets,
+    # all subsets are triangulated in one batched pass, and each subset gets
+    # its own TRC, augmentation, OpenSim, neutral pose image and visualizer
+    # outputs (with the subset name as folder suffix). The synchronized
+    # videos (VisualizerVideos) are shared by all subsets and are trimmed to
+    # the frames of the last subset only, so they may not match the frames
+    # of the other subsets.
+    if cameraSubsets is None:
+        subsetNames = [None]
+    else:
+        subsetNames = list(cameraSubsets)
+        # Cameras in first-seen order, such that the first camera of the
+        # first subset stays the reference camera for synchronization.
+        camerasToUse = list(dict.fromkeys(
+            cam for subsetName in subsetNames for cam in cameraSubsets[subsetName]))
+        
     # %% Paths and metadata. This gets defined through web app.
     baseDir = os.path.dirname(os.path.abspath(__file__))
     if dataDir is None:
@@ -116,51 +138,6 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
     elif poseDetector == 'mmpose':
         poseDetectorDirectory = getMMposeDirectory(isDocker)    
         
-    # %% Create marker folders
-    # Create output folder.
-    if genericFolderNames:
-        markerDataFolderName = os.path.join('MarkerData') 
-    else:
-        if poseDetector == 'mmpose':
-            suff_pd = '_' + str(bbox_thr)
-        elif poseDetector == 'OpenPose':
-            suff_pd = '_' + resolutionPoseDetection
-                
-        markerDataFolderName = os.path.join('MarkerData', 
-                                            poseDetector + suff_pd) 
-        if not markerDataFolderNameSuffix is None:
-            markerDataFolderName = os.path.join(markerDataFolderName,
-                                                markerDataFolderNameSuffix)
-    preAugmentationDir = os.path.join(sessionDir, markerDataFolderName,
-                                      'PreAugmentation')
-    os.makedirs(preAugmentationDir, exist_ok=True)
-    
-    # Create augmented marker folders as well
-    if genericFolderNames:
-        postAugmentationDir = os.path.join(sessionDir, markerDataFolderName, 
-                                           'PostAugmentation')
-    else:
-        postAugmentationDir = os.path.join(
-            sessionDir, markerDataFolderName, 
-            'PostAugmentation_{}'.format(augmenterModel))
-    os.makedirs(postAugmentationDir, exist_ok=True)
-        
-    # %% Dump settings in yaml.
-    if not extrinsicsTrial:
-        pathSettings = os.path.join(postAugmentationDir,
-                                    'Settings_' + trial_id + '.yaml')
-        settings = {
-            'poseDetector': poseDetector, 
-            'augmenter_model': augmenterModel, 
-            'imageUpsampleFactor': imageUpsampleFactor,
-            'openSimModel': sessionMetadata['openSimModel']}
-        if poseDetector == 'OpenPose':
-            settings['resolutionPoseDetection'] = resolutionPoseDetection
-        elif poseDetector == 'mmpose':
-            settings['bbox_thr'] = bbox_thr
-        with open(pathSettings, 'w') as file:
-            yaml.dump(settings, file)
-
     # %% Camera calibration.
     if runCameraCalibration:    
         # Get checkerboard parameters from metadata.
@@ -264,15 +241,6 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
             
     # %% 3D reconstruction
     
-    # Set output file name.
-    pathOutputFiles = {}
-    if benchmark:
-        pathOutputFiles[trialName] = os.path.join(preAugmentationDir,
-                                                  trialName + ".trc")
-    else:
-        pathOutputFiles[trialName] = os.path.join(preAugmentationDir,
-                                                  trial_id + ".trc")
-    
     # Trial relative path
     trialRelativePath = os.path.join('InputMedia', trialName, trial_id)
     
@@ -320,6 +288,9 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
         
     if runSynchronization:
         # Synchronize videos. 
+        # Subsets of 2 cameras are trimmed with the nansInOut of 2 cameras 
+        # (see triangulateMultiviewVideoSubsets).
+        nansInOutTwoCameras = None if cameraSubsets is None else {}
         try:
             keypoints2D, confidence, keypointNames, frameRate, nansInOut, startEndFrames, cameras2Use = (
                 synchronizeVideos( 
@@ -328,7 +299,10 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
                     filtFreqs=filtFreqs, confidenceThreshold=0.4,
                     imageBasedTracker=False, cams2Use=camerasToUse, 
                     poseDetector=poseDetector, trialName=trialName,
-                    resolutionPoseDetection=resolutionPoseDetection))
+                    resolutionPoseDetection=resolutionPoseDetection,
+                    useLagPrior=useSyncLagPrior, syncMethod=syncMethod,
+                    useMetadataLagWindow=useSyncMetadataLagWindow,
+                    nansInOutTwoCameras=nansInOutTwoCameras))
         except Exception as e:
             if len(e.args) == 2: # specific exception
                 raise Exception(e.args[0], e.args[1])
@@ -348,13 +322,29 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
     if runTriangulation:
         # Triangulate.
         try:
-            keypoints3D, confidence3D = triangulateMultiviewVideo(
-                CamParamDict, keypoints2D, ignoreMissingMarkers=False, 
-                cams2Use=cameras2Use, confidenceDict=confidence,
-                spline3dZeros = True, splineMaxFrames=int(frameRate/5), 
-                nansInOut=nansInOut,CameraDirectories=cameraDirectories,
-                trialName=trialName,startEndFrames=startEndFrames,trialID=trial_id,
-                outputMediaFolder=outputMediaFolder)
+            if cameraSubsets is None:
+                keypoints3D, confidence3D = triangulateMultiviewVideo(
+                    CamParamDict, keypoints2D, ignoreMissingMarkers=False, 
+                    cams2Use=cameras2Use, confidenceDict=confidence,
+                    spline3dZeros = True, splineMaxFrames=int(frameRate/5), 
+                    nansInOut=nansInOut,CameraDirectories=cameraDirectories,
+                    trialName=trialName,startEndFrames=startEndFrames,trialID=trial_id,
+                    outputMediaFolder=outputMediaFolder)
+                keypoints3DSubsets = {None: keypoints3D}
+            else:
+                # All camera subsets at once, without the cameras that were
+                # excluded during synchronization.
+                keypoints3DSubsets, _ = triangulateMultiviewVideoSubsets(
+                    CamParamDict, keypoints2D, 
+                    {subsetName: [cam for cam in cameraSubsets[subsetName] 
+                                  if cam in cameras2Use] 
+                     for subsetName in subsetNames}, 
+                    confidenceDict=confidence,
+                    spline3dZeros = True, splineMaxFrames=int(frameRate/5), 
+                    nansInOut=nansInOut,nansInOutTwoCameras=nansInOutTwoCameras,
+                    CameraDirectories=cameraDirectories,
+                    trialName=trialName,startEndFrames=startEndFrames,trialID=trial_id,
+                    outputMediaFolder=outputMediaFolder)
         except Exception as e:
             if len(e.args) == 2: # specific exception
                 raise Exception(e.args[0], e.args[1])
@@ -362,175 +352,251 @@ def main(sessionName, trialName, trial_id, camerasToUse=['all'],
                 exception = "Triangulation failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed trial."
                 raise Exception(exception, traceback.format_exc())
         
-        # Throw an error if not enough data
-        if keypoints3D.shape[2] < 10:
-            e1 = 'Error - less than 10 good frames of triangulated data.'
-            raise Exception(e1,e1)
-    
-        # Write TRC.
-        writeTRCfrom3DKeypoints(keypoints3D, pathOutputFiles[trialName],
-                                keypointNames, frameRate=frameRate, 
-                                rotationAngles=rotationAngles)
-    
-    # %% Augmentation.
-    
-    # Get augmenter model.
-    augmenterModelName = (
-        sessionMetadata['markerAugmentationSettings']['markerAugmenterModel'])
-    
-    # Set output file name.
-    pathAugmentedOutputFiles = {}
-    if genericFolderNames:
-        pathAugmentedOutputFiles[trialName] = os.path.join(
-                postAugmentationDir, trial_id + ".trc")
-    else:
-        if benchmark:
-            pathAugmentedOutputFiles[trialName] = os.path.join(
-                    postAugmentationDir, trialName + "_" + augmenterModelName +".trc")
+    # %% Outputs of each camera subset (only one outside of validation mode).
+    for subsetName in subsetNames:
+        if subsetName is None:
+            subsetFolderNameSuffix = markerDataFolderNameSuffix
+        elif markerDataFolderNameSuffix is None:
+            subsetFolderNameSuffix = subsetName
         else:
-            pathAugmentedOutputFiles[trialName] = os.path.join(
-                    postAugmentationDir, trial_id + "_" + augmenterModelName +".trc")
-    
-    if runMarkerAugmentation:
-        os.makedirs(postAugmentationDir, exist_ok=True)    
-        augmenterDir = os.path.join(baseDir, "MarkerAugmenter")
-        print('Augmenting marker set')
-        try:
-            vertical_offset = augmentTRC(
-                pathOutputFiles[trialName],sessionMetadata['mass_kg'], 
-                sessionMetadata['height_m'], pathAugmentedOutputFiles[trialName],
-                augmenterDir, augmenterModelName=augmenterModelName,
-                augmenter_model=augmenterModel, offset=offset)
-        except Exception as e:
-            if len(e.args) == 2: # specific exception
-                raise Exception(e.args[0], e.args[1])
-            elif len(e.args) == 1: # generic exception
-                exception = "Marker augmentation failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed trial."
-                raise Exception(exception, traceback.format_exc())
-        if offset:
-            # If offset, no need to offset again for the webapp visualization.
-            # (0.01 so that there is no overall offset, see utilsOpenSim).
-            vertical_offset_settings = float(np.copy(vertical_offset)-0.01)
-            vertical_offset = 0.01   
-        
-    # %% OpenSim pipeline.
-    if runOpenSimPipeline:
-        openSimPipelineDir = os.path.join(baseDir, "opensimPipeline")        
+            subsetFolderNameSuffix = os.path.join(markerDataFolderNameSuffix,
+                                                  subsetName)
         
+        # Create marker folders
+        # Create output folder.
         if genericFolderNames:
-            openSimFolderName = 'OpenSimData'
+            markerDataFolderName = os.path.join('MarkerData') 
         else:
-            openSimFolderName = os.path.join('OpenSimData', 
-                                             poseDetector + suff_pd)
-            if not markerDataFolderNameSuffix is None:
-                openSimFolderName = os.path.join(openSimFolderName,
-                                                 markerDataFolderNameSuffix)
+            if poseDetector == 'mmpose':
+                suff_pd = '_' + str(bbox_thr)
+            elif poseDetector == 'OpenPose':
+                suff_pd = '_' + resolutionPoseDetection
+                
+            markerDataFolderName = os.path.join('MarkerData', 
+                                                poseDetector + suff_pd) 
+            if not subsetFolderNameSuffix is None:
+                markerDataFolderName = os.path.join(markerDataFolderName,
+                                                    subsetFolderNameSuffix)
+        preAugmentationDir = os.path.join(sessionDir, markerDataFolderName,
+                                          'PreAugmentation')
+        os.makedirs(preAugmentationDir, exist_ok=True)
+    
+        # Create augmented marker folders as well
+        if genericFolderNames:
+            postAugmentationDir = os.path.join(sessionDir, markerDataFolderName, 
+                                               'PostAugmentation')
+        else:
+            postAugmentationDir = os.path.join(
+                sessionDir, markerDataFolderName, 
+                'PostAugmentation_{}'.format(augmenterModel))
+        os.makedirs(postAugmentationDir, exist_ok=True)
         
-        openSimDir = os.path.join(sessionDir, openSimFolderName)        
-        outputScaledModelDir = os.path.join(openSimDir, 'Model')
+        # Dump settings in yaml.
+        if not extrinsicsTrial:
+            pathSettings = os.path.join(postAugmentationDir,
+                                        'Settings_' + trial_id + '.yaml')
+            settings = {
+                'poseDetector': poseDetector, 
+                'augmenter_model': augmenterModel, 
+                'imageUpsampleFactor': imageUpsampleFactor,
+                'openSimModel': sessionMetadata['openSimModel']}
+            if poseDetector == 'OpenPose':
+                settings['resolutionPoseDetection'] = resolutionPoseDetection
+            elif poseDetector == 'mmpose':
+                settings['bbox_thr'] = bbox_thr
+            with open(pathSettings, 'w') as file:
+                yaml.dump(settings, file)
 
-        # Check if shoulder model.
-        if 'shoulder' in sessionMetadata['openSimModel']:
-            suffix_model = '_shoulder'
+        # Set output file name.
+        pathOutputFiles = {}
+        if benchmark:
+            pathOutputFiles[trialName] = os.path.join(preAugmentationDir,
+                                                      trialName + ".trc")
         else:
-            suffix_model = ''
+            pathOutputFiles[trialName] = os.path.join(preAugmentationDir,
+                                                      trial_id + ".trc")
+    
+        if runTriangulation:
+            keypoints3D = keypoints3DSubsets[subsetName]
         
-        # Scaling.    
-        if scaleModel:
-            os.makedirs(outputScaledModelDir, exist_ok=True)
-            # Path setup file.
-            genericSetupFile4ScalingName = (
-                'Setup_scaling_RajagopalModified2016_withArms_KA.xml')
-            pathGenericSetupFile4Scaling = os.path.join(
-                openSimPipelineDir, 'Scaling', genericSetupFile4ScalingName)
-            # Path model file.
-            pathGenericModel4Scaling = os.path.join(
-                openSimPipelineDir, 'Models', 
-                sessionMetadata['openSimModel'] + '.osim')            
-            # Path TRC file.
-            pathTRCFile4Scaling = pathAugmentedOutputFiles[trialName]
-            # Get time range.
+            # Throw an error if not enough data
+            if keypoints3D.shape[2] < 10:
+                e1 = 'Error - less than 10 good frames of triangulated data.'
+                raise Exception(e1,e1)
+    
+            # Write TRC.
+            writeTRCfrom3DKeypoints(keypoints3D, pathOutputFiles[trialName],
+                                    keypointNames, frameRate=frameRate, 
+                                    rotationAngles=rotationAngles)
+    
+        # Augmentation.
+    
+        # Get augmenter model.
+        augmenterModelName = (
+            sessionMetadata['markerAugmentationSettings']['markerAugmenterModel'])
+    
+        # Set output file name.
+        pathAugmentedOutputFiles = {}
+        if genericFolderNames:
+            pathAugmentedOutputFiles[trialName] = os.path.join(
+                    postAugmentationDir, trial_id + ".trc")
+        else:
+            if benchmark:
+                pathAugmentedOutputFiles[trialName] = os.path.join(
+                        postAugmentationDir, trialName + "_" + augmenterModelName +".trc")
+            else:
+                pathAugmentedOutputFiles[trialName] = os.path.join(
+                        postAugmentationDir, trial_id + "_" + augmenterModelName +".trc")
+    
+        if runMarkerAugmentation:
+            os.makedirs(postAugmentationDir, exist_ok=True)    
+            augmenterDir = os.path.join(baseDir, "MarkerAugmenter")
+            print('Augmenting marker set')
             try:
-                thresholdPosition = 0.003
-                maxThreshold = 0.015
-                increment = 0.001
-                success = False
-                while thresholdPosition <= maxThreshold and not success:
-                    try:
-                        timeRange4Scaling = getScaleTimeRange(
-                            pathTRCFile4Scaling,
-                            thresholdPosition=thresholdPosition,
-                            thresholdTime=0.1, removeRoot=True)
-                        success = True
-                    except Exception as e:
-                        print(f"Attempt with thresholdPosition {thresholdPosition} failed: {e}")
-                        thresholdPosition += increment  # Increase the threshold for the next iteration
-
-                # Run scale tool.
-                print('Running Scaling')
-                pathScaledModel = runScaleTool(
-                    pathGenericSetupFile4Scaling, pathGenericModel4Scaling,
-                    sessionMetadata['mass_kg'], pathTRCFile4Scaling, 
-                    timeRange4Scaling, outputScaledModelDir,
-                    subjectHeight=sessionMetadata['height_m'], 
-                    suffix_model=suffix_model)
+                vertical_offset = augmentTRC(
+                    pathOutputFiles[trialName],sessionMetadata['mass_kg'], 
+                    sessionMetadata['height_m'], pathAugmentedOutputFiles[trialName],
+                    augmenterDir, augmenterModelName=augmenterModelName,
+                    augmenter_model=augmenterModel, offset=offset)
             except Exception as e:
                 if len(e.args) == 2: # specific exception
                     raise Exception(e.args[0], e.args[1])
                 elif len(e.args) == 1: # generic exception
-                    exception = "Musculoskeletal model scaling failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed neutral pose."
+                    exception = "Marker augmentation failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed trial."
                     raise Exception(exception, traceback.format_exc())
-            # Extract one frame from videos to verify neutral pose.
-            staticImagesFolderDir = os.path.join(sessionDir, 
-                                                 'NeutralPoseImages')
-            os.makedirs(staticImagesFolderDir, exist_ok=True)
-            popNeutralPoseImages(cameraDirectories, cameras2Use, 
-                                 timeRange4Scaling[0], staticImagesFolderDir,
-                                 trial_id, writeVideo = True)   
-            pathOutputIK = pathScaledModel[:-5]+'.mot'     
+            if offset:
+                # If offset, no need to offset again for the webapp visualization.
+                # (0.01 so that there is no overall offset, see utilsOpenSim).
+                vertical_offset_settings = float(np.copy(vertical_offset)-0.01)
+                vertical_offset = 0.01   
+        
+        # OpenSim pipeline.
+        if runOpenSimPipeline:
+            openSimPipelineDir = os.path.join(baseDir, "opensimPipeline")        
+        
+            if genericFolderNames:
+                openSimFolderName = 'OpenSimData'
+            else:
+                openSimFolderName = os.path.join('OpenSimData', 
+                                                 poseDetector + suff_pd)
+                if not subsetFolderNameSuffix is None:
+                    openSimFolderName = os.path.join(openSimFolderName,
+                                                     subsetFolderNameSuffix)
+        
+            openSimDir = os.path.join(sessionDir, openSimFolderName)        
+            outputScaledModelDir = os.path.join(openSimDir, 'Model')
+
+            # Check if shoulder model.
+            if 'shoulder' in sessionMetadata['openSimModel']:
+                suffix_model = '_shoulder'
+            else:
+                suffix_model = ''
         
-        # Inverse kinematics.
-        if not scaleModel:
-            outputIKDir = os.path.join(openSimDir, 'Kinematics')
-            os.makedirs(outputIKDir, exist_ok=True)
-            # Check if there is a scaled model.
-            pathScaledModel = os.path.join(outputScaledModelDir, 
-                                            sessionMetadata['openSimModel'] + 
-                                            "_scaled.osim")
-            if os.path.exists(pathScaledModel):
+            # Scaling.    
+            if scaleModel:
+                os.makedirs(outputScaledModelDir, exist_ok=True)
                 # Path setup file.
-                genericSetupFile4IKName = 'Setup_IK{}.xml'.format(suffix_model)
-                pathGenericSetupFile4IK = os.path.join(
-                    openSimPipelineDir, 'IK', genericSetupFile4IKName)
+                genericSetupFile4ScalingName = (
+                    'Setup_scaling_RajagopalModified2016_withArms_KA.xml')
+                pathGenericSetupFile4Scaling = os.path.join(
+                    openSimPipelineDir, 'Scaling', genericSetupFile4ScalingName)
+                # Path model file.
+                pathGenericModel4Scaling = os.path.join(
+                    openSimPipelineDir, 'Models', 
+                    sessionMetadata['openSimModel'] + '.osim')            
                 # Path TRC file.
-                pathTRCFile4IK = pathAugmentedOutputFiles[trialName]
-                # Run IK tool. 
-                print('Running Inverse Kinematics')
+                pathTRCFile4Scaling = pathAugmentedOutputFiles[trialName]
+                # Get time range.
                 try:
-                    pathOutputIK = runIKTool(
-                        pathGenericSetupFile4IK, pathScaledModel, 
-                        pathTRCFile4IK, outputIKDir)
+                    thresholdPosition = 0.003
+                    maxThreshold = 0.015
+                    increment = 0.001
+                    success = False
+                    while thresholdPosition <= maxThreshold and not success:
+                        try:
+                            timeRange4Scaling = getScaleTimeRange(
+                                pathTRCFile4Scaling,
+                                thresholdPosition=thresholdPosition,
+                                thresholdTime=0.1, removeRoot=True)
+                            success = True
+                        except Exception as e:
+                            print(f"Attempt with thresholdPosition {thresholdPosition} failed: {e}")
+                            thresholdPosition += increment  # Increase the threshold for the next iteration
+
+                    # Run scale tool.
+                    print('Running Scaling')
+                    pathScaledModel = runScaleTool(
+                        pathGenericSetupFile4Scaling, pathGenericModel4Scaling,
+                        sessionMetadata['mass_kg'], pathTRCFile4Scaling, 
+                        timeRange4Scaling, outputScaledModelDir,
+                        subjectHeight=sessionMetadata['height_m'], 
+                        suffix_model=suffix_model)
                 except Exception as e:
                     if len(e.args) == 2: # specific exception
                         raise Exception(e.args[0], e.args[1])
                     elif len(e.args) == 1: # generic exception
-                        exception = "Inverse kinematics failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed trial."
+                        exception = "Musculoskeletal model scaling failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed neutral pose."
                         raise Exception(exception, traceback.format_exc())
-            else:
-                raise ValueError("No scaled model available.")
+                # Extract one frame from videos to verify neutral pose.
+                staticImagesFolderDir = os.path.join(sessionDir, 
+                                                     'NeutralPoseImages')
+                cameras2UseImages = cameras2Use
+                if subsetName is not None:
+                    staticImagesFolderDir = os.path.join(
+                        staticImagesFolderDir, subsetFolderNameSuffix)
+                    cameras2UseImages = [cam for cam in cameraSubsets[subsetName]
+                                         if cam in cameras2Use]
+                os.makedirs(staticImagesFolderDir, exist_ok=True)
+                popNeutralPoseImages(cameraDirectories, cameras2UseImages, 
+                                     timeRange4Scaling[0], staticImagesFolderDir,
+                                     trial_id, writeVideo = True)   
+                pathOutputIK = pathScaledModel[:-5]+'.mot'     
+        
+            # Inverse kinematics.
+            if not scaleModel:
+                outputIKDir = os.path.join(openSimDir, 'Kinematics')
+                os.makedirs(outputIKDir, exist_ok=True)
+                # Check if there is a scaled model.
+                pathScaledModel = os.path.join(outputScaledModelDir, 
+                                                sessionMetadata['openSimModel'] + 
+                                                "_scaled.osim")
+                if os.path.exists(pathScaledModel):
+                    # Path setup file.
+                    genericSetupFile4IKName = 'Setup_IK{}.xml'.format(suffix_model)
+                    pathGenericSetupFile4IK = os.path.join(
+                        openSimPipelineDir, 'IK', genericSetupFile4IKName)
+                    # Path TRC file.
+                    pathTRCFile4IK = pathAugmentedOutputFiles[trialName]
+                    # Run IK tool. 
+                    print('Running Inverse Kinematics')
+                    try:
+                        pathOutputIK = runIKTool(
+                            pathGenericSetupFile4IK, pathScaledModel, 
+                            pathTRCFile4IK, outputIKDir)
+                    except Exception as e:
+                        if len(e.args) == 2: # specific exception
+                            raise Exception(e.args[0], e.args[1])
+                        elif len(e.args) == 1: # generic exception
+                            exception = "Inverse kinematics failed. Verify your setup and try again. Visit https://www.opencap.ai/best-pratices to learn more about data collection and https://www.opencap.ai/troubleshooting for potential causes for a failed trial."
+                            raise Exception(exception, traceback.format_exc())
+                else:
+                    raise ValueError("No scaled model available.")
         
-        # Write body transforms to json for visualization.
-        outputJsonVisDir = os.path.join(sessionDir,'VisualizerJsons',
-                                        trialName)
-        os.makedirs(outputJsonVisDir,exist_ok=True)
-        outputJsonVisPath = os.path.join(outputJsonVisDir,
-                                         trialName + '.json')
-        generateVisualizerJson(pathScaledModel, pathOutputIK,
-                               outputJsonVisPath, 
-                               vertical_offset=vertical_offset)  
+            # Write body transforms to json for visualization.
+            outputJsonVisDir = os.path.join(sessionDir,'VisualizerJsons',
+                                            trialName)
+            if subsetName is not None:
+                outputJsonVisDir = os.path.join(outputJsonVisDir,
+                                                subsetFolderNameSuffix)
+            os.makedirs(outputJsonVisDir,exist_ok=True)
+            outputJsonVisPath = os.path.join(outputJsonVisDir,
+                                             trialName + '.json')
+            generateVisualizerJson(pathScaledModel, pathOutputIK,
+                                   outputJsonVisPath, 
+                                   vertical_offset=vertical_offset)  
         
-    # %% Rewrite settings, adding offset  
-    if not extrinsicsTrial and offset:
-        settings['verticalOffset'] = vertical_offset_settings 
-        with open(pathSettings, 'w') as file:
-            yaml.dump(settings, file)
+        # Rewrite settings, adding offset  
+        if not extrinsicsTrial and offset:
+            settings['verticalOffset'] = vertical_offset_settings 
+            with open(pathSettings, 'w') as file:
+                yaml.dump(settings, file)
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# %% Synthetic cameras looking at a moving person.
+def makeCameraParams(nCams=2):
+    # Cameras at 3 m from the origin, 90 degrees apart.
+    CameraParams = []
+    for i in range(nCams):
+        angle = np.pi * i / 2
+        center = np.array([3000*np.cos(angle), 3000*np.sin(angle), 1000])
+        z = -center / np.linalg.norm(center)
+        x = np.cross([0, 0, 1], z)
+        x /= np.linalg.norm(x)
+        R = np.stack([x, np.cross(z, x), z])
+        CameraParams.append({
+            'intrinsicMat': np.array([[1400., 0, 540], [0, 1400., 960],
+                                      [0, 0, 1]]),
+            'rotation': R, 'translation': (-R @ center).reshape(3, 1),
+            'distortion': np.zeros((1, 5)),
+            'imageSize': np.array([[1920], [1080]])})
+    return CameraParams
+
+def makeKeypoints(CameraParams, confRanges, nFrames=200, fps=60, nMkrs=25,
+                  lags=None):
+    # Keypoints of the same motion in all cameras, with confidence 0.9 
+    # within confRanges and 0 elsewhere. Camera i sees frame f of the motion
+    # at frame f - lags[i] (0 by default).
+    rng = np.random.default_rng(0)
+    if lags is None:
+        lags = np.zeros(len(CameraParams), dtype=int)
+    nMotion = nFrames + 2*np.max(np.abs(lags))
+    t = (np.arange(nMotion) - np.max(np.abs(lags))) / fps
+    base = rng.normal(0, 150, (nMkrs, 3))
+    base[:, 2] = np.linspace(1700, 0, nMkrs)
+    points3D = base[:, None, :] + np.stack(
+        [300*np.sin(2*np.pi*t), 100*np.cos(np.pi*t), 50*np.sin(t)], -1)[None]
+    keypointList, confidenceList = [], []
+    for params, confRange, lag in zip(CameraParams, confRanges, lags):
+        start = np.max(np.abs(lags)) + lag
+        points2D, _ = cv2.projectPoints(
+            points3D[:, start:start+nFrames].reshape(-1, 3), 
+            cv2.Rodrigues(params['rotation'])[0], params['translation'], 
+            params['intrinsicMat'], params['distortion'])
+        confidence = np.zeros((nMkrs, nFrames))
+        confidence[:, confRange[0]:confRange[1]] = 0.9
+        keypointList.append(points2D.reshape(nMkrs, nFrames, 2))
+        confidenceList.append(confidence)
+    return keypointList, confidenceList
+
+
+# %% Fixtures.
+@pytest.fixture
+def cameraParamsFactory():
+    return makeCameraParams
+
+@pytest.fixture
+def keypointsFactory():
+    return makeKeypoints
+
+@pytest.fixture
+def cameraParams():
+    return makeCameraParams()
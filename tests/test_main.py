@@ -0,0 +1,142 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import yaml
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('opensim')
+
+import main
+import utilsChecker
+from utils import getOpenPoseMarkerNames
+from utilsChecker import (saveCameraParameters, clean2Dkeypoints,
+                          MultiCamKeypoints)
+from conftest import makeCameraParams, makeKeypoints
+
+
+# %% Session with 3 calibrated cameras, and a trial with their keypoints.
+# Pose detection, synchronization, augmentation and the OpenSim tools are
+# replaced by stubs.
+cameras = ['Cam0', 'Cam1', 'Cam2']
+trialName, trial_id = 'walking', 'trial0'
+
+def makeSession(dataDir):
+    sessionDir = os.path.join(dataDir, 'Data', 'session')
+    metadata = {
+        'checkerBoard': {'black2BlackCornersWidth_n': 4, 
+                         'black2BlackCornersHeight_n': 5,
+                         'squareSideLength_mm': 35, 'placement': 'backWall'},
+        'iphoneModel': {cam: 'iPhone13,3' for cam in cameras},
+        'openSimModel': 'LaiUhlrich2022', 'mass_kg': 70, 'height_m': 1.8,
+        'markerAugmentationSettings': {'markerAugmenterModel': 'LSTM'}}
+    os.makedirs(sessionDir)
+    with open(os.path.join(sessionDir, 'sessionMetadata.yaml'), 'w') as f:
+        yaml.dump(metadata, f)
+    for cam, CameraParams in zip(cameras, makeCameraParams(3)):
+        camDir = os.path.join(sessionDir, 'Videos', cam)
+        saveCameraParameters(
+            os.path.join(camDir, 'cameraIntrinsicsExtrinsics.pickle'), 
+            CameraParams)
+        videoDir = os.path.join(camDir, 'OutputMedia_default', trialName)
+        os.makedirs(videoDir)
+        open(os.path.join(videoDir, trial_id + '.avi'), 'w').close()
+    return sessionDir
+
+def fakeSynchronizeVideos(CameraDirectories, trialRelativePath, 
+                          pathPoseDetector, cams2Use=['all'], 
+                          confidenceThreshold=0.3, nansInOutTwoCameras=None,
+                          **kwargs):
+    # Synchronized keypoints of cameras without lags: the keypoints cleaned
+    # for the number of cameras (see synchronizeVideoKeypoints).
+    keypointList, confidenceList = makeKeypoints(
+        makeCameraParams(3), [[10, 190], [0, 180], [20, 200]])
+    for iCam, confidence in enumerate(confidenceList):
+        confidence[iCam:iCam+4, 60+10*iCam:80+10*iCam] = 0.1
+    iCams = [cameras.index(cam) for cam in cams2Use]
+    cleaned = [clean2Dkeypoints(keypointList[i], confidenceList[i], 
+                                confidenceThreshold, nCams=len(cams2Use))
+               for i in iCams]
+    keypoints = MultiCamKeypoints.fromLists(
+        [key2D for key2D, _, _, _ in cleaned], 
+        [confidence for _, confidence, _, _ in cleaned], cams2Use)
+    if nansInOutTwoCameras is not None:
+        nansInOutTwoCameras.update(
+            (cam, clean2Dkeypoints(keypointList[i], confidenceList[i], 
+                                   confidenceThreshold, nCams=2)[2]) 
+            for cam, i in zip(cams2Use, iCams))
+    return (keypoints, keypoints.confidenceDict(), getOpenPoseMarkerNames(),
+            60, {cam: nansInOut for cam, (_, _, nansInOut, _) in 
+                 zip(cams2Use, cleaned)}, 
+            {cam: [0, 199] for cam in cams2Use}, cams2Use)
+
+@pytest.fixture
+def runMain(monkeypatch):
+    calls = {name: [] for name in ['rewriteVideos', 'popNeutralPoseImages',
+                                   'generateVisualizerJson']}
+    def record(name, output=None):
+        def stub(*args, **kwargs):
+            calls[name].append(args)
+            return output
+        return stub
+    def augmentTRC(pathInputTRC, mass, height, pathOutputTRC, *args, 
+                   **kwargs):
+        shutil.copyfile(pathInputTRC, pathOutputTRC)
+        return 0.1
+    def runScaleTool(*args, **kwargs):
+        return os.path.join(args[5], 'LaiUhlrich2022_scaled.osim')
+    monkeypatch.setattr(main, 'runPoseDetector', lambda *args, **kwargs: '')
+    monkeypatch.setattr(main, 'synchronizeVideos', fakeSynchronizeVideos)
+    monkeypatch.setattr(main, 'augmentTRC', augmentTRC)
+    monkeypatch.setattr(main, 'getScaleTimeRange', 
+                        lambda *args, **kwargs: [0, 0.5])
+    monkeypatch.setattr(main, 'runScaleTool', runScaleTool)
+    for name in ['popNeutralPoseImages', 'generateVisualizerJson']:
+        monkeypatch.setattr(main, name, record(name))
+    monkeypatch.setattr(utilsChecker, 'rewriteVideos', record('rewriteVideos'))
+    
+    def run(dataDir, **kwargs):
+        sessionDir = makeSession(str(dataDir))
+        main.main('session', trialName, trial_id, dataDir=str(dataDir), 
+                  scaleModel=True, **kwargs)
+        return sessionDir, calls
+    return run
+
+def loadTRC(sessionDir, subsetName=None):
+    markerDataDir = os.path.join(sessionDir, 'MarkerData', 'OpenPose_default')
+    if subsetName is not None:
+        markerDataDir = os.path.join(markerDataDir, subsetName)
+    return np.loadtxt(os.path.join(markerDataDir, 'PreAugmentation', 
+                                   trial_id + '.trc'), skiprows=5)
+
+
+# %% Validation mode gives the outputs of separate trials with the cameras
+# of each subset.
+def test_mainValidationMode(tmp_path, runMain):
+    subsets = {'2-cameras': ['Cam0', 'Cam1'], '3-cameras': cameras}
+    sessionDir, calls = runMain(tmp_path / 'subsets', cameraSubsets=subsets)
+    calls = {name: list(args) for name, args in calls.items()}
+    
+    # Per subset outputs.
+    assert [args[1] for args in calls['popNeutralPoseImages']] == [
+        subsets['2-cameras'], subsets['3-cameras']]
+    for args, subsetName in zip(calls['popNeutralPoseImages'], subsets):
+        assert args[3] == os.path.join(sessionDir, 'NeutralPoseImages', 
+                                       subsetName)
+    for args, subsetName in zip(calls['generateVisualizerJson'], subsets):
+        assert args[2] == os.path.join(sessionDir, 'VisualizerJsons', 
+                                       trialName, subsetName, 
+                                       trialName + '.json')
+    
+    # Synchronized videos are only written once, with the frames of the 
+    # last subset.
+    assert len(calls['rewriteVideos']) == 3
+    assert all(args[2] == len(loadTRC(sessionDir, '3-cameras')) 
+               for args in calls['rewriteVideos'])
+    
+    for subsetName, subsetCameras in subsets.items():
+        sessionDirSubset, _ = runMain(tmp_path / subsetName, 
+                                      camerasToUse=subsetCameras)
+        np.testing.assert_allclose(loadTRC(sessionDir, subsetName),
+                                   loadTRC(sessionDirSubset), atol=1e-3)
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import utilsChecker
+
+
+# %% Synthetic audio: the same clicks recorded by cameras that start at
+# different times.
+sampleRate = 16000
+frameRate = 60
+
+def recordAudio(startTimes, duration=8., seed=0):
+    rng = np.random.default_rng(seed)
+    sound = rng.normal(0, .01, int((np.max(startTimes) + duration + 1) * 
+                                   sampleRate))
+    nClick = int(.02 * sampleRate)
+    for clickTime in rng.uniform(.5, len(sound)/sampleRate - .5, 25):
+        iClick = int(clickTime * sampleRate)
+        sound[iClick:iClick+nClick] += (rng.normal(0, .5, nClick) * 
+                                        np.exp(-np.arange(nClick) / 300))
+    return [sound[int(startTime*sampleRate):
+                  int((startTime+duration)*sampleRate)] + 
+            rng.normal(0, .01, int(duration*sampleRate)) 
+            for startTime in startTimes]
+
+
+# %% Tests.
+def test_getAudioLags():
+    # Sub-frame offsets between the cameras, and audio tracks that start
+    # after the first video frame.
+    videoStartTimes = np.array([.3, .3837, .24877, 1.5311])
+    audioOffsets = [0., .01, -.02, 0.]
+    audioList = recordAudio(videoStartTimes + audioOffsets)
+    lags = utilsChecker.getAudioLags(audioList, audioOffsets, frameRate,
+                                     sampleRate=sampleRate)
+    expectedLags = (videoStartTimes[0] - videoStartTimes) * frameRate
+    assert np.allclose(lags, expectedLags, atol=.1)
+
+def test_getAudioLagsWithoutAudio():
+    audioList = recordAudio([.3, .4])
+    lags = utilsChecker.getAudioLags(
+        [audioList[0], None, np.random.default_rng(1).normal(0, .01, 8*sampleRate)],
+        [0., None, 0.], frameRate, sampleRate=sampleRate)
+    assert lags == [0., None, None]
+    assert utilsChecker.getAudioLags([None, audioList[1]], [None, 0.], 
+                                     frameRate) == [None, None]
+
+
+# %% loadAudioTrack with ffprobe and ffmpeg replaced.
+class FakeFfmpegStream:
+    def __init__(self, calls, out=None, error=False):
+        self.calls, self.out, self.error = calls, out, error
+    def output(self, *args, **kwargs):
+        self.calls['output'] = (args, kwargs)
+        return self
+    def run(self, **kwargs):
+        self.calls['run'] = kwargs
+        if self.error:
+            raise utilsChecker.ffmpeg.Error('ffmpeg', b'', b'')
+        return self.out, b''
+
+@pytest.fixture
+def fakeVideo(monkeypatch):
+    def setup(streams, audio=None, error=False):
+        calls = {}
+        monkeypatch.setattr(utilsChecker, 'probeVideo', 
+                            lambda videoPath: {'streams': streams})
+        def fakeInput(videoPath):
+            calls['input'] = videoPath
+            return FakeFfmpegStream(
+                calls, None if audio is None else audio.tobytes(), error)
+        monkeypatch.setattr(utilsChecker.ffmpeg, 'input', fakeInput)
+        return calls
+    return setup
+
+def test_loadAudioTrack(fakeVideo):
+    audio = np.linspace(-1, 1, 1000, dtype=np.float32)
+    calls = fakeVideo([{'codec_type': 'video', 'start_time': '0.033000'},
+                       {'codec_type': 'audio', 'start_time': '0.012000'}],
+                      audio)
+    audioOut, audioOffset = utilsChecker.loadAudioTrack('video.mov', 
+                                                        sampleRate=8000)
+    assert np.array_equal(audioOut, audio)
+    assert audioOffset == pytest.approx(-.021)
+    # Raw mono float32 samples at the requested sample rate, from stdout.
+    args, kwargs = calls['output']
+    assert args == ('pipe:',)
+    assert kwargs['format'] == 'f32le' and kwargs['ac'] == 1
+    assert kwargs['ar'] == 8000
+    assert calls['run']['capture_stdout']
+
+def test_loadAudioTrackWithoutAudio(fakeVideo):
+    fakeVideo([{'codec_type': 'video', 'start_time': '0'}])
+    assert utilsChecker.loadAudioTrack('video.mov') == (None, None)
+    # Missing start times count as 0.
+    audio = np.zeros(10, dtype=np.float32)
+    fakeVideo([{'codec_type': 'video'}, {'codec_type': 'audio', 
+                                         'start_time': '0.5'}], audio)
+    assert utilsChecker.loadAudioTrack('video.mov')[1] == .5
+    # Decoding errors.
+    fakeVideo([{'codec_type': 'video'}, {'codec_type': 'audio'}], 
+              error=True)
+    assert utilsChecker.loadAudioTrack('video.mov') == (None, None)
@@ -0,0 +1,128 @@
+import io
+import contextlib
+
+import numpy as np
+import pytest
+
+from utilsCameraPy3 import CameraRig
+from utilsChecker import (syncLagFromPrior, prepareReprojectionForSync,
+                          synchronizeVideoKeypoints, loadSyncLags, 
+                          saveSyncLags)
+
+
+# %% Correlation curve with peaks at the given lags.
+corrLags = np.arange(-100, 101)
+
+def makeCorrelation(peakLags, peakCorrs):
+    return np.sum([peakCorr * np.exp(-(corrLags - peakLag)**2 / 50) 
+                   for peakLag, peakCorr in zip(peakLags, peakCorrs)], axis=0)
+
+
+# %% syncLagFromPrior.
+def test_syncLagFromPrior():
+    corr = makeCorrelation([10, 70], [.9, .8])
+    corrPeak, lag = syncLagFromPrior(corr, corrLags, 12, 12)
+    assert lag == 10 and corrPeak == pytest.approx(.9, abs=1e-3)
+    # The other peak, if the prior is close to it.
+    assert syncLagFromPrior(corr, corrLags, 65, 12)[1] == 70
+
+def test_syncLagFromPriorFallback():
+    corr = makeCorrelation([10, 70], [.9, .8])
+    # Best lag on the edge of the window: no local peak in the window.
+    assert syncLagFromPrior(corr, corrLags, 30, 12) == (None, None)
+    # Peak weaker than minCorr.
+    assert syncLagFromPrior(.5*corr, corrLags, 12, 12) == (None, None)
+    assert syncLagFromPrior(.5*corr, corrLags, 12, 12, 
+                            minCorr=.4)[1] == 10
+    # No correlation (e.g., no keypoints in a camera).
+    assert syncLagFromPrior(None, None, 12, 12) == (None, None)
+
+def test_syncLagFromPriorReprojection(cameraParams, keypointsFactory):
+    # Periodic motion: correlation peaks every 60 frames, the cameras are
+    # synced at lag 0. The peak of the prior is only used if its 
+    # reprojection error is clearly smaller than at the closest other peaks.
+    keypointList, confidenceList = keypointsFactory(cameraParams,
+                                                    [[0, 200], [0, 200]])
+    reprojData = prepareReprojectionForSync(
+        CameraRig.from_camera_params(cameraParams), keypointList, [0, 1],
+        confidenceList)
+    corr = makeCorrelation([-60, 0, 60], [.8, .8, .8])
+    assert syncLagFromPrior(corr, corrLags, 3, 12, 
+                            dataForReproj=reprojData)[1] == 0
+    assert syncLagFromPrior(corr, corrLags, 57, 12, 
+                            dataForReproj=reprojData) == (None, None)
+
+
+# %% Prior in synchronizeVideoKeypoints.
+def syncWithPrior(cameraParams, keypointsFactory, lagPrior):
+    keypointList, confidenceList = keypointsFactory(
+        cameraParams, [[0, 400], [0, 400]], nFrames=400, lags=[0, 5])
+    cameras2Use = ['Cam0', 'Cam1']
+    syncLags = {}
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        synchronizeVideoKeypoints(
+            keypointList, confidenceList, confidenceThreshold=0.4,
+            sampleFreq=60, maxShiftSteps=120, CameraParams=cameraParams,
+            cameras2Use=cameras2Use, 
+            CameraDirectories={cam: '' for cam in cameras2Use},
+            syncLags=syncLags, lagPrior=lagPrior)
+    return syncLags, 'Used the session lag prior' in log.getvalue()
+
+def test_lagPrior(cameraParams, keypointsFactory):
+    syncLags, usedPrior = syncWithPrior(cameraParams, keypointsFactory, None)
+    assert not usedPrior
+    assert syncLags['reference'] == 'Cam0' and syncLags['frameRate'] == 60
+    assert syncLags['confidence']['Cam1'] >= .5
+    
+    # Prior from the same cameras.
+    syncLagsPrior, usedPrior = syncWithPrior(
+        cameraParams, keypointsFactory, syncLags)
+    assert usedPrior
+    assert syncLagsPrior['lags'] == syncLags['lags']
+    
+@pytest.mark.parametrize('key, value', [
+    ('reference', 'Cam1'), ('frameRate', 30), ('confidence', {'Cam1': .4})])
+def test_lagPriorNotUsed(cameraParams, keypointsFactory, key, value):
+    # Other reference camera or frame rate, or weak correlation at the 
+    # prior lag: the prior is not used.
+    syncLags, _ = syncWithPrior(cameraParams, keypointsFactory, None)
+    lagPrior = dict(syncLags, **{key: value})
+    _, usedPrior = syncWithPrior(cameraParams, keypointsFactory, lagPrior)
+    assert not usedPrior
+
+
+# %% Saved lags.
+def test_saveSyncLags(tmp_path):
+    syncLagsPath = str(tmp_path / 'syncLags.pickle')
+    assert loadSyncLags(syncLagsPath) is None
+    
+    lagPrior = {'reference': 'Cam0', 'frameRate': 60, 
+                'lags': {'Cam1': 4, 'Cam2': -7}, 
+                'confidence': {'Cam1': .8, 'Cam2': .9}}
+    saveSyncLags(syncLagsPath, lagPrior)
+    assert loadSyncLags(syncLagsPath) == lagPrior
+    
+    # Cam2 was not synced in this trial: its lag is kept.
+    syncLags = {'reference': 'Cam0', 'frameRate': 60, 'lags': {'Cam1': 5},
+                'confidence': {'Cam1': .7}}
+    saveSyncLags(syncLagsPath, syncLags, lagPrior=loadSyncLags(syncLagsPath))
+    assert loadSyncLags(syncLagsPath) == {
+        'reference': 'Cam0', 'frameRate': 60, 
+        'lags': {'Cam1': 5, 'Cam2': -7}, 
+        'confidence': {'Cam1': .7, 'Cam2': .9}}
+
+@pytest.mark.parametrize('key, value', [('reference', 'Cam1'), 
+                                        ('frameRate', 30)])
+def test_saveSyncLagsOtherSetup(tmp_path, key, value):
+    # Lags relative to another reference camera or at another frame rate
+    # are not kept.
+    syncLagsPath = str(tmp_path / 'syncLags.pickle')
+    lagPrior = {'reference': 'Cam0', 'frameRate': 60, 
+                'lags': {'Cam1': 4, 'Cam2': -7}, 
+                'confidence': {'Cam1': .8, 'Cam2': .9}}
+    syncLags = {'reference': 'Cam0', 'frameRate': 60, 'lags': {'Cam1': 5},
+                'confidence': {'Cam1': .7}}
+    syncLags[key] = value
+    saveSyncLags(syncLagsPath, dict(syncLags), lagPrior=lagPrior)
+    assert loadSyncLags(syncLagsPath) == syncLags
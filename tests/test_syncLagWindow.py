@@ -0,0 +1,69 @@
+import io
+import contextlib
+
+import pytest
+
+import utilsChecker
+
+
+# %% Sync of two cameras with a lag window from the video start times, with
+# the correlation search replaced by fixed lags: the lower edge ('min') or
+# the middle ('mid') of the window, and fullLag for the full window.
+def syncWithLagWindow(monkeypatch, CameraParams, keypointsFactory, windowLag,
+                      checkPasses, fullLag=9):
+    searchedWindows = []
+    def fakeSearch(*args, maxLag=None, dataForReproj=None, **kwargs):
+        searchedWindows.append(maxLag)
+        if isinstance(maxLag, tuple):
+            return 1.0, maxLag[0] if windowLag == 'min' else sum(maxLag)//2
+        return 1.0, fullLag
+    
+    # Only the lag searches (with dataForReproj) are replaced, not the 
+    # correlations used to detect the activity.
+    for name in ['cross_corr', 'cross_corr_multiple_timeseries']:
+        original = getattr(utilsChecker, name)
+        def patched(*args, _original=original, **kwargs):
+            if kwargs.get('dataForReproj') is not None:
+                return fakeSearch(*args, **kwargs)
+            return _original(*args, **kwargs)
+        monkeypatch.setattr(utilsChecker, name, patched)
+    monkeypatch.setattr(utilsChecker, 'checkSyncLag', 
+                        lambda *args, **kwargs: checkPasses)
+    
+    keypointList, confidenceList = keypointsFactory(CameraParams,
+                                                    [[0, 200], [0, 200]])
+    cameras2Use = ['Cam0', 'Cam1']
+    syncLags = {}
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        utilsChecker.synchronizeVideoKeypoints(
+            keypointList, confidenceList, confidenceThreshold=0.4,
+            sampleFreq=60, maxShiftSteps=120, CameraParams=CameraParams,
+            cameras2Use=cameras2Use, 
+            CameraDirectories={cam: '' for cam in cameras2Use},
+            syncLags=syncLags,
+            videoStartTimes={'Cam0': (100., 1e-3), 'Cam1': (100., 1e-3)})
+        
+    return syncLags['lags']['Cam1'], searchedWindows, log.getvalue()
+
+
+# %% Tests.
+@pytest.mark.parametrize('windowLag, checkPasses', 
+                         [('min', True), ('mid', False)])
+def test_fallbackToFullLagWindow(monkeypatch, cameraParams, keypointsFactory,
+                                 windowLag, checkPasses):
+    # Lag on the edge of the start time window, or not passing the
+    # reprojection check: the full lag window is searched.
+    lag, searchedWindows, log = syncWithLagWindow(
+        monkeypatch, cameraParams, keypointsFactory, windowLag, checkPasses)
+    assert lag == 9
+    assert isinstance(searchedWindows[0], tuple)
+    assert not isinstance(searchedWindows[-1], tuple)
+    assert 'Using the full lag window' in log
+
+def test_lagWithinWindow(monkeypatch, cameraParams, keypointsFactory):
+    lag, searchedWindows, log = syncWithLagWindow(
+        monkeypatch, cameraParams, keypointsFactory, 'mid', True)
+    assert lag == 0
+    assert len(searchedWindows) == 1
+    assert 'Using the full lag window' not in log
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from utilsCameraPy3 import CameraRig
+from utilsChecker import (prepareReprojectionForSync,
+                          calcReprojectionErrorsForSync, checkSyncLag)
+
+
+# %% Fixtures.
+@pytest.fixture
+def shortWindowReprojData(cameraParams, keypointsFactory):
+    # The second camera only sees the person confidently for 40 frames.
+    keypointList, confidenceList = keypointsFactory(cameraParams,
+                                                    [[5, 200], [20, 60]])
+    return prepareReprojectionForSync(
+        CameraRig.from_camera_params(cameraParams), keypointList, [0, 1],
+        confidenceList)
+
+
+# %% Tests.
+def test_lagsWithoutOverlapAreNotScored(shortWindowReprojData):
+    reprojError, reprojSuccess = calcReprojectionErrorsForSync(
+        shortWindowReprojData, [-180, 0, 150, 190, -150])
+    assert list(reprojSuccess) == [False, True, False, False, True]
+    assert np.all(reprojError[~reprojSuccess] == 1000)
+    assert reprojError[1] < 1e-3
+
+def test_checkSyncLagWithLargeGrid(shortWindowReprojData):
+    # Most grid lags cannot be scored, they are left out of the check.
+    assert checkSyncLag(shortWindowReprojData, 0, 60, 180)
+    assert not checkSyncLag(shortWindowReprojData, 15, 60, 180)
+    # No overlap at the lag itself.
+    assert not checkSyncLag(shortWindowReprojData, 150, 60, 180)
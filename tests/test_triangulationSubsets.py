@@ -0,0 +1,107 @@
+import numpy as np
+
+from utilsChecker import (clean2Dkeypoints, confidenceToTwoCameras, 
+                          getNansInOut, synchronizeVideoKeypoints,
+                          triangulateMultiviewVideo,
+                          triangulateMultiviewVideoSubsets)
+
+
+# %% 3 cameras with different lags and confidence ranges, and frames with 
+# low confidence within these ranges.
+def makeTrial(cameraParamsFactory, keypointsFactory):
+    CameraParams = cameraParamsFactory(3)
+    keypointList, confidenceList = keypointsFactory(
+        CameraParams, [[20, 380], [0, 370], [30, 400]], nFrames=400, 
+        lags=[0, 5, -4])
+    for iCam, confidence in enumerate(confidenceList):
+        confidence[iCam:iCam+4, 100+10*iCam:120+10*iCam] = 0.1
+    return CameraParams, keypointList, confidenceList
+
+
+# %% nansInOut of 2 cameras from confidences cleaned for more cameras.
+def test_nansInOutTwoCameras(cameraParamsFactory, keypointsFactory):
+    _, keypointList, confidenceList = makeTrial(cameraParamsFactory, 
+                                                keypointsFactory)
+    for key2D, confidence in zip(keypointList, confidenceList):
+        _, confidenceMoreCams, nansInOut, _ = clean2Dkeypoints(
+            key2D, confidence, confidenceThreshold=0.4, nCams=3)
+        assert np.all(np.isnan(nansInOut))
+        _, confidenceTwoCams, nansInOutTwoCams, _ = clean2Dkeypoints(
+            key2D, confidence, confidenceThreshold=0.4, nCams=2)
+        np.testing.assert_array_equal(
+            getNansInOut(confidenceToTwoCameras(confidenceMoreCams)), 
+            nansInOutTwoCams)
+
+
+# %% A subset of 2 cameras is trimmed like a trial with these 2 cameras.
+def test_subsetTwoCameras(cameraParamsFactory, keypointsFactory):
+    CameraParams, keypointList, confidenceList = makeTrial(
+        cameraParamsFactory, keypointsFactory)
+    cameras = ['Cam0', 'Cam1', 'Cam2']
+    nansInOutTwoCameras = []
+    keypointsSync, confidenceSync, nansInOut, _ = synchronizeVideoKeypoints(
+        keypointList, confidenceList, confidenceThreshold=0.4, 
+        sampleFreq=60, maxShiftSteps=120, CameraParams=CameraParams,
+        cameras2Use=cameras, CameraDirectories={cam: '' for cam in cameras},
+        nansInOutTwoCameras=nansInOutTwoCameras)
+    CameraParamDict = dict(zip(cameras, CameraParams))
+    keypointDict = dict(zip(cameras, keypointsSync))
+    confidenceDict = dict(zip(cameras, confidenceSync))
+    nansInOut = dict(zip(cameras, nansInOut))
+    nansInOutTwoCameras = dict(zip(cameras, nansInOutTwoCameras))
+    
+    subsets = {'2-cameras': ['Cam0', 'Cam1'], '3-cameras': cameras}
+    points3DSubsets, _ = triangulateMultiviewVideoSubsets(
+        CameraParamDict, keypointDict, subsets, confidenceDict=confidenceDict,
+        nansInOut=nansInOut, nansInOutTwoCameras=nansInOutTwoCameras,
+        spline3dZeros=True, splineMaxFrames=12)
+    
+    points3D, _ = triangulateMultiviewVideo(
+        CameraParamDict, keypointDict, cams2Use=subsets['2-cameras'],
+        confidenceDict={cam: confidenceToTwoCameras(confidenceDict[cam]) 
+                        for cam in subsets['2-cameras']},
+        nansInOut={cam: nansInOutTwoCameras[cam] 
+                   for cam in subsets['2-cameras']},
+        spline3dZeros=True, splineMaxFrames=12)
+    np.testing.assert_allclose(points3DSubsets['2-cameras'], points3D, 
+                               atol=1e-6)
+    
+    # Only the nansInOut of 2 cameras are set when syncing more cameras.
+    assert all(np.all(np.isnan(nansInOut[cam])) for cam in cameras)
+    assert all(np.all(np.isfinite(nansInOutTwoCameras[cam])) 
+               for cam in cameras)
+    points3DMoreCameras, _ = triangulateMultiviewVideoSubsets(
+        CameraParamDict, keypointDict, subsets, confidenceDict=confidenceDict,
+        nansInOut=nansInOut, spline3dZeros=True, splineMaxFrames=12)
+    np.testing.assert_allclose(points3DSubsets['3-cameras'], 
+                               points3DMoreCameras['3-cameras'])
+
+def test_subsetTwoCamerasTrimming(cameraParamsFactory, keypointsFactory):
+    # nansInOut within the frames seen by the 2 cameras trim the subset of
+    # 2 cameras only.
+    CameraParams, keypointList, confidenceList = makeTrial(
+        cameraParamsFactory, keypointsFactory)
+    cameras = ['Cam0', 'Cam1', 'Cam2']
+    CameraParamDict = dict(zip(cameras, CameraParams))
+    keypointDict = dict(zip(cameras, keypointList))
+    confidenceDict = {cam: clean2Dkeypoints(key2D, confidence, nCams=3)[1] 
+                      for cam, key2D, confidence in zip(
+                          cameras, keypointList, confidenceList)}
+    nansInOutTwoCameras = {'Cam0': np.array([50., 300.]), 
+                           'Cam1': np.array([60., 320.]), 
+                           'Cam2': np.array([0., 399.])}
+    subsets = {'2-cameras': ['Cam0', 'Cam1'], '3-cameras': cameras}
+    points3DSubsets, _ = triangulateMultiviewVideoSubsets(
+        CameraParamDict, keypointDict, subsets, confidenceDict=confidenceDict,
+        nansInOutTwoCameras=nansInOutTwoCameras)
+    
+    points3D, _ = triangulateMultiviewVideo(
+        CameraParamDict, keypointDict, cams2Use=subsets['2-cameras'],
+        confidenceDict={cam: confidenceToTwoCameras(confidenceDict[cam]) 
+                        for cam in subsets['2-cameras']},
+        nansInOut={cam: nansInOutTwoCameras[cam] 
+                   for cam in subsets['2-cameras']})
+    assert points3DSubsets['2-cameras'].shape[2] == 300 - 60
+    np.testing.assert_allclose(points3DSubsets['2-cameras'], points3D, 
+                               atol=1e-6)
+    assert points3DSubsets['3-cameras'].shape[2] > 300 - 60
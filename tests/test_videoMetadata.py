@@ -0,0 +1,28 @@
+import os
+
+import utilsChecker
+
+
+# %% Tests.
+def test_probeVideoCache(monkeypatch, tmp_path):
+    probedPaths = []
+    def probe(videoPath):
+        probedPaths.append(videoPath)
+        return {'streams': [], 'format': {}}
+    monkeypatch.setattr(utilsChecker.ffmpeg, 'probe', probe)
+    utilsChecker.probeVideoCached.cache_clear()
+    
+    videoPath = tmp_path / 'video.mov'
+    videoPath.write_bytes(b'')
+    utilsChecker.probeVideo(str(videoPath))
+    utilsChecker.probeVideo(str(videoPath))
+    assert len(probedPaths) == 1
+    
+    # A rewritten video is probed again.
+    os.utime(videoPath, (0, 1000))
+    utilsChecker.probeVideo(str(videoPath))
+    assert len(probedPaths) == 2
+    
+    # The cache is bounded.
+    assert utilsChecker.probeVideoCached.cache_info().maxsize is not None
+    utilsChecker.probeVideoCached.cache_clear()
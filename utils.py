@@ -1117,6 +1117,16 @@ def lowpassFilter(inputData, filtFreq, order=4):
 
     return data
 
+
+def getSlidingWindowExtent(data, windowLength):
+    # Extent (max - min) of each column of data (nFrames x nColumns) over all
+    # windows of windowLength consecutive frames, at once. Returns
+    # (nFrames - windowLength + 1) x nColumns, with nan for windows with nans.
+    windows = np.lib.stride_tricks.sliding_window_view(data, windowLength,
+                                                       axis=0)
+    
+    return np.max(windows, axis=-1) - np.min(windows, axis=-1)
+
         
 def TRC2numpy(pathFile, markers,rotation=None):
     # rotation is a dict, eg. {'y':90} with axis, angle for rotation
@@ -665,8 +665,9 @@ class Camera:
             if world.shape[0] == 4:
                 world = p2e(world)
             if self.calibration_type == 'opencv':
-                distorted_image_coords = cv2.projectPoints(world.T, self.R, self.t,
-                                                           self.K, self.opencv_dist_coeff)[0].reshape(-1, 2).T
+                distorted_image_coords = project_points_batch(
+                    self.K[np.newaxis], self.R[np.newaxis], self.t[np.newaxis], world.T,
+                    distortion=None if self.opencv_dist_coeff is None else self.opencv_dist_coeff.reshape(1, -1))[0].T
             else:
                 distorted_image_coords = cv2.fisheye.projectPoints(
                         world.T.reshape((1, -1, 3)), cv2.Rodrigues(self.R)[0],
@@ -793,6 +794,144 @@ class Camera:
         return np.transpose(null_space)
 
 
+class CameraRig:
+    """
+    Immutable set of calibrated pinhole cameras, built once per trial
+        - stacked camera matrices, intrinsics, distortion and camera centers as contiguous arrays
+        - vectorized projection of world points to all cameras
+        - vectorized undistortion of image points
+        - batched weighted triangulation
+    """
+
+    def __init__(self, K, R, t, distortion=None, names=None):
+        """
+        :param K: intrinsic camera parameters
+        :type K: numpy.ndarray, shape=(n, 3, 3)
+        :param R: camera rotations
+        :type R: numpy.ndarray, shape=(n, 3, 3)
+        :param t: camera translations
+        :type t: numpy.ndarray, shape=(n, 3) or (n, 3, 1)
+        :param distortion: OpenCV distortion coefficients, None for no distortion
+        :type distortion: numpy.ndarray, shape=(n, k)
+        :param names: camera names, e.g. ['Cam0', 'Cam1']
+        :type names: sequence
+        """
+        K = np.ascontiguousarray(K, dtype=float)
+        R = np.ascontiguousarray(R, dtype=float)
+        t = np.ascontiguousarray(np.reshape(t, (-1, 3, 1)), dtype=float)
+        n_cams = K.shape[0]
+        if distortion is None:
+            distortion = np.zeros((n_cams, 5))
+        distortion = np.ascontiguousarray(distortion, dtype=float)
+        if names is None:
+            names = range(n_cams)
+        arrays = {'K': K,
+                  'R': R,
+                  't': t,
+                  'distortion': distortion,
+                  'P': np.matmul(K, np.concatenate((R, t), axis=2)),
+                  'centers': -np.matmul(np.swapaxes(R, 1, 2), t)[:, :, 0]}
+        for name, array in arrays.items():
+            array.setflags(write=False)
+            object.__setattr__(self, name, array)
+        object.__setattr__(self, 'names', tuple(names))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CameraRig is immutable')
+
+    def __len__(self):
+        return self.K.shape[0]
+
+    @classmethod
+    def from_camera_params(cls, camera_params, names=None, use_rotation_euler=False):
+        """
+        Build a rig from OpenCap camera parameter dicts.
+        :param camera_params: dicts with 'intrinsicMat', 'rotation' (or 'rotation_EulerAngles'), 'translation' and
+                              optionally 'distortion'
+        :type camera_params: sequence of dict
+        :param names: camera names, None for indices
+        :type names: sequence
+        :param use_rotation_euler: use the Rodrigues vector 'rotation_EulerAngles' instead of 'rotation'
+        :type use_rotation_euler: bool
+        :return: camera rig
+        :rtype: CameraRig
+        """
+        camera_params = list(camera_params)
+        if use_rotation_euler:
+            R = [cv2.Rodrigues(params['rotation_EulerAngles'])[0] for params in camera_params]
+        else:
+            R = [params['rotation'] for params in camera_params]
+        distortions = [np.ravel(params.get('distortion', np.zeros(5))) for params in camera_params]
+        distortion = np.zeros((len(camera_params), max(5, max(len(d) for d in distortions))))
+        for i, d in enumerate(distortions):
+            distortion[i, :len(d)] = d
+        return cls(np.stack([params['intrinsicMat'] for params in camera_params]), np.stack(R),
+                   np.stack([np.reshape(params['translation'], (3, 1)) for params in camera_params]),
+                   distortion=distortion, names=names)
+
+    def subset(self, cameras):
+        """
+        Rig made of some of the cameras.
+        :param cameras: camera indices
+        :type cameras: sequence of int
+        :return: camera rig
+        :rtype: CameraRig
+        """
+        cameras = list(cameras)
+        return CameraRig(self.K[cameras], self.R[cameras], self.t[cameras], distortion=self.distortion[cameras],
+                         names=[self.names[i] for i in cameras])
+
+    def project(self, world, distort=False):
+        """
+        Project world coordinates to the images of all cameras, see project_points_batch.
+        :param world: world points in euclidean coordinates
+        :type world: numpy.ndarray, shape=(..., 3)
+        :param distort: apply the lens distortion (real image coordinates), otherwise undistorted image coordinates
+        :type distort: bool
+        :return: image coordinates
+        :rtype: numpy.ndarray, shape=(n, ..., 2)
+        """
+        return project_points_batch(self.K, self.R, self.t, world, distortion=self.distortion if distort else None)
+
+    def undistort(self, image_points, out=None):
+        """
+        Remove distortion from image coordinates, keeping each camera's intrinsic matrix.
+        One cv2.undistortPoints call per camera, written directly to the output.
+        :param image_points: distorted image coordinates
+        :type image_points: numpy.ndarray, shape=(n, ..., 2)
+        :param out: output array, None to allocate one, may be image_points for in place undistortion
+        :type out: numpy.ndarray, shape=(n, ..., 2), C-contiguous, same dtype as image_points
+        :return: undistorted image coordinates
+        :rtype: numpy.ndarray, shape=(n, ..., 2), float32 for float32 image_points, float64 otherwise
+        """
+        image_points = np.asarray(image_points)
+        if image_points.dtype != np.float32:
+            image_points = image_points.astype(float, copy=False)
+        assert(image_points.shape[0] == len(self))
+        if out is None:
+            out = np.empty(image_points.shape, dtype=image_points.dtype)
+        assert(out.shape == image_points.shape and out.dtype == image_points.dtype and out.flags['C_CONTIGUOUS'])
+        for i in range(len(self)):
+            dst = out[i].reshape((-1, 1, 2))
+            res = cv2.undistortPoints(image_points[i].reshape((-1, 1, 2)), self.K[i], self.distortion[i],
+                                      dst=dst, P=self.K[i])
+            if res is not dst:
+                dst[...] = res
+        return out
+
+    def triangulate(self, image_points, weights=None):
+        """
+        Weighted linear triangulation of correspondences in all cameras, see nview_linear_triangulations_batch.
+        :param image_points: undistorted image coordinates
+        :type image_points: numpy.ndarray, shape=(n, ..., 2)
+        :param weights: confidence of each observation, None for equal weights
+        :type weights: numpy.ndarray, shape=(n, ...)
+        :return: world coordinates, confidence
+        :rtype: numpy.ndarray, shape=(3, ...), numpy.ndarray, shape=(...)
+        """
+        return nview_linear_triangulations_batch(self.P, image_points, weights=weights)
+
+
 def nview_linear_triangulation(cameras, correspondences,weights = None):
     """
     Computes ONE world coordinate from image correspondences in n views.
@@ -867,17 +1006,122 @@ def nview_linear_triangulations(cameras, image_points,weights=None):
     assert(len(cameras) == image_points[0].shape[1])
     assert(image_points[0].shape[0] == 2)
 
-    world = np.zeros((3, len(image_points)))
-    confidence = np.zeros((1,len(image_points)))
-    for i, correspondence in enumerate(image_points):
-        if weights is not None:
-            w = [w[i] for w in weights]
-        else:
-            w = None
-        pt3d, conf = nview_linear_triangulation(cameras, correspondence,weights=w)
-        world[:, i] = np.ndarray.flatten(pt3d)
-        confidence[0,i] = conf
-    return world,confidence
+    P = np.stack([cam.P for cam in cameras])
+    # (m, 2, n) -> (n, m, 2)
+    points = np.transpose(np.stack(image_points), (2, 0, 1))
+    if weights is not None:
+        weights = np.stack([np.asarray(w, dtype=float).reshape(-1) for w in weights])
+    world, confidence = nview_linear_triangulations_batch(P, points, weights=weights)
+    return world, confidence[np.newaxis, :]
+
+
+def nview_linear_triangulations_batch(P, image_points, weights=None):
+    """
+    Computes world coordinates of many points at once from image correspondences in n views.
+    Builds the weighted D matrices of all points as one (..., 2n, 4) tensor and solves them with a single batched
+    eigendecomposition of D^T D. Follows the weighting rules of nview_linear_triangulation: nan weights are used
+    as 0.5, points with less than 2 non-zero weights are returned as 0 with confidence 0, and the confidence is
+    the mean of the non-zero (non-nan) weights, or 0.5 if they are all nan.
+    :param P: stacked camera matrices
+    :type P: numpy.ndarray, shape=(n, 3, 4)
+    :param image_points: image coordinates of the correspondences in n views, any batch shape (e.g. markers, frames)
+    :type image_points: numpy.ndarray, shape=(n, ..., 2)
+    :param weights: confidence of each observation, None for equal weights
+    :type weights: numpy.ndarray, shape=(n, ...)
+    :return: world coordinates, confidence
+    :rtype: numpy.ndarray, shape=(3, ...), numpy.ndarray, shape=(...)
+    """
+    P = np.asarray(P, dtype=float)
+    image_points = np.asarray(image_points, dtype=float)
+    n_cams = P.shape[0]
+    assert(n_cams >= 2)
+    assert(image_points.shape[0] == n_cams)
+    assert(image_points.shape[-1] == 2)
+    batch_shape = image_points.shape[1:-1]
+    if weights is None:
+        weights = np.ones((n_cams,) + batch_shape)
+    else:
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), (n_cams,) + batch_shape)
+    w = np.nan_to_num(weights, nan=0.5)  # turns nan confidences into 0.5
+
+    # D blocks, see [1, p. 88, The Triangulation Problem]: rows u * P[2] - P[0] and v * P[2] - P[1] per camera.
+    P_b = P.reshape((n_cams,) + (1,) * len(batch_shape) + (3, 4))
+    uv = image_points[..., np.newaxis]
+    D = (uv * P_b[..., 2, np.newaxis, :] - P_b[..., 0:2, :]) * w[..., np.newaxis, np.newaxis]
+    # (n, ..., 2, 4) -> (..., 2n, 4)
+    D = np.moveaxis(D, 0, -3).reshape(batch_shape + (2 * n_cams, 4))
+    Q = np.matmul(np.swapaxes(D, -1, -2), D)
+    # Eigenvector of the smallest eigenvalue of D^T D (eigenvalues are in ascending order).
+    _, v = np.linalg.eigh(Q)
+    X = v[..., :, 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        world = np.moveaxis(X[..., 0:3] / X[..., 3, np.newaxis], -1, 0)
+
+    nonzero = weights != 0
+    valid = nonzero & ~np.isnan(weights)
+    n_valid = np.count_nonzero(valid, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        confidence = np.where(valid, weights, 0).sum(axis=0) / n_valid
+    confidence = np.where(n_valid == 0, 0.5, confidence)  # all nan slice (all cameras were splined)
+
+    # return 0s if there aren't at least 2 cameras with confidence
+    enough_cams = np.count_nonzero(nonzero, axis=0) >= 2
+    world = np.where(enough_cams, world, 0)
+    confidence = np.where(enough_cams, confidence, 0)
+    return world, confidence
+
+
+def project_points_batch(K, R, t, world, distortion=None):
+    """
+    Projects world points to the images of many cameras at once, with the OpenCV camera model (cv2.projectPoints):
+    radial (k1, k2, k3 and the rational k4, k5, k6), tangential (p1, p2) and thin prism (s1, s2, s3, s4) distortion.
+    :param K: intrinsic camera parameters
+    :type K: numpy.ndarray, shape=(n, 3, 3)
+    :param R: camera rotations
+    :type R: numpy.ndarray, shape=(n, 3, 3)
+    :param t: camera translations
+    :type t: numpy.ndarray, shape=(n, 3) or (n, 3, 1)
+    :param world: world points in euclidean coordinates, any batch shape (e.g. points, or frames and markers)
+    :type world: numpy.ndarray, shape=(..., 3)
+    :param distortion: OpenCV distortion coefficients (4, 5, 8 or 12 per camera), None for no distortion
+    :type distortion: numpy.ndarray, shape=(n, k)
+    :return: image coordinates
+    :rtype: numpy.ndarray, shape=(n, ..., 2)
+    """
+    K = np.asarray(K, dtype=float)
+    R = np.asarray(R, dtype=float)
+    world = np.asarray(world, dtype=float)
+    n_cams = K.shape[0]
+    # Reshapes (n, ...) camera parameters to broadcast with (n, ..., 3) points.
+    cam_shape = (n_cams,) + (1,) * (world.ndim - 1)
+    # (..., n, 3) -> (n, ..., 3)
+    camera = np.moveaxis(np.tensordot(world, R, axes=([-1], [2])), -2, 0)
+    camera = camera + np.reshape(np.asarray(t, dtype=float), (n_cams, 3)).reshape(cam_shape + (3,))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z_inv = np.where(camera[..., 2] != 0, 1 / camera[..., 2], 1)
+    x = camera[..., 0] * z_inv
+    y = camera[..., 1] * z_inv
+
+    if distortion is not None:
+        distortion = np.asarray(distortion, dtype=float).reshape(n_cams, -1)
+        if distortion.shape[1] > 12:
+            assert not np.any(distortion[:, 12:]), 'tilted sensor model not supported'
+        # k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4
+        coeffs = np.zeros((n_cams, 12))
+        coeffs[:, :min(12, distortion.shape[1])] = distortion[:, :12]
+        k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4 = coeffs.T.reshape((12,) + cam_shape)
+        r2 = x * x + y * y
+        r4 = r2 * r2
+        r6 = r4 * r2
+        radial = (1 + k1 * r2 + k2 * r4 + k3 * r6) / (1 + k4 * r2 + k5 * r4 + k6 * r6)
+        xy2 = 2 * x * y
+        x, y = (x * radial + p1 * xy2 + p2 * (r2 + 2 * x * x) + s1 * r2 + s2 * r4,
+                y * radial + p1 * (r2 + 2 * y * y) + p2 * xy2 + s3 * r2 + s4 * r4)
+
+    K_b = K.reshape(cam_shape + (3, 3))
+    u = K_b[..., 0, 0] * x + K_b[..., 0, 1] * y + K_b[..., 0, 2]
+    v = K_b[..., 1, 1] * y + K_b[..., 1, 2]
+    return np.stack((u, v), axis=-1)
 
 
 def calibrate_division_model(line_coordinates, y0, z_n, focal_length=1):
@@ -15,13 +15,17 @@ import requests
 import ffmpeg
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
-from scipy.signal import gaussian, sosfiltfilt, butter, find_peaks
-from scipy.interpolate import pchip_interpolate
+from scipy.signal import sosfiltfilt, butter, find_peaks
 from scipy.spatial.transform import Rotation 
 import scipy.linalg
+import scipy.fft
 from itertools import combinations
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from collections.abc import Mapping
 import copy
-from utilsCameraPy3 import Camera, nview_linear_triangulations
+from utilsCameraPy3 import CameraRig, project_points_batch
 from utils import getOpenPoseMarkerNames, getOpenPoseFaceMarkers
 from utils import numpy2TRC, rewriteVideos, delete_multiple_element,loadCameraParameters
 from utilsAPI import getAPIURL
@@ -283,11 +287,62 @@ def saveCameraParameters(filename,CameraParams):
     
     return True
 
+#%% 
+def probeVideo(videoPath):
+    # ffmpeg.probe, cached by path and modification time such that each 
+    # video is probed once. The returned dict should not be modified.
+    if not os.path.exists(videoPath):
+        return ffmpeg.probe(videoPath)
+    
+    return probeVideoCached(os.path.abspath(videoPath), 
+                            os.path.getmtime(videoPath))
+
+# The cache is bounded since trials are processed in one long-lived process
+# (app.py). The modification time is only part of the cache key.
+@lru_cache(maxsize=128)
+def probeVideoCached(videoPath, modificationTime):
+    return ffmpeg.probe(videoPath)
+
+#%% 
+def getVideoStartTimes(videoPathList):
+    # Recording start times (s) of the videos from their container creation
+    # dates, with the resolution (s) of these dates: 1 s if they have no 
+    # fractional seconds, 1 ms otherwise. The same tag is used for all
+    # videos. Returns None if no tag is available for all videos.
+    tagNames = ['com.apple.quicktime.creationdate', 'creation_time']
+    tagsList = []
+    for videoPath in videoPathList:
+        try:
+            tagsList.append(probeVideo(videoPath)['format'].get('tags', {}))
+        except ffmpeg.Error:
+            return None
+    dates = None
+    for tagName in tagNames:
+        if all(tagName in tags for tags in tagsList):
+            dates = [tags[tagName] for tags in tagsList]
+            break
+    if dates is None:
+        return None
+    
+    startTimes = []
+    for date in dates:
+        try:
+            timestamp = pd.Timestamp(date)
+        except ValueError:
+            return None
+        if timestamp.microsecond == 0 and timestamp.nanosecond == 0:
+            resolution = 1.
+        else:
+            resolution = 1e-3
+        startTimes.append((timestamp.timestamp(), resolution))
+        
+    return startTimes
+
 #%% 
 def getVideoRotation(videoPath):
     
     
-    meta = ffmpeg.probe(videoPath)
+    meta = probeVideo(videoPath)
     try:
         rotation = meta['format']['tags']['com.apple.quicktime.video-orientation']
     except:
@@ -307,7 +362,16 @@ def getVideoRotation(videoPath):
         
     return int(rotation)
 
-#%% 
+#%%
+def getVideoImageSize(videoPath):
+    # Image size (height, width) of the first video stream from the cached
+    # ffprobe metadata, as the frames are read with OpenCV.
+    meta = probeVideo(videoPath)
+    stream = [s for s in meta['streams'] if s['codec_type'] == 'video'][0]
+
+    return (int(stream['height']), int(stream['width']))
+
+#%%
 def rotateIntrinsics(CamParams,videoPath):
     rotation = getVideoRotation(videoPath)
     
@@ -504,9 +568,11 @@ def calcExtrinsics(imageFileName, CameraParams, CheckerBoardParams,
     for iRet,rvec,tvec in zip(range(rets),rvecs,tvecs):
         theseCameraParams = copy.deepcopy(CameraParams)
         # Show reprojections
-        img_points, _ = cv2.projectPoints(objectp3d, rvec, tvec, 
-                                          CameraParams['intrinsicMat'],  
-                                          CameraParams['distortion'])
+        img_points = project_points_batch(
+            CameraParams['intrinsicMat'][np.newaxis], 
+            cv2.Rodrigues(rvec)[0][np.newaxis], tvec[np.newaxis], 
+            objectp3d.reshape(-1,3), 
+            distortion=CameraParams['distortion'])[0][:,np.newaxis,:]
     
         # Plot reprojected points
         # for c in img_points.squeeze():
@@ -717,34 +783,30 @@ def computeOptimalCalibrationCombination(keypoints2D,confidence,extrinsicsOption
     meanReprojectionErrors = []
     combinations = []  
     
+    # One rig with all extrinsics options of both cameras; each combination
+    # is a subset of it.
+    nOptionsCam0 = len(extrinsicsOptions[CamNames[0]])
+    optionsRig = CameraRig.from_camera_params(
+        list(extrinsicsOptions[CamNames[0]]) + 
+        list(extrinsicsOptions[CamNames[1]]))
+    
+    # Organize points for reprojectionError function
+    stackedPoints = np.stack([k[:,None,0,:] for k in keypointList])
+    pointsInput = []
+    for i in range(stackedPoints.shape[1]):
+        pointsInput.append(stackedPoints[:,i,0,:].T)
+    
     for iCam0 in firstCamOptions:
         for iCam1 in range(len(extrinsicsOptions[CamNames[1]])):
             combinations.append([iCam0,iCam1])
             
-            CameraParamList = [extrinsicsOptions[CamNames[0]][iCam0],
-                               extrinsicsOptions[CamNames[1]][iCam1]]
+            cameraRig = optionsRig.subset([iCam0, nOptionsCam0+iCam1])
                                            
             # triangulate           
-            points3D,_ = triangulateMultiview(CameraParamList,keypointList)
-            
-            # reproject
-            # Make list of camera objects
-            cameraObjList = []       
-            for camParams in CameraParamList:
-                c = Camera()
-                c.set_K(camParams['intrinsicMat'])
-                c.set_R(camParams['rotation'])
-                c.set_t(np.reshape(camParams['translation'],(3,1)))
-                cameraObjList.append(c)
-               
-            # Organize points for reprojectionError function
-            stackedPoints = np.stack([k[:,None,0,:] for k in keypointList])
-            pointsInput = []
-            for i in range(stackedPoints.shape[1]):
-                pointsInput.append(stackedPoints[:,i,0,:].T)
+            points3D,_ = triangulateMultiview(cameraRig,keypointList)
            
             # Calculate combined reprojection error
-            reprojError = calcReprojectionError(cameraObjList,pointsInput,points3D,
+            reprojError = calcReprojectionError(cameraRig,pointsInput,points3D,
                                                 normalizeError=True)
             meanReprojectionErrors.append(np.mean(reprojError))
       
@@ -774,6 +836,74 @@ def orderCamerasForAutoCalDetection(extrinsicsOptions):
     
     return sortedCams
 
+# %%
+class MultiCamKeypoints(Mapping):
+    # Synchronized 2D keypoints of multiple cameras, stored as one contiguous
+    # nCams x nMkrs x nFrames x 2 keypoint array and one nCams x nMkrs x 
+    # nFrames confidence array, indexed by camera name. float32 by default,
+    # which is the precision of the pose detectors' outputs. Behaves as a
+    # read-only dict of per-camera nMkrs x nFrames x 2 keypoint arrays (views
+    # into the contiguous array), like the keypoint dicts used elsewhere.
+    def __init__(self, keypoints, confidence, cameraNames, dtype=np.float32):
+        self.keypoints = np.ascontiguousarray(keypoints, dtype=dtype)
+        self.confidence = np.ascontiguousarray(confidence, dtype=dtype)
+        self.cameraNames = list(cameraNames)
+        self.cameraIndex = {cam: i for i, cam in enumerate(self.cameraNames)}
+        if (self.keypoints.ndim != 4 or self.keypoints.shape[-1] != 2 or
+            self.keypoints.shape[:-1] != self.confidence.shape or
+            self.keypoints.shape[0] != len(self.cameraNames)):
+            raise ValueError('Inconsistent keypoints ({}), confidence ({}) and cameras ({}).'.format(
+                self.keypoints.shape, self.confidence.shape, len(self.cameraNames)))
+    
+    @classmethod
+    def fromLists(cls, keypointList, confidenceList, cameraNames, 
+                  dtype=np.float32):
+        # keypointList: nCams x (nMkrs x nFrames x 2), confidenceList: 
+        # nCams x (nMkrs x nFrames); written directly into the arrays.
+        keypoints = np.empty((len(keypointList),) + np.shape(keypointList[0]),
+                             dtype=dtype)
+        confidence = np.empty(keypoints.shape[:-1], dtype=dtype)
+        for iCam, (key, conf) in enumerate(zip(keypointList, confidenceList)):
+            keypoints[iCam] = key
+            confidence[iCam] = conf
+        return cls(keypoints, confidence, cameraNames, dtype=dtype)
+    
+    @property
+    def valid(self):
+        # Keypoints usable for triangulation: non-zero confidence (nan
+        # confidences are splined keypoints, which are used).
+        return self.confidence != 0
+    
+    @property
+    def nMarkers(self):
+        return self.keypoints.shape[1]
+    
+    @property
+    def nFrames(self):
+        return self.keypoints.shape[2]
+    
+    def __getitem__(self, cameraName):
+        return self.keypoints[self.cameraIndex[cameraName]]
+    
+    def __iter__(self):
+        return iter(self.cameraNames)
+    
+    def __len__(self):
+        return len(self.cameraNames)
+    
+    def confidenceDict(self):
+        return {cam: self.confidence[i] for i, cam in enumerate(self.cameraNames)}
+    
+    def subset(self, cameraNames):
+        # Keypoints of some of the cameras, in the order of cameraNames. No
+        # copy if these are all the cameras, in the same order.
+        cameraNames = list(cameraNames)
+        if cameraNames == self.cameraNames:
+            return self
+        idx = [self.cameraIndex[cam] for cam in cameraNames]
+        return MultiCamKeypoints(self.keypoints[idx], self.confidence[idx], 
+                                 cameraNames, dtype=self.keypoints.dtype)
+
 # %%
 def synchronizeVideos(CameraDirectories, trialRelativePath, pathPoseDetector,
                       undistortPoints=False, CamParamDict=None, 
@@ -782,7 +912,25 @@ def synchronizeVideos(CameraDirectories, trialRelativePath, pathPoseDetector,
                       imageBasedTracker=False, cams2Use=['all'],
                       poseDetector='OpenPose', trialName=None, bbox_thr=0.8,
                       resolutionPoseDetection='default', 
-                      visualizeKeypointAnimation=False):
+                      visualizeKeypointAnimation=False, nWorkers=None,
+                      useLagPrior=False, syncMethod='keypoints',
+                      useMetadataLagWindow=False, nansInOutTwoCameras=None):
+    
+    # useLagPrior: the lags of each trial are saved in the session folder
+    # (see saveSyncLags), and the lags of the previous trials are used to 
+    # narrow the lag search (see syncLagFromPrior). The narrow search is only
+    # kept if its correlation peak is confirmed by the reprojection error,
+    # which on synthetic trials happens in about 60% of the trials even when
+    # the prior is correct; the full search is run for the others.
+    # syncMethod: 'keypoints' (default) syncs with the keypoints only.
+    # 'audio' first estimates the lags from the audio tracks of the videos,
+    # and uses the keypoints for the cameras whose audio lag could not be
+    # found or verified.
+    # If nansInOutTwoCameras is a dict, it gets filled with the nansInOut of
+    # each camera in the convention of 2 cameras (see 
+    # synchronizeVideoKeypoints).
+    if syncMethod not in ['keypoints', 'audio']:
+        raise Exception('Unknown sync method: {}.'.format(syncMethod))
     
     markerNames = getOpenPoseMarkerNames()
     
@@ -791,11 +939,12 @@ def synchronizeVideos(CameraDirectories, trialRelativePath, pathPoseDetector,
         cameras2Use = list(CameraDirectories.keys())
     else:
         cameras2Use = cams2Use
-    cameras2Use_in = copy.deepcopy(cameras2Use)
+    cameras2Use_in = list(cameras2Use)
 
     # Initialize output lists
     pointList = []
     confList = []
+    videoPathList = []
     
     CameraDirectories_selectedCams = {}
     CamParamList_selectedCams = []
@@ -828,6 +977,7 @@ def synchronizeVideos(CameraDirectories, trialRelativePath, pathPoseDetector,
         else:
             pointList.append(key2D)
             confList.append(confidence)
+            videoPathList.append(videoFullPath)
         
     # If video is not existing, the corresponding camera should be removed.
     idx_camToExclude = []
@@ -872,36 +1022,112 @@ def synchronizeVideos(CameraDirectories, trialRelativePath, pathPoseDetector,
             # Show the animation
             fig.show()
 
+    # Build the camera rig once for synchronization.
+    cameraRig = CameraRig.from_camera_params(CamParamList_selectedCams,
+                                             names=cameras2Use)
+    
+    # With useLagPrior, the lags between cameras are saved in the session 
+    # folder, next to mappingCamDevice.pickle, and the lags of the previous
+    # trials are used to narrow the lag search of this trial.
+    lagPrior = None
+    syncLags = None
+    if useLagPrior:
+        videosDir = os.path.dirname(os.path.normpath(
+            CameraDirectories_selectedCams[cameras2Use[0]]))
+        syncLagsPath = os.path.join(videosDir, 'syncLags.pickle')
+        lagPrior = loadSyncLags(syncLagsPath)
+        syncLags = {}
+    
+    # Lags from the audio tracks, one decode per video.
+    audioLags = None
+    if syncMethod == 'audio':
+        audioTracks = mapCameras(loadAudioTrack, videoPathList, 
+                                 nWorkers=nWorkers)
+        lags = getAudioLags([audio for audio, _ in audioTracks],
+                            [offset for _, offset in audioTracks], frameRate,
+                            maxShift=2)
+        audioLags = {camName: lag for camName, lag in zip(cameras2Use, lags)
+                     if lag is not None}
+        
+    # Lag windows from the creation dates of the videos.
+    videoStartTimes = None
+    if useMetadataLagWindow:
+        startTimes = getVideoStartTimes(videoPathList)
+        if startTimes is not None:
+            videoStartTimes = dict(zip(cameras2Use, startTimes))
+        
     # Synchronize keypoints.
+    nansInOutTwoCamerasList = None if nansInOutTwoCameras is None else []
     pointList, confList, nansInOutList,startEndFrameList = synchronizeVideoKeypoints(
         pointList, confList, confidenceThreshold=confidenceThreshold,
         filtFreqs=filtFreqs, sampleFreq=frameRate, visualize=False,
-        maxShiftSteps=2*frameRate, CameraParams=CamParamList_selectedCams,
+        maxShiftSteps=2*frameRate, CameraParams=cameraRig,
         cameras2Use=cameras2Use, 
-        CameraDirectories=CameraDirectories_selectedCams, trialName=trialName)
+        CameraDirectories=CameraDirectories_selectedCams, trialName=trialName,
+        nWorkers=nWorkers, lagPrior=lagPrior, syncLags=syncLags, 
+        audioLags=audioLags, videoStartTimes=videoStartTimes,
+        nansInOutTwoCameras=nansInOutTwoCamerasList)
+    
+    if syncLags:
+        saveSyncLags(syncLagsPath, syncLags, lagPrior=lagPrior)
+    
+    # Synchronized keypoints of all cameras in one contiguous array.
+    keypoints = MultiCamKeypoints.fromLists(
+        pointList, confList, list(CameraDirectories_selectedCams))
     
     if undistortPoints:
         if CamParamList_selectedCams is None:
             raise Exception('Need to have CamParamList to undistort Images')
-        # nFrames = pointList[0].shape[1]
-        unpackedPoints = unpackKeypointList(pointList) ;
-        undistortedPoints = []
-        for points in unpackedPoints:
-            undistortedPoints.append(undistort2Dkeypoints(
-                points, CamParamList_selectedCams, useIntrinsicMatAsP=True))
-        pointList = repackKeypointList(undistortedPoints)
-        
-    pointDir = {}
-    confDir = {}
+        undistortKeypoints(keypoints.keypoints, cameraRig, 
+                           out=keypoints.keypoints)
+        
     nansInOutDir = {}
     startEndFrames = {}
     for iCam, camName in enumerate(CameraDirectories_selectedCams):
-        pointDir[camName] =  pointList[iCam]
-        confDir[camName] =  confList[iCam] 
         nansInOutDir[camName] = nansInOutList[iCam] 
         startEndFrames[camName] = startEndFrameList[iCam]
+        if nansInOutTwoCameras is not None:
+            nansInOutTwoCameras[camName] = nansInOutTwoCamerasList[iCam]
         
-    return pointDir, confDir, markerNames, frameRate, nansInOutDir, startEndFrames, cameras2Use
+    return keypoints, keypoints.confidenceDict(), markerNames, frameRate, nansInOutDir, startEndFrames, cameras2Use
+
+# %%
+def mapCameras(function, *iterables, nWorkers=None):
+    # Apply function to the data of each camera, e.g., 
+    # mapCameras(f, keypointList, confidenceList) calls f(keypoints, confidence)
+    # for each camera. Cameras are processed in a pool of nWorkers threads (as
+    # many as cameras and cpus if None, serially if 1); numpy and scipy 
+    # release the GIL on large arrays. Results are returned in camera order.
+    args = list(zip(*iterables))
+    if nWorkers is None:
+        nWorkers = min(len(args), os.cpu_count() or 1)
+    if nWorkers <= 1 or len(args) <= 1:
+        return [function(*arg) for arg in args]
+    with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+        return list(executor.map(lambda arg: function(*arg), args))
+
+# %%
+def loadSyncLags(syncLagsPath):
+    # Sync lags of the previous trials of a session (see saveSyncLags), None
+    # if there are none.
+    if not os.path.exists(syncLagsPath):
+        return None
+    with open(syncLagsPath, 'rb') as handle:
+        return pickle.load(handle)
+
+# %%
+def saveSyncLags(syncLagsPath, syncLags, lagPrior=None):
+    # Saves the sync lags of a trial (see synchronizeVideoKeypoints). The
+    # lags of cameras that were not synced in this trial are kept from 
+    # lagPrior, the lags of the previous trials, if they have the same 
+    # reference camera and frame rate.
+    if (lagPrior is not None and 
+            lagPrior['reference'] == syncLags['reference'] and
+            lagPrior['frameRate'] == syncLags['frameRate']):
+        for key in ['lags', 'confidence']:
+            syncLags[key] = {**lagPrior[key], **syncLags[key]}
+    with open(syncLagsPath, 'wb') as handle:
+        pickle.dump(syncLags, handle)
 
 # %%
 def synchronizeVideoKeypoints(keypointList, confidenceList,
@@ -910,36 +1136,65 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
                               sampleFreq=30, visualize=False, maxShiftSteps=30,
                               isGait=False, CameraParams = None,
                               cameras2Use=['none'],CameraDirectories = None,
-                              trialName=None, trialID=''):
+                              trialName=None, trialID='',
+                              restrictLagsToMaxShift=False, nWorkers=None,
+                              lagPrior=None, syncLags=None, audioLags=None,
+                              videoStartTimes=None, nansInOutTwoCameras=None):
     visualize2Dkeypoint = False # this is a visualization just for testing what filtered input data looks like
     
+    # If restrictLagsToMaxShift, the correlation curves are only evaluated
+    # for lags within +/- maxShiftSteps, instead of picking a lag on the
+    # full curve and discarding it if it is larger than maxShiftSteps.
+    if restrictLagsToMaxShift:
+        maxLag = maxShiftSteps
+    else:
+        maxLag = None
+    
+    # lagPrior: lags found in a previous trial of the session, in the format
+    # of syncLags. If syncLags is a dict, it gets filled with the lags of
+    # this trial: {'reference': reference camera, 'frameRate': sampleFreq,
+    # 'lags': {camera: lag}, 'confidence': {camera: correlation at lag}}.
+    # audioLags: {camera: lag} relative to any common reference camera, e.g.,
+    # from getAudioLags. They are used instead of the keypoint lag search if
+    # they pass a short reprojection check (see checkSyncLag).
+    # videoStartTimes: {camera: (start time, resolution)} in seconds, e.g.,
+    # from getVideoStartTimes. They bound the lag search of each camera.
+    # If nansInOutTwoCameras is a list, it gets filled with the nansInOut of 
+    # each camera in the convention of 2 cameras (see clean2Dkeypoints), 
+    # whatever the number of cameras, e.g., for triangulating subsets of 2 
+    # cameras (see triangulateMultiviewVideoSubsets).
+    
     # keypointList is a mCamera length list of (nmkrs,nTimesteps,2) arrays of camera 2D keypoints
     print('Synchronizing Keypoints')
     
-    # Deep copies such that the inputs do not get modified.
-    c_CameraParams = copy.deepcopy(CameraParams)
-    c_cameras2Use = copy.deepcopy(cameras2Use)
-    c_CameraDirectoryDict = copy.deepcopy(CameraDirectories)
+    # Rig of the cameras to synchronize, built once and shared by all
+    # reprojection error computations.
+    if CameraParams is None or isinstance(CameraParams, CameraRig):
+        cameraRig = CameraParams
+    else:
+        cameraRig = CameraRig.from_camera_params(CameraParams)
+    
+    # New lists (of the same arrays) such that the inputs do not get
+    # modified. The arrays themselves are never written to.
+    c_cameras2Use = list(cameras2Use)
     
-    # Turn Camera Dict into List
-    c_CameraDirectories = list(c_CameraDirectoryDict.values())
     # Check if one camera has only 0s as confidence scores, which would mean
     # no one has been properly identified. We want to kick out this camera
-    # from the synchronization and triangulation. We do that by popping out
+    # from the synchronization and triangulation. We do that by leaving out
     # the corresponding data before syncing and add back 0s later.
     badCameras = []
     for icam, conf in enumerate(confidenceList):
         if np.max(conf) == 0.0:
             badCameras.append(icam)
-    idxBadCameras = [badCameras[i]-i for i in range(len(badCameras))]
-    for idxBadCamera in idxBadCameras:
-        print('{} kicked out of synchronization'.format(
-            c_cameras2Use[idxBadCamera]))
-        keypointList.pop(idxBadCamera)
-        confidenceList.pop(idxBadCamera)
-        c_CameraParams.pop(idxBadCamera)
-        c_cameras2Use.pop(idxBadCamera)
-        c_CameraDirectories.pop(idxBadCamera)
+            print('{} kicked out of synchronization'.format(
+                c_cameras2Use[icam]))
+    goodCameras = [i for i in range(len(confidenceList)) if i not in badCameras]
+    keypointList = [keypointList[i] for i in goodCameras]
+    confidenceList = [confidenceList[i] for i in goodCameras]
+    c_cameras2Use = [c_cameras2Use[i] for i in goodCameras]
+    if badCameras and cameraRig is not None:
+        cameraRig = cameraRig.subset(
+            [i for i in range(len(cameraRig)) if i not in badCameras])
         
         
     markerNames = getOpenPoseMarkerNames()
@@ -951,43 +1206,52 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
     armMkrs = {'right':[mkrDict['RElbow'], mkrDict['RWrist']],
                 'left':[mkrDict['LElbow'], mkrDict['LWrist']]}
     
-    plt.close('all')
+    if visualize or visualize2Dkeypoint:
+        plt.close('all')
     
-    # Copy for visualization
-    keypointListUnfilt = copy.deepcopy(keypointList)
-    
-    # remove occluded foot markers (uses large differences in confidence)
-    keypointList,confidenceList = zip(*[removeOccludedSide(keys,conf,footMkrs,confidenceThreshold,visualize=False) for keys,conf in zip(keypointList,confidenceList)])
-    # remove occluded arm markers
-    keypointList,confidenceList = zip(*[removeOccludedSide(keys,conf,armMkrs,confidenceThreshold,visualize=False) for keys,conf in zip(keypointList,confidenceList)])
-       
-    # Copy for visualization 
-    keypointListOcclusionRemoved = copy.deepcopy(keypointList)
+    # For visualization. No copy needed: the stages below do not modify
+    # their inputs.
+    if visualize2Dkeypoint:
+        keypointListUnfilt = keypointList
     
     # Don't change these. The ankle markers are used for gait detector
     markers4VertVel = [mkrDict['RAnkle'], mkrDict['LAnkle']] # R&L Ankles and Heels did best. There are some issues though - like when foot marker velocity is aligned with camera ray
     markers4HandPunch = [mkrDict['RWrist'], mkrDict['LWrist'],mkrDict['RShoulder'],mkrDict['LShoulder']]
     markers4Ankles = [mkrDict['RAnkle'],mkrDict['LAnkle']]
     
-    # find velocity signals for synchronization
     nCams = len(keypointList)
-    vertVelList = []
-    mkrSpeedList = []
-    handPunchVertPositionList = []
-    allMarkerList = []
-    for (keyRaw,conf) in zip(keypointList,confidenceList):
-        keyRaw_clean, _, _, _ = clean2Dkeypoints(keyRaw,conf,confidenceThreshold=0.3,nCams=nCams,linearInterp=True)        
-        keyRaw_clean_smooth = smoothKeypoints(keyRaw_clean, sdKernel=3) 
-        handPunchVertPositionList.append(getPositions(keyRaw_clean_smooth,markers4HandPunch,direction=1)) 
-        vertVelList.append(getVertVelocity(keyRaw_clean_smooth)) # doing it again b/c these settings work well for synchronization
-        mkrSpeedList.append(getMarkerSpeed(keyRaw_clean_smooth,markers4VertVel,confidence=conf,averageVels=False)) # doing it again b/c these settings work well for synchronization
-        allMarkerList.append(keyRaw_clean_smooth)
+    
+    # Per-camera preprocessing: remove occluded markers and find velocity
+    # signals for synchronization. Cameras are independent and processed in
+    # a pool of nWorkers threads.
+    def preprocessCamera(keys, conf):
+        # remove occluded foot markers (uses large differences in confidence)
+        keys, conf = removeOccludedSide(keys,conf,footMkrs,confidenceThreshold,visualize=False)
+        # remove occluded arm markers, in place in the arrays returned above
+        keys, conf = removeOccludedSide(keys,conf,armMkrs,confidenceThreshold,visualize=False,inPlace=True)
+        keyRaw_clean, _, _, _ = clean2Dkeypoints(keys,conf,confidenceThreshold=0.3,nCams=nCams,linearInterp=True)        
+        keyRaw_clean_smooth = smoothKeypoints(keyRaw_clean, sdKernel=3, inPlace=True) 
+        handPunchVertPosition = getPositions(keyRaw_clean_smooth,markers4HandPunch,direction=1)
+        vertVel = getVertVelocity(keyRaw_clean_smooth) # doing it again b/c these settings work well for synchronization
+        mkrSpeed = getMarkerSpeed(keyRaw_clean_smooth,markers4VertVel,confidence=conf,averageVels=False) # doing it again b/c these settings work well for synchronization
+        return keys, conf, handPunchVertPosition, vertVel, mkrSpeed, keyRaw_clean_smooth
+    
+    (keypointList, confidenceList, handPunchVertPositionList, vertVelList,
+     mkrSpeedList, allMarkerList) = [list(out) for out in zip(*mapCameras(
+         preprocessCamera, keypointList, confidenceList, nWorkers=nWorkers))]
+       
+    # For visualization
+    if visualize2Dkeypoint:
+        keypointListOcclusionRemoved = keypointList
         
     # Find indices with high confidence that overlap between cameras.    
     # Note: Could get creative and do camera pair syncing in the future, based
     # on cameras with greatest amount of overlapping confidence.
-    overlapInds_clean, minConfLength_all = findOverlap(confidenceList,
-                                                   markers4VertVel)
+    # The sync marker confidence of each camera is computed once and reused
+    # for all camera combinations tried below.
+    syncConfidenceList = getSyncConfidence(confidenceList, markers4VertVel)
+    overlapInds_clean, minConfLength_all = findOverlapSyncConfidence(
+        syncConfidenceList)
     
     # If no overlap found, try with fewer cameras.
     c_nCams = len(confidenceList)
@@ -995,13 +1259,11 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
         print("Could not find overlap with {} cameras - trying with {} cameras".format(c_nCams, c_nCams-1))
         cam_list = [i for i in range(nCams)]
         # All possible combination with c_nCams-1 cameras.
-        from itertools import combinations
         combs = set(combinations(cam_list, c_nCams-1))
         overlapInds_clean_combs = []
         for comb in combs:
-            confidenceList_sel = [confidenceList[i] for i in list(comb)]
-            overlapInds_clean_c, minConfLength_c = findOverlap(
-                confidenceList_sel, markers4VertVel)
+            overlapInds_clean_c, _ = findOverlapSyncConfidence(
+                [syncConfidenceList[i] for i in comb])
             overlapInds_clean_combs.append(overlapInds_clean_c.flatten())
         longest_stretch = 0
         for overlapInds_clean_comb in overlapInds_clean_combs:
@@ -1062,22 +1324,29 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
     
     # Filter keypoint data
     # sdKernel = sampleFreq/(2*np.pi*filtFreq) # not currently used, but in case using gaussian smoother (smoothKeypoints function) instead of butterworth to filter keypoints
-    keyFiltList = []
-    confFiltList = []
-    confSyncFiltList = []
-    nansInOutList = []
-    for (keyRaw,conf) in zip(keypointList,confidenceList):
+    def filterCamera(keyRaw, conf):
         keyRaw_clean, conf_clean, nans_in_out, conf_sync_clean = clean2Dkeypoints(keyRaw,conf,confidenceThreshold,nCams=nCams)
-        keyRaw_clean_filt = filterKeypointsButterworth(keyRaw_clean,filtFreq,sampleFreq,order=4)
-        keyFiltList.append(keyRaw_clean_filt)
-        confFiltList.append(conf_clean)
-        confSyncFiltList.append(conf_sync_clean)
-        nansInOutList.append(nans_in_out)
+        keyRaw_clean_filt = filterKeypointsButterworth(keyRaw_clean,filtFreq,sampleFreq,order=4,inPlace=True)
+        return keyRaw_clean_filt, conf_clean, conf_sync_clean, nans_in_out
+    
+    keyFiltList, confFiltList, confSyncFiltList, nansInOutList = [
+        list(out) for out in zip(*mapCameras(
+            filterCamera, keypointList, confidenceList, nWorkers=nWorkers))]
+    # With more than 2 cameras, low confidence values are 0s rather than 
+    # nans, see confidenceToTwoCameras.
+    if nansInOutTwoCameras is not None:
+        if nCams>2:
+            nansInOutTwoCamerasList = [
+                getNansInOut(confidenceToTwoCameras(conf)) 
+                for conf in confFiltList]
+        else:
+            nansInOutTwoCamerasList = nansInOutList
 
-    # Copy for visualization
-    keypointListFilt = copy.deepcopy(keyFiltList)
-    confidenceListFilt = copy.deepcopy(confFiltList)
-    confidenceSyncListFilt = copy.deepcopy(confSyncFiltList)
+    # These are not modified below, so no copies are needed for
+    # visualization or reprojection.
+    keypointListFilt = keyFiltList
+    confidenceListFilt = confFiltList
+    confidenceSyncListFilt = confSyncFiltList
 
     # find nSample shift relative to the first camera
     # nSamps = keypointList[0].shape[1]
@@ -1085,42 +1354,149 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
     shiftVals.append(0)
     timeVecs = []
     tStartEndVec = np.zeros((len(keypointList),2))
+    
+    # Lags of a previous trial of the session (see synchronizeVideos). They
+    # are only used if relative to the same reference camera, at the same
+    # frame rate, and if they were found with a strong correlation. The lag
+    # is then searched within +/- .2 seconds of the prior lag, and the full
+    # search is used if there is no strong correlation peak in that window.
+    lagPriorMinCorr = 0.5
+    lagPriorWindow = int(np.round(.2*sampleFreq))
+    priorLags = {}
+    if (lagPrior is not None and syncActivity != 'handPunch' and
+            lagPrior['reference'] == c_cameras2Use[0] and 
+            lagPrior['frameRate'] == sampleFreq):
+        priorLags = {cam: lag for cam, lag in lagPrior['lags'].items()
+                     if lagPrior['confidence'][cam] >= lagPriorMinCorr}
+    if syncLags is not None:
+        syncLags.update({'reference': c_cameras2Use[0], 
+                         'frameRate': sampleFreq, 'lags': {}, 
+                         'confidence': {}})
+    # Lag windows from the video start times: the lag of each camera is
+    # searched within the resolution of the start times (+.1 s margin)
+    # around the lag given by the start times. If the start times are
+    # missing or the window is outside +/- maxShiftSteps, the full window is
+    # used.
+    lagWindows = {}
+    nSignal = np.max([len(vertVel) for vertVel in vertVelList])
+    if videoStartTimes is not None and c_cameras2Use[0] in videoStartTimes:
+        startTimeRef, resolutionRef = videoStartTimes[c_cameras2Use[0]]
+        for camName in c_cameras2Use[1:]:
+            if camName not in videoStartTimes:
+                continue
+            startTime, resolution = videoStartTimes[camName]
+            lagCenter = (startTimeRef - startTime) * sampleFreq
+            lagHalfWidth = (np.max([resolutionRef, resolution]) + .1) * sampleFreq
+            lagWindow = (int(np.max([np.floor(lagCenter - lagHalfWidth), 
+                                     -maxShiftSteps, -(nSignal//2)])),
+                         int(np.min([np.ceil(lagCenter + lagHalfWidth), 
+                                     maxShiftSteps, nSignal - 1 - nSignal//2])))
+            if lagWindow[0] < lagWindow[1]:
+                lagWindows[camName] = lagWindow
+            else:
+                print('Inconsistent start time of {}. Using the full lag window.'.format(camName))
+    
+    # Lag search of the general and gait sync functions: correlation peaks
+    # scored with the reprojection error, for lags within maxLagCam.
+    def searchLag(iCam, maxLagCam):
+        dataForReproj = prepareReprojectionForSync(
+            cameraRig, keypointListFilt,
+            [0, c_cameras2Use.index(c_cameras2Use[iCam])],
+            confidenceSyncListFilt)
+        dataForReproj['cameras2Use'] = c_cameras2Use
+        if syncActivity == 'general':
+            return cross_corr(vertVelList[iCam],vertVelList[0],multCorrGaussianStd=maxShiftSteps/2,
+                              visualize=False,dataForReproj=dataForReproj,
+                              frameRate=sampleFreq,maxLag=maxLagCam) # gaussian curve gets multipled by correlation plot - helping choose the smallest shift value for periodic motions
+        else:
+            return cross_corr_multiple_timeseries(mkrSpeedList[iCam],
+                                                  mkrSpeedList[0],
+                                                  multCorrGaussianStd=maxShiftSteps/2,
+                                                  dataForReproj=dataForReproj,
+                                                  visualize=False,
+                                                  frameRate=sampleFreq,
+                                                  maxLag=maxLagCam)
+    
+    if syncActivity == 'gait':
+        syncSignalList = mkrSpeedList
+    else:
+        syncSignalList = vertVelList
+    
     for iCam,vertVel in enumerate(vertVelList):
         timeVecs.append(np.arange(keypointList[iCam].shape[1]))
         if iCam>0:
+            # Correlation of the sync signals, used for the lag prior and to
+            # save the confidence of the selected lag.
+            syncCorr, syncCorrLags = None, None
+            if c_cameras2Use[iCam] in priorLags or syncLags is not None:
+                syncCorr, syncCorrLags = syncCorrelation(
+                    syncSignalList[iCam], syncSignalList[0], maxLag=maxLag)
+            # Lag from the audio tracks, if it passes a short reprojection
+            # check.
+            lagFromAudio = None
+            if (audioLags is not None and 
+                    audioLags.get(c_cameras2Use[iCam]) is not None and
+                    audioLags.get(c_cameras2Use[0]) is not None):
+                audioLag = int(np.round(
+                    audioLags[c_cameras2Use[iCam]] - audioLags[c_cameras2Use[0]]))
+                if (np.abs(audioLag) <= maxShiftSteps and checkSyncLag(
+                        prepareReprojectionForSync(
+                            cameraRig, keypointListFilt, [0, iCam],
+                            confidenceSyncListFilt), 
+                        audioLag, sampleFreq, int(maxShiftSteps))):
+                    lagFromAudio = audioLag
+                else:
+                    print('Could not verify the audio lag of {}. Using keypoints.'.format(c_cameras2Use[iCam]))
+            
+            lagFromPrior = None
+            if lagFromAudio is None and c_cameras2Use[iCam] in priorLags:
+                dataForReproj = prepareReprojectionForSync(
+                    cameraRig, keypointListFilt,
+                    [0, c_cameras2Use.index(c_cameras2Use[iCam])],
+                    confidenceSyncListFilt)
+                _, lagFromPrior = syncLagFromPrior(
+                    syncCorr, syncCorrLags, priorLags[c_cameras2Use[iCam]],
+                    lagPriorWindow, dataForReproj=dataForReproj,
+                    minCorr=lagPriorMinCorr)
+            
             # if no keypoints in Cam0 or the camera of interest, do not use cross_corr to sync.
+            lagFound = True
             if np.max(np.abs(vertVelList[iCam])) == 0 or np.max(np.abs(vertVelList[0])) == 0:
                 lag = 0
-            elif syncActivity == 'general':
-                dataForReproj = {'CamParamList':c_CameraParams,
-                                 'keypointList':keypointListFilt,
-                                 'cams2UseReproj': [0, c_cameras2Use.index(c_cameras2Use[iCam])],
-                                 'confidence': confidenceSyncListFilt,
-                                 'cameras2Use': c_cameras2Use
-                                 }
-                corVal,lag = cross_corr(vertVel,vertVelList[0],multCorrGaussianStd=maxShiftSteps/2,
-                                        visualize=False,dataForReproj=dataForReproj,
-                                        frameRate=sampleFreq) # gaussian curve gets multipled by correlation plot - helping choose the smallest shift value for periodic motions
-            elif syncActivity == 'gait':
-                
-                dataForReproj = {'CamParamList':c_CameraParams,
-                                 'keypointList':keypointListFilt,
-                                 'cams2UseReproj': [0, c_cameras2Use.index(c_cameras2Use[iCam])],
-                                 'confidence': confidenceSyncListFilt,
-                                 'cameras2Use': c_cameras2Use
-                                 }
-                corVal,lag = cross_corr_multiple_timeseries(mkrSpeedList[iCam],
-                                            mkrSpeedList[0],
-                                            multCorrGaussianStd=maxShiftSteps/2,
-                                            dataForReproj=dataForReproj,
-                                            visualize=False,
-                                            frameRate=sampleFreq)    
+                lagFound = False
+            elif lagFromAudio is not None:
+                lag = lagFromAudio
+                print('Used the audio tracks to sync {}.'.format(c_cameras2Use[iCam]))
+            elif lagFromPrior is not None:
+                lag = lagFromPrior
+                print('Used the session lag prior to sync {}.'.format(c_cameras2Use[iCam]))
+            elif syncActivity in ['general', 'gait']:
+                camName = c_cameras2Use[iCam]
+                corVal,lag = searchLag(iCam, lagWindows.get(camName, maxLag))
+                # If the lag is at the edge of the start time window or does
+                # not pass a short reprojection check, the start times are
+                # probably off: search the full window instead.
+                if camName in lagWindows:
+                    lagWindowMin, lagWindowMax = lagWindows[camName]
+                    if (lag <= lagWindowMin or lag >= lagWindowMax or 
+                            not checkSyncLag(
+                                prepareReprojectionForSync(
+                                    cameraRig, keypointListFilt, [0, iCam],
+                                    confidenceSyncListFilt),
+                                lag, sampleFreq, int(maxShiftSteps))):
+                        print('Could not verify the lag of {} within the start time window. Using the full lag window.'.format(camName))
+                        corVal,lag = searchLag(iCam, maxLag)
             elif syncActivity == 'handPunch':
                 corVal,lag = syncHandPunch([handPunchVertPositionList[i] for i in [0,iCam]],
                                            handForPunch,maxShiftSteps=maxShiftSteps)
             if np.abs(lag) > maxShiftSteps: # if this fails and we get a lag greater than maxShiftSteps (units=timesteps)
                 lag = 0 
+                lagFound = False
                 print('Did not use cross correlation to sync {} - computed shift was greater than specified {} frames. Shift set to 0.'.format(c_cameras2Use[iCam], maxShiftSteps))
+            if syncLags is not None and lagFound and syncCorr is not None:
+                syncLags['lags'][c_cameras2Use[iCam]] = int(lag)
+                syncLags['confidence'][c_cameras2Use[iCam]] = float(
+                    np.sum(syncCorr[syncCorrLags == lag]))
             shiftVals.append(lag)
             timeVecs[iCam] = timeVecs[iCam] - shiftVals[iCam]
         tStartEndVec[iCam,:] = [timeVecs[iCam][0], timeVecs[iCam][-1]]
@@ -1146,6 +1522,9 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
         else:
             shiftednNansInOut = nansInOutList[iCam]
         nansInOutSync.append(shiftednNansInOut)        
+        if nansInOutTwoCameras is not None:
+            nansInOutTwoCameras.append(nansInOutTwoCamerasList[iCam] - 
+                                       max(shiftVals[iCam], 0))
         # Save start and end frames to list, so can rewrite videos in
         # triangulateMultiviewVideo
         startEndFrames.append([iStart,iEnd])
@@ -1203,6 +1582,8 @@ def synchronizeVideoKeypoints(keypointList, confidenceList,
         keypointsSync.insert(badCamera, np.zeros(keypointsSync[0].shape))
         confidenceSync.insert(badCamera, np.zeros(confidenceSync[0].shape))
         nansInOutSync.insert(badCamera, np.array([np.nan, np.nan]))
+        if nansInOutTwoCameras is not None:
+            nansInOutTwoCameras.insert(badCamera, np.array([np.nan, np.nan]))
         startEndFrames.insert(badCamera, None)
  
     return keypointsSync, confidenceSync, nansInOutSync, startEndFrames
@@ -1288,45 +1669,38 @@ def detectGait(rSpeed,lSpeed,frameRate):
 # %%
 def detectFeetMoving(allMarkers,confidence,ankleInds,motionThreshold=.5):
     # motion threshold is a percent of bounding box height/width
+    # allMarkers: nMkrs x nFrames x 2, confidence: nMkrs x nFrames.
     
     # Get bounding box height or width
-    # nFrames x(nMkrsx3)
+    # nFrames x(nMkrsx3), ie x, y, confidence of each marker.
     nFrames = confidence.shape[1]
-    nMkrs = confidence.shape[0]
-    cMkrs = np.copy(allMarkers)
-    reshapedMkrs = np.ndarray((nFrames,0))
-    for i in range(nMkrs):
-        reshapedMkrs = np.append(reshapedMkrs,np.squeeze(cMkrs[i,:,:]),axis=1)
-    
-    inData = np.insert(reshapedMkrs.T,np.arange(2,nMkrs*2+1,2),confidence,axis=0)
+    inData = np.concatenate((allMarkers, confidence[:,:,None]), 
+                            axis=2).transpose(1,0,2).reshape(nFrames,-1)
     
-    bbox=keypointsToBoundingBox(inData.T)
+    bbox=keypointsToBoundingBox(inData)
     # normalize by the average width of the bounding box
     normValue = np.mean(bbox[:,2])
     
-    # compute max distance
+    # compute max distance, for both feet at once.
     ankleMkrs = np.divide(allMarkers[ankleInds,:,:],normValue)
     ankleConf = confidence[ankleInds,:]
     confThresh = 0.4
-    maxMvt = []
-    for i in range(2):
-        confidentInds = ankleConf[i]>confThresh
-        if len(confidentInds)>0:
-            confidentMarkers = ankleMkrs[i,ankleConf[i]>confThresh,:]
-            # need to find the two points that are furthest from each other. A naive
-            # search is O(n^2). Let's assume we are looking for motion in horizontal 
-            # direction.
-            idxMax = np.argmax(confidentMarkers[:,0])
-            idxMin = np.argmin(confidentMarkers[:,0])
-            maxMvt.append(scipy.linalg.norm(
-                confidentMarkers[idxMax,:]-confidentMarkers[idxMin,:]))
-        else:
-            # if we did not see the foot, assume it did not move
-            maxMvt.append=0
-
+    confidentInds = ankleConf>confThresh
+    # need to find the two points that are furthest from each other. A naive
+    # search is O(n^2). Let's assume we are looking for motion in horizontal 
+    # direction. Frames with low confidence are never selected.
+    idxMax = np.argmax(np.where(confidentInds, ankleMkrs[:,:,0], -np.inf), 
+                       axis=1)
+    idxMin = np.argmin(np.where(confidentInds, ankleMkrs[:,:,0], np.inf), 
+                       axis=1)
+    feet = np.arange(len(ankleInds))
+    maxMvt = np.linalg.norm(ankleMkrs[feet,idxMax,:] - ankleMkrs[feet,idxMin,:],
+                            axis=1)
+    # if we did not see the foot, assume it did not move
+    maxMvt[~np.any(confidentInds,axis=1)] = 0
     
     # did both feet move greater than the motion threshold
-    anyFootMoving = all([m>motionThreshold for m in maxMvt])
+    anyFootMoving = bool(np.all(maxMvt>motionThreshold))
     
     return anyFootMoving
     
@@ -1352,6 +1726,9 @@ def detectGaitAllVideos(mkrSpeedList,allMarkers,confidence,ankleInds,sampleFreq)
 def getLargestBoundingBox(data, bbox, confThresh=0.6):
     # Select the person/timepoint with the greatest bounding box area, with
     # reasonable mean confidence (i.e., closest to the camera).
+    # data: (...) x nFrames x 75, bbox: (...) x nFrames x 4, e.g., for all
+    # people at once: nPeople x nFrames x 75 and nPeople x nFrames x 4.
+    # Returns the max area and its frame (nan if none), of shape (...).
 
     # Parameters (may require some tuning).
     # Don't consider frame if > this many keypoints with 0s or low confidence.
@@ -1362,81 +1739,83 @@ def getLargestBoundingBox(data, bbox, confThresh=0.6):
     footConfThresh = 0.5
 
     # Copy data
-    c_data = np.copy(data)
-    c_data[c_data==0] = np.nan
-    conf = c_data[:,2::3]
-    c_bbox = np.copy(bbox)
+    c_data = np.where(data==0, np.nan, data)
+    conf = c_data[...,2::3]
     
     # Detect rows where < nGoodKeypoints markers have non-zeros.
-    rows_nonzeros = np.count_nonzero(c_data, axis=1)        
-    rows_nonzeros_10m = np.argwhere(rows_nonzeros < nGoodKeypoints*3)
+    rows_nonzeros_10m = np.count_nonzero(c_data, axis=-1) < nGoodKeypoints*3
     
     # Detect rows where < nGoodKeypoints markers have high confidence.
     nHighConfKeypoints = np.count_nonzero((conf > confThreshRemoveRow), 
-                                          axis=1) 
-    rows_lowConf = np.argwhere(nHighConfKeypoints < nGoodKeypoints)
+                                          axis=-1) 
+    rows_lowConf = nHighConfKeypoints < nGoodKeypoints
        
     # Detect rows where the feet have low confidence.
     markerNames = getOpenPoseMarkerNames()
     feetMarkers = ['RAnkle', 'RHeel', 'RBigToe', 'LAnkle', 'LHeel', 'LBigToe']
     idxFeet = [markerNames.index(i) for i in feetMarkers]
-    confFeet = conf[:,idxFeet]
-    confFeet[np.isnan(confFeet)] = 0
-    rows_badFeet = np.argwhere(np.mean(confFeet, axis=1) < footConfThresh)
+    confFeet = np.nan_to_num(conf[...,idxFeet], nan=0)
+    rows_badFeet = np.mean(confFeet, axis=-1) < footConfThresh
     
     # Set bounding box to 0 for bad rows.
-    badRows = np.unique(np.concatenate((rows_nonzeros_10m, rows_lowConf,
-                                        rows_badFeet)))
+    badRows = rows_nonzeros_10m | rows_lowConf | rows_badFeet
     
     # Only remove rows if it isn't removing all rows
-    if len(badRows) < c_data.shape[0]: 
-        c_bbox[badRows, :] = 0
+    badRows &= ~np.all(badRows, axis=-1, keepdims=True)
     
     # Find bbox size.
-    bbArea = np.multiply(c_bbox[:,2], c_bbox[:,3])
+    bbArea = np.where(badRows, 0, np.multiply(bbox[...,2], bbox[...,3]))
     
     # Find rows with high enough average confidence.
-    confMask = np.zeros((conf.shape[0]), dtype=bool)
-    nonNanRows = np.argwhere(np.any(~np.isnan(c_data), axis=1))
-    confMask[nonNanRows] = np.nanmean(conf[nonNanRows,:],axis=2) > confThresh
+    nonNanRows = np.any(~np.isnan(c_data), axis=-1)
+    nConf = np.count_nonzero(~np.isnan(conf), axis=-1)
+    meanConf = np.divide(np.nansum(conf, axis=-1), nConf, 
+                         out=np.full(nConf.shape, np.nan), where=nConf>0)
+    confMask = nonNanRows & (meanConf > confThresh)
     maskedArea = np.multiply(confMask, bbArea)
-    maxArea = np.nanmax(maskedArea)
-    try:
-        idxMax = np.nanargmax(maskedArea)
-    except:
-        idxMax = np.nan
+    
+    # Max area and its (first) frame, ignoring nans.
+    maxArea = np.fmax.reduce(maskedArea, axis=-1)
+    allNan = np.all(np.isnan(maskedArea), axis=-1)
+    idxMax = np.argmax(np.where(np.isnan(maskedArea), -np.inf, maskedArea), 
+                       axis=-1)
+    if np.ndim(idxMax) == 0:
+        idxMax = np.nan if allNan else idxMax
+    else:
+        idxMax = np.where(allNan, np.nan, idxMax)
    
     return maxArea, idxMax
 
 #%%
 def keypointsToBoundingBox(data,confidenceThreshold=0.3):
-    # input: nFrames x 75.
-    # output: nFrames x 4 (xTopLeft, yTopLeft, width, height).
-    
-    c_data = np.copy(data)
+    # input: (...) x nFrames x 75, e.g., nPeople x nFrames x 75.
+    # output: (...) x nFrames x 4 (xTopLeft, yTopLeft, width, height).
     
     # Remove face markers - they are intermittent.
     _, idxFaceMarkers = getOpenPoseFaceMarkers()
     idxToRemove = np.hstack([np.arange(i*3,i*3+3) for i in idxFaceMarkers])
-    c_data = np.delete(c_data, idxToRemove, axis=1)    
+    c_data = np.delete(data, idxToRemove, axis=-1)
+    c_data = c_data.reshape(c_data.shape[:-1] + (-1, 3))
     
     # nan the data if below a threshold
-    confData = c_data[:,2::3]<confidenceThreshold
-    confMask = np.repeat(confData, 3, axis=1)
-    c_data[confMask] = np.nan  
-    nonNanRows = np.argwhere(np.any(~np.isnan(c_data), axis=1))
-    
-    bbox = np.zeros((c_data.shape[0], 4))
-    bbox[nonNanRows,0] = np.nanmin(c_data[nonNanRows,0::3], axis=2)
-    bbox[nonNanRows,1] = np.nanmin(c_data[nonNanRows,1::3], axis=2)
-    bbox[nonNanRows,2] = (np.nanmax(c_data[nonNanRows,0::3], axis=2) - 
-                          np.nanmin(c_data[nonNanRows,0::3], axis=2))
-    bbox[nonNanRows,3] = (np.nanmax(c_data[nonNanRows,1::3], axis=2) - 
-                          np.nanmin(c_data[nonNanRows,1::3], axis=2))
+    lowConf = c_data[...,2] < confidenceThreshold
+    c_data[lowConf] = np.nan
+    nonNanRows = np.any(~np.isnan(c_data), axis=(-2,-1))
+    
+    # Min and max ignoring nans (fmin/fmax), 0 for rows without data.
+    xMin = np.fmin.reduce(c_data[...,0], axis=-1)
+    yMin = np.fmin.reduce(c_data[...,1], axis=-1)
+    bbox = np.zeros(c_data.shape[:-2] + (4,))
+    bbox[...,0] = np.where(nonNanRows, xMin, 0)
+    bbox[...,1] = np.where(nonNanRows, yMin, 0)
+    bbox[...,2] = np.where(nonNanRows, 
+                           np.fmax.reduce(c_data[...,0], axis=-1) - xMin, 0)
+    bbox[...,3] = np.where(nonNanRows,
+                           np.fmax.reduce(c_data[...,1], axis=-1) - yMin, 0)
     
     # Go a bit above head (this is for image-based tracker).
-    bbox[:,1] = np.maximum(0, bbox[:,1] - .05 * bbox[:,3])
-    bbox[:,3] = bbox[:,3] * 1.05
+    bbox[...,1] = np.maximum(0, bbox[...,1] - .05 * bbox[...,3])
+    bbox[...,3] = bbox[...,3] * 1.05
     
     return bbox
 
@@ -1452,16 +1831,14 @@ def findClosestBox(bbox,keyBoxes,imageSize,iPerson=None):
     # considered different person
     cornerChangeThreshold = 0.2 
     
-    keyBoxCorners = []
-    for keyBox in keyBoxes:
-        keyBoxCorners.append(np.array([keyBox[0], keyBox[1], 
-                                       keyBox[0] + keyBox[2],
-                                       keyBox[1] + keyBox[3]]))
+    # Corners of all boxes at once: nBoxes x 4.
+    keyBoxes = np.asarray(keyBoxes, dtype=float).reshape(-1, 4)
+    keyBoxCorners = np.concatenate(
+        (keyBoxes[:,:2], keyBoxes[:,:2] + keyBoxes[:,2:]), axis=1)
     bboxCorners = np.array(
         [bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]])
     
-    boxErrors = [
-        np.linalg.norm(keyBox - bboxCorners) for keyBox in keyBoxCorners]
+    boxErrors = np.linalg.norm(keyBoxCorners - bboxCorners, axis=1)
     try:
         if iPerson is None:
             iPerson = np.nanargmin(boxErrors)
@@ -1476,27 +1853,60 @@ def findClosestBox(bbox,keyBoxes,imageSize,iPerson=None):
         
     return iPerson,bbox,samePerson
 
+#%%
+def readVideoFrames(videoPath, frameStart, frameIncrement, nFrames,
+                    chunkSize=64):
+    # Yields (frameNum, frame) from frameStart in steps of frameIncrement (1 or
+    # -1) while 0 <= frameNum < nFrames, until a frame cannot be read. Frames
+    # are decoded sequentially rather than seeking to each one: forward after
+    # a single seek, backward in chunks of chunkSize frames that are decoded
+    # forward and yielded in reverse.
+    video = cv2.VideoCapture(videoPath)
+    try:
+        if frameIncrement > 0:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frameStart)
+            for frameNum in range(frameStart, nFrames):
+                ok, frame = video.read()
+                if not ok:
+                    return
+                yield frameNum, frame
+        else:
+            chunkEnd = frameStart if frameStart < nFrames else -1
+            while chunkEnd >= 0:
+                chunkStart = max(0, chunkEnd - chunkSize + 1)
+                video.set(cv2.CAP_PROP_POS_FRAMES, chunkStart)
+                chunk = []
+                for _ in range(chunkStart, chunkEnd + 1):
+                    ok, frame = video.read()
+                    if not ok:
+                        # The last frames of the chunk, which come first
+                        # going backward, cannot be read.
+                        return
+                    chunk.append(frame)
+                for frameNum in range(chunkEnd, chunkStart - 1, -1):
+                    yield frameNum, chunk[frameNum - chunkStart]
+                chunkEnd = chunkStart - 1
+    finally:
+        video.release()
+
 #%%
 def trackKeypointBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0 ,
                      frameIncrement = 1, visualize = False, poseDetector='OpenPose',
                      badFramesBeforeStop = 0):
     # Tracks closest keypoint bounding boxes until the box changes too much.
+    # allPeople: nPeople x nFrames x 75, allBoxes: nPeople x nFrames x 4 (see
+    # keypointsToBoundingBox).
+    # The video is only decoded for visualization, the image size comes from
+    # the video metadata.
     bboxKey = bbStart # starting bounding box
     frameNum = frameStart
 
-    # initiate video capture
-    # Read video
-    video = cv2.VideoCapture(videoPath.replace('.mov', '_rotated.avi'))
+    videoPath = videoPath.replace('.mov', '_rotated.avi')
     nFrames = allBoxes[0].shape[0]
+    imageSize = getVideoImageSize(videoPath)
+    if visualize:
+        frames = readVideoFrames(videoPath, frameStart, frameIncrement, nFrames)
     
-    # Read desiredFrames.
-    video.set(1, frameNum)
-    ok, frame = video.read()
-    if not ok:
-        print('Cannot read video file')
-        raise Exception('Cannot read video file')
-        
-    imageSize = (frame.shape[0],frame.shape[1])
     justStarted = True
     count = 0   
     badFrames = []
@@ -1504,13 +1914,13 @@ def trackKeypointBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0
         # Read a new frame
         
         if visualize:
-            video.set(1, frameNum)
-            ok, frame = video.read()
-            if not ok:
+            try:
+                _, frame = next(frames)
+            except StopIteration:
                 break
         
         # Find person closest to tracked bounding box, and fill their keypoint data
-        keyBoxes = [box[frameNum] for box in allBoxes]        
+        keyBoxes = allBoxes[:,frameNum]
         
         iPerson, bboxKey_new, samePerson = findClosestBox(bboxKey, keyBoxes, 
                                                 imageSize)
@@ -1562,6 +1972,7 @@ def trackKeypointBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0
 def trackBoundingBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0 ,frameIncrement = 1, visualize = False):
     # Uses image-based tracking to track person thru video
     # returns dataOut with single person nFrames x 75 
+    # allPeople: nPeople x nFrames x 75, allBoxes: nPeople x nFrames x 4.
         
     # Initialize tracker. KCF is accurate and semi-fast
     tracker = cv2.TrackerKCF_create()
@@ -1571,14 +1982,13 @@ def trackBoundingBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0
     bboxKey = bbStart
     frameNum = frameStart
     
-    # Read video
-    video = cv2.VideoCapture(videoPath.replace('.mov', '_rotated.avi'))
+    # Read video sequentially, starting at frameStart.
     nFrames = allBoxes[0].shape[0]
-
-    # Read desiredFrames.
-    video.set(1, frameNum)
-    ok, frame = video.read()
-    if not ok:
+    frames = readVideoFrames(videoPath.replace('.mov', '_rotated.avi'),
+                             frameStart, frameIncrement, nFrames)
+    try:
+        _, frame = next(frames)
+    except StopIteration:
         raise Exception('Cannot read video file')
          
     # Initialize tracker with first frame and bounding box
@@ -1591,13 +2001,15 @@ def trackBoundingBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0
     updateCounter = 0
     imageSize = (frame.shape[0],frame.shape[1])
     
+    # The first frame is also used for the first update.
     while frameNum > -1 and frameNum < nFrames:
         # Read a new frame
         
-        video.set(1, frameNum)
-        ok, frame = video.read()
-        if not ok:
-            break
+        if not justStarted:
+            try:
+                _, frame = next(frames)
+            except StopIteration:
+                break
                      
         # Start timer
         timer = cv2.getTickCount()
@@ -1629,7 +2041,7 @@ def trackBoundingBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0
             cv2.putText(frame, "FPS : " + str(int(fps)), (100,50), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (50,170,50), 2);
       
         # Find person closest to tracked bounding box, and fill their keypoint data
-        keyBoxes = [box[frameNum] for box in allBoxes]
+        keyBoxes = allBoxes[:,frameNum]
         iPerson, bboxKey, samePerson = findClosestBox(bbox,keyBoxes,imageSize) # it may be better to find the one closest to bboxKey, but then it wouldn't be leveraging
                                                                               # image based tracker except when person leaves scene
 
@@ -1669,10 +2081,14 @@ def trackBoundingBox(videoPath,bbStart,allPeople,allBoxes,dataOut,frameStart = 0
     return dataOut
 
 # %% 
-def removeOccludedSide(key2D,confidence,mkrInds,confThresh,visualize=False):
+def removeOccludedSide(key2D,confidence,mkrInds,confThresh,visualize=False,inPlace=False):
     
-    key2D_out = np.copy(key2D)
-    confidence_out = np.copy(confidence)
+    if inPlace:
+        key2D_out = key2D
+        confidence_out = confidence
+    else:
+        key2D_out = np.copy(key2D)
+        confidence_out = np.copy(confidence)
     
     #Parameters
     confDif = .2 # the difference in mean confidence between R and L sided markers. If dif > confDif, must be occluded
@@ -1696,76 +2112,43 @@ def removeOccludedSide(key2D,confidence,mkrInds,confThresh,visualize=False):
         plt.ylabel('mean confidence')
     
     
-    rOccluded = np.where(np.logical_and(np.less(dConf,confDif) , np.less(rConf,confThresh)))[0]
-    lOccluded = np.where(np.logical_and(np.greater(dConf,confDif) , np.less(lConf,confThresh)))[0]
+    rOccluded = np.logical_and(np.less(dConf,confDif) , np.less(rConf,confThresh))
+    lOccluded = np.logical_and(np.greater(dConf,confDif) , np.less(lConf,confThresh))
     
-    # if inleading and exiting values are in occluded list, don't change them
-    def zeroPad(occInds,nSamps):
-    
-        # Default: not setting confidence of any indices to 0
-        zeroInds = np.empty([0],dtype=np.int64)
-        
-        if len(occInds) == 0:
-            return occInds,zeroInds
-
-        # find gaps
-        dInds = np.diff(occInds,prepend=1)
-
-        #all first vals        
-        if occInds[0] == 0:
-            #special case - occlusion starts at beginning but there are no gaps afterwards
-            if not any(dInds>1):
-                zeroInds = np.concatenate((zeroInds, np.copy(occInds)))
-                occInds = []
-                return occInds, zeroInds
-
-            else:
-                # otherwise, remove in-leading indices
-                firstGap = np.argwhere(dInds>1)[0]
-                occInds = np.delete(occInds,np.arange(firstGap))
-                dInds = np.delete(dInds,np.arange(firstGap))
-                zeroInds = np.concatenate((zeroInds, np.arange(firstGap)))
-
-        #all end vals
-        if occInds[-1] == nSamps-1:
-            #special case - occlusion goes to end but there are no gaps beforehand
-            if not any(dInds>1):
-                zeroInds = np.concatenate((zeroInds, np.copy(occInds)))
-                occInds = []
-            else:
-                # otherwise, remove end zeros
-                lastGap = np.argwhere(dInds>1)[-1]
-                occInds_init = np.copy(occInds)
-                occInds = np.delete(occInds,np.arange(lastGap,len(occInds)))
-                zeroInds = np.concatenate((zeroInds, np.arange(occInds_init[lastGap[0]],occInds_init[-1]+1)))
-
-        return occInds, zeroInds
-
-    nSamps = len(rConf)
-    # Assumes that occlusion can't happen starting in first frame or ending in last frame. Looks for first "gap"
-    rOccluded,rZeros = zeroPad(rOccluded,nSamps)
-    lOccluded,lZeros = zeroPad(lOccluded,nSamps)    
-    
-    # Couldn't figure out how to index multidimensions...
-    # Set occlusion confidences to nan. Later, the keypoints with associated nan confidence will be cubic splines, 
-    # and the confidence will get set to something like 0.5 for weighted triangulation in utilsCameraPy3 
-    for mkr in lMkrs:
-        if np.count_nonzero(confidence_out[mkr,:]>0)>3:
-            lNan = np.intersect1d(lOccluded,np.arange(np.argwhere(confidence_out[mkr,:]>0)[1],np.argwhere(confidence_out[mkr,:]>0)[-1])) # don't add nans to 0 pad
-        else:
-            lNan = np.array([],dtype='int64')
-        key2D_out[mkr,lNan.astype(int),:] = np.nan
-        confidence_out[mkr,lNan.astype(int)] = np.nan
-        confidence_out[mkr,lZeros] = 0
-        
-    for mkr in rMkrs:
-        if np.count_nonzero(confidence_out[mkr,:]>0)>3:  
-            rNan = np.intersect1d(rOccluded,np.arange(np.argwhere(confidence_out[mkr,:]>0)[1],np.argwhere(confidence_out[mkr,:]>0)[-1])) # don't add nans to 0 pad
+    # If inleading and exiting frames are occluded, don't set them to nan but
+    # set their confidence to 0: split the occluded frames into the runs 
+    # starting at the first or ending at the last frame (zeros) and the others.
+    def zeroPad(occluded):
+        frames = np.arange(len(occluded))
+        notOccluded = np.flatnonzero(~occluded)
+        if len(notOccluded) == 0:
+            zeros = occluded.copy()
         else:
-            rNan = np.array([],dtype='int64')
-        key2D_out[mkr,rNan.astype(int),:] = np.nan
-        confidence_out[mkr,rNan.astype(int)] = np.nan
-        confidence_out[mkr,rZeros] = 0
+            zeros = (frames < notOccluded[0]) | (frames > notOccluded[-1])
+        return occluded & ~zeros, zeros
+
+    rOccluded,rZeros = zeroPad(rOccluded)
+    lOccluded,lZeros = zeroPad(lOccluded)    
+    
+    # Set occlusion confidences to nan, all markers of each side at once. 
+    # Later, the keypoints with associated nan confidence will be cubic 
+    # splines, and the confidence will get set to something like 0.5 for 
+    # weighted triangulation in utilsCameraPy3. Only markers with >3 frames
+    # with >0 confidence are set to nan, and only from their second to their
+    # last of these frames (don't add nans to 0 pad).
+    frames = np.arange(len(rConf))
+    for mkrs, occluded, zeros in ((lMkrs, lOccluded, lZeros), 
+                                  (rMkrs, rOccluded, rZeros)):
+        mkrs = np.asarray(mkrs)
+        positive = confidence_out[mkrs,:] > 0
+        second = np.argmax(np.cumsum(positive, axis=1) >= 2, axis=1)
+        last = positive.shape[1] - 1 - np.argmax(positive[:,::-1], axis=1)
+        setNan = (occluded & (frames >= second[:,None]) & (frames < last[:,None])
+                  & (np.count_nonzero(positive, axis=1) > 3)[:,None])
+        iMkr, iFrame = np.nonzero(setNan)
+        key2D_out[mkrs[iMkr],iFrame,:] = np.nan
+        confidence_out[mkrs[iMkr],iFrame] = np.nan
+        confidence_out[np.ix_(mkrs,np.flatnonzero(zeros))] = 0
 
     
     if visualize:
@@ -1785,46 +2168,27 @@ def removeOccludedSide(key2D,confidence,mkrInds,confThresh,visualize=False):
 
 
 # %%
-def unpackKeypointList(keypointList):
-    nFrames = keypointList[0].shape[1]
-    unpackedKeypoints = []
-    for iFrame in range(nFrames):
-        tempList = []
-        for keyArray in keypointList:
-            tempList.append(keyArray[:,iFrame,None,:])
-        unpackedKeypoints.append(tempList.copy())
-        
-    return unpackedKeypoints
-
-# %%
-def repackKeypointList(unpackedKeypointList):
-    nFrames = len(unpackedKeypointList)
-    nCams = len(unpackedKeypointList[0])
-    nMkrs = unpackedKeypointList[0][0].shape[0]
-    
-    repackedKeypoints = []
-    
-    for iCam in range(nCams):
-        tempArray = np.empty((nMkrs,nFrames,2))
-        for iFrame in range(nFrames):
-            tempArray[:,iFrame,:] = np.squeeze(unpackedKeypointList[iFrame][iCam])
-        repackedKeypoints.append(np.copy(tempArray))
-    
-    return repackedKeypoints
-
-# %%
-def undistort2Dkeypoints(pointList2D, CameraParamList, useIntrinsicMatAsP=True):
-    # list of 2D points per image
-    pointList2Dundistorted = []
-    
-    for i,points2D in enumerate(pointList2D):
-        if useIntrinsicMatAsP:
-            res = cv2.undistortPoints(points2D,CameraParamList[i]['intrinsicMat'],CameraParamList[i]['distortion'],P=CameraParamList[i]['intrinsicMat'])
-        else:
-            res = cv2.undistortPoints(points2D,CameraParamList[i]['intrinsicMat'],CameraParamList[i]['distortion'])
-        pointList2Dundistorted.append(res.copy())
-    
-    return pointList2Dundistorted
+def undistortKeypoints(keypointList, CameraParams, out=None):
+    # Undistort the 2D keypoints of all cameras (all markers and frames) with
+    # one cv2.undistortPoints call per camera, using the intrinsic matrices
+    # as new camera matrices (i.e., the undistorted keypoints stay in pixels).
+    # keypointList: nCams x (nMkrs x nFrames x 2), list or array.
+    # CameraParams: CameraRig or list of camera parameter dicts.
+    # out: nCams x nMkrs x nFrames x 2 float64 or float32 buffer the 
+    # undistorted keypoints are written to (float64 allocated if None), may be
+    # keypointList itself (e.g., MultiCamKeypoints.keypoints).
+    # Returns the nCams x nMkrs x nFrames x 2 array of undistorted keypoints.
+    if not isinstance(CameraParams, CameraRig):
+        CameraParams = CameraRig.from_camera_params(CameraParams)
+    if out is None:
+        out = np.empty((len(keypointList),) + np.shape(keypointList[0]))
+    # Gather the keypoints in the buffer and undistort them in place.
+    if keypointList is not out:
+        for iCam, keypoints in enumerate(keypointList):
+            out[iCam] = keypoints
+    CameraParams.undistort(out, out=out)
+    
+    return out
 
 # %%
 def getVertVelocity(key2D):
@@ -1838,7 +2202,7 @@ def getVertVelocity(key2D):
 # %%
 # get 2D speed of specified markers
 def getMarkerSpeed(key2D,idxMkrs = [0],confidence = None, confThresh = 0.2, averageVels=False):
-    c_conf = copy.deepcopy(confidence)
+    c_conf = confidence # read only
     
     diffOrder = 1 ;
     # 2d marker speed
@@ -1863,19 +2227,21 @@ def getMarkerSpeed(key2D,idxMkrs = [0],confidence = None, confThresh = 0.2, aver
     return vertVelTotal
 
 # %%
-def smoothKeypoints(key2D,sdKernel=1):
-    key2D_out = np.copy(key2D)
-    for i in range(25):
-        for j in range(2):
-            key2D_out[i,:,j] = np.apply_along_axis(
-                lambda x: gaussian_filter1d(x, sdKernel),
-                arr = key2D_out[i,:,j],
-                axis = 0)
+def smoothKeypoints(key2D,sdKernel=1,inPlace=False):
+    if inPlace:
+        key2D_out = key2D
+    else:
+        key2D_out = np.copy(key2D)
+    # Filter along the time axis, all (25 body) markers and coordinates at once.
+    key2D_out[:25] = gaussian_filter1d(key2D_out[:25], sdKernel, axis=1)
     return key2D_out
 
 # %% 
-def filterKeypointsButterworth(key2D,filtFreq,sampleFreq,order=4):
-    key2D_out = np.copy(key2D)
+def filterKeypointsButterworth(key2D,filtFreq,sampleFreq,order=4,inPlace=False):
+    if inPlace:
+        key2D_out = key2D
+    else:
+        key2D_out = np.copy(key2D)
     wn = filtFreq/(sampleFreq/2)
     if wn>1:
         print('You tried to filter ' + str(int(sampleFreq)) + ' Hz signal with cutoff freq of ' + str(int(filtFreq)) + '. Will filter at ' + str(int(sampleFreq/2)) + ' instead.')
@@ -1907,6 +2273,121 @@ def filter3DPointsButterworth(points3D,filtFreq,sampleFreq,order=4):
         
     return points3D_out
 
+# %%
+def interpolateMissingSamples(y, missing, linearInterp=False):
+    # Fill the samples of y flagged in missing by interpolating each row over
+    # its other samples, for all rows at once. Same values as np.interp
+    # (linearInterp) or pchip_interpolate (otherwise) applied row by row, 
+    # including the extrapolation before the first and after the last sample.
+    # Rows with a single sample left are interpolated linearly, rows without
+    # samples left are not modified.
+    # y: nRows x nSamples, modified in place. missing: boolean, same shape.
+    if not y.flags['C_CONTIGUOUS']:
+        yContiguous = np.ascontiguousarray(y)
+        interpolateMissingSamples(yContiguous, missing, linearInterp)
+        y[...] = yContiguous
+        return y
+    nSamples = y.shape[1]
+    yFlat = y.reshape(-1)
+    valid = ~missing.reshape(-1)
+    nValid = np.count_nonzero(~missing, axis=1)
+    
+    # Knots (valid samples) of all rows concatenated: within a row, knot k is
+    # followed by knot k+1. Last knot at or before each missing sample, which
+    # is before rowFirst for inleading samples.
+    knots = np.flatnonzero(valid)
+    knotY = yFlat[knots]
+    rowFirst = np.cumsum(nValid) - nValid
+    rowLast = rowFirst + nValid - 1
+    samples = np.flatnonzero(missing.reshape(-1) & 
+                             np.repeat(nValid>0, nSamples))
+    if samples.size == 0:
+        return y
+    rows = samples // nSamples
+    k = np.searchsorted(knots, samples) - 1
+    
+    def slope(k0):
+        return (knotY[k0+1] - knotY[k0]) / (knots[k0+1] - knots[k0])
+    
+    # Linear interpolation, values are carried over backward and forward for 
+    # inleading and exiting samples. Also used for rows with a single knot.
+    linear = (nValid[rows] < 2) | linearInterp
+    if np.any(linear):
+        s, r, kl = samples[linear], rows[linear], k[linear]
+        before = kl < rowFirst[r]
+        after = kl == rowLast[r]
+        values = np.where(before, knotY[rowFirst[r]], knotY[rowLast[r]])
+        inside = ~before & ~after
+        ki = kl[inside]
+        values[inside] = slope(ki)*(s[inside] - knots[ki]) + knotY[ki]
+        yFlat[s] = values
+        if linearInterp:
+            return y
+        samples, rows, k = samples[~linear], rows[~linear], k[~linear]
+    
+    # Piecewise cubic Hermite interpolation, inleading and exiting samples are
+    # extrapolated from the first and last intervals. Coefficients are
+    # computed once per interval used.
+    k = np.clip(k, rowFirst[rows], rowLast[rows]-1)
+    newInterval = np.ones(k.shape, dtype=bool)
+    newInterval[1:] = k[1:] != k[:-1]
+    k0 = k[newInterval]
+    intervalRows = rows[newInterval]
+    
+    # Derivatives at the knots, following scipy's PchipInterpolator.
+    def derivatives(kd):
+        r = intervalRows
+        d = np.zeros(kd.shape)
+        first = kd == rowFirst[r]
+        last = kd == rowLast[r]
+        # Two knots only: linear.
+        twoKnots = nValid[r] == 2
+        d[twoKnots] = slope(rowFirst[r[twoKnots]])
+        # Interior knots: weighted harmonic mean of the adjacent slopes, or 0
+        # if they have different signs or one of them is 0.
+        interior = ~first & ~last
+        ki = kd[interior]
+        m0, m1 = slope(ki-1), slope(ki)
+        h0, h1 = knots[ki] - knots[ki-1], knots[ki+1] - knots[ki]
+        condition = (np.sign(m0) != np.sign(m1)) | (m0 == 0) | (m1 == 0)
+        w1 = 2*h1 + h0
+        w2 = h1 + 2*h0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            whmean = (w1/m0 + w2/m1) / (w1 + w2)
+            d[interior] = np.where(condition, 0., 1./whmean)
+        # End knots: one-sided three-point estimate.
+        for end, kA, kB, kC in (
+                (first & ~twoKnots, kd, kd+1, kd+2), 
+                (last & ~twoKnots, kd, kd-1, kd-2)):
+            kA, kB, kC = kA[end], kB[end], kC[end]
+            h0, h1 = knots[kA] - knots[kB], knots[kB] - knots[kC]
+            m0 = (knotY[kA] - knotY[kB]) / h0
+            m1 = (knotY[kB] - knotY[kC]) / h1
+            h0, h1 = np.abs(h0), np.abs(h1)
+            dEnd = ((2*h0 + h1)*m0 - h0*m1) / (h0 + h1)
+            mask = np.sign(dEnd) != np.sign(m0)
+            mask2 = (np.sign(m0) != np.sign(m1)) & (np.abs(dEnd) > 3.*np.abs(m0))
+            dEnd[~mask & mask2] = 3.*m0[~mask & mask2]
+            dEnd[mask] = 0.
+            d[end] = dEnd
+        return d
+    
+    d0 = derivatives(k0)
+    d1 = derivatives(k0+1)
+    dx = knots[k0+1] - knots[k0]
+    m = slope(k0)
+    t = (d0 + d1 - 2*m) / dx
+    c0 = t / dx
+    c1 = (m - d0) / dx - t
+    
+    # Evaluate.
+    interval = np.cumsum(newInterval) - 1
+    s = samples - knots[k0][interval]
+    yFlat[samples] = (knotY[k0][interval] + d0[interval]*s + 
+                      c1[interval]*(s*s) + c0[interval]*(s*s*s))
+    
+    return y
+
 # %%
 def clean2Dkeypoints(key2D, confidence, confidenceThreshold=0.5, nCams=2, 
                      linearInterp=False):
@@ -1915,126 +2396,302 @@ def clean2Dkeypoints(key2D, confidence, confidenceThreshold=0.5, nCams=2,
     confidence_out = np.copy(confidence)
     confidence_sync_out = np.copy(confidence)
     
-    nMkrs = key2D_out.shape[0]    
+    nMkrs, nFrames = key2D_out.shape[:2]
     markerNames = getOpenPoseMarkerNames()
+    faceMarkers, _ = getOpenPoseFaceMarkers()
     
     # Turn all 0s into nans.
     key2D_out[key2D_out==0] = np.nan    
     
-    # Turn low confidence values to 0s if >2 cameras and nans otherwise.
-    for i in range(nMkrs):        
-        # If a marker has at least two frames with positive confidence,
-        # then identify frames where confidence is lower than threshold.
-        if len(np.argwhere(confidence_out[i,:]>0))>2:
-            nanInds = np.where(confidence_out[i,:] < confidenceThreshold)
-        # If a marker doesn't have two frames with positive confidence,
-        # then return empty list.    
-        else:
-            nanInds = []
-            faceMarkers = getOpenPoseFaceMarkers()[0]
-            # no warning if face marker
-            if not markerNames[i] in faceMarkers:
-                print('There were <2 frames with >0 confidence for {}'.format(
-                    markerNames[i]))
-        # Turn low confidence values to 0s if >2 cameras.
-        # Frames with confidence values of 0s are ignored during triangulation.
-        if nCams>2:
-            confidence_out[i,nanInds] = 0
-        # Turn low confidence values to nans if 2 cameras.
-        # Frames with nan confidence values are splined, and nan confidences
-        # are replaced by 0.5 during triangulation.
-        else:
-            confidence_out[i,nanInds] = np.nan            
-        # Turn inleading and exiting nans into 0s
-        idx_nonnans = ~np.isnan(confidence_out[i,:])
-        idx_nonzeros  = confidence_out[i,:] != 0            
-        idx_nonnanszeros = idx_nonnans & idx_nonzeros
-        if True in idx_nonnanszeros:
-            idx_nonnanszeros_first = np.where(idx_nonnanszeros)[0][0]
-            idx_nonnanszeros_last = np.where(idx_nonnanszeros)[0][-1]
-            confidence_out[i,:idx_nonnanszeros_first] = 0
-            confidence_out[i,idx_nonnanszeros_last:] = 0 
-        else:
-            confidence_out[i,:] = 0                    
-            
-        # Turn low confidence values to 0s for confidence_sync_out whatever
-        # the number of cameras; confidence_sync_out is used for 
-        # calculating the reprojection error, and using nans rather than 
-        # 0s might affect the outcome.
-        confidence_sync_out[i,nanInds] = 0
-        # Turn inleading and exiting nans into 0s
-        idx_nonnans = ~np.isnan(confidence_sync_out[i,:])
-        idx_nonzeros  = confidence_sync_out[i,:] != 0            
-        idx_nonnanszeros = idx_nonnans & idx_nonzeros
-        if True in idx_nonnanszeros:
-            idx_nonnanszeros_first = np.where(idx_nonnanszeros)[0][0]
-            idx_nonnanszeros_last = np.where(idx_nonnanszeros)[0][-1]
-            confidence_sync_out[i,:idx_nonnanszeros_first] = 0
-            confidence_sync_out[i,idx_nonnanszeros_last:] = 0 
-        else:
-            confidence_sync_out[i,:] = 0
-        
-        # Turn keypoint values to nan if confidence is low. Keypoints with nan
-        # will be interpolated. In cases with more than 2 cameras, this will
-        # have no impact on triangulation, since corresponding confidence is 0.
-        # But with 2 cameras, we need the keypoint 2D coordinates to
-        # be interpolated. In both cases, not relying on garbage keypoints for
-        # interpolation matters when computing keypoint speeds, which are used
-        # for synchronization.            
-        key2D_out[i,nanInds,:] = np.nan
-    
-    # Helper function.
-    def nan_helper(y):
-        return np.isnan(y), lambda z: z.nonzero()[0]
-    
-    # Interpolate keypoints with nans.
-    for i in range(nMkrs):
-        for j in range(2):
-            if np.isnan(key2D_out[i,:,j]).all(): # only nans
-                key2D_out[i,:,j] = 0
-            elif np.isnan(key2D_out[i,:,j]).any():  # partially nans
-                nans, x = nan_helper(key2D_out[i,:,j])
-                if linearInterp:
-                    # Note: with linear interpolation, values are carried over
-                    # backward and forward for inleading and exiting nans.
-                    key2D_out[i,nans,j] = np.interp(x(nans), x(~nans), 
-                                                    key2D_out[i,~nans,j]) 
-                else:
-                    # Note: with cubic interpolate, values are garbage for
-                    # inleading and exiting nans.
-                    try:
-                        key2D_out[i,:,j] = pchip_interpolate(
-                            x(~nans), key2D_out[i,~nans,j], 
-                            np.arange(key2D_out.shape[1]))    
-                    except:
-                        key2D_out[i,nans,j] = np.interp(x(nans), x(~nans), 
-                                                        key2D_out[i,~nans,j])
+    # If a marker has at least two frames with positive confidence,
+    # then identify frames where confidence is lower than threshold.
+    validMarkers = np.count_nonzero(confidence_out>0, axis=1) > 2
+    nanInds = (confidence_out < confidenceThreshold) & validMarkers[:,None]
+    for i in np.flatnonzero(~validMarkers):
+        # no warning if face marker
+        if not markerNames[i] in faceMarkers:
+            print('There were <2 frames with >0 confidence for {}'.format(
+                markerNames[i]))
+    
+    # Turn low confidence values to 0s if >2 cameras.
+    # Frames with confidence values of 0s are ignored during triangulation.
+    if nCams>2:
+        confidence_out[nanInds] = 0
+    # Turn low confidence values to nans if 2 cameras.
+    # Frames with nan confidence values are splined, and nan confidences
+    # are replaced by 0.5 during triangulation.
+    else:
+        confidence_out[nanInds] = np.nan
+    # Turn low confidence values to 0s for confidence_sync_out whatever
+    # the number of cameras; confidence_sync_out is used for 
+    # calculating the reprojection error, and using nans rather than 
+    # 0s might affect the outcome.
+    confidence_sync_out[nanInds] = 0
+    
+    # Turn inleading and exiting nans into 0s: everything before the first
+    # and from the last non-nan non-zero confidence on, or everything if there
+    # is none.
+    frames = np.arange(nFrames)
+    for conf in (confidence_out, confidence_sync_out):
+        idx_nonnanszeros = ~np.isnan(conf) & (conf != 0)
+        idx_first = np.argmax(idx_nonnanszeros, axis=1)
+        idx_last = nFrames - 1 - np.argmax(idx_nonnanszeros[:,::-1], axis=1)
+        conf[(frames < idx_first[:,None]) | (frames >= idx_last[:,None]) |
+             ~np.any(idx_nonnanszeros, axis=1)[:,None]] = 0
+    
+    # Turn keypoint values to nan if confidence is low. Keypoints with nan
+    # will be interpolated. In cases with more than 2 cameras, this will
+    # have no impact on triangulation, since corresponding confidence is 0.
+    # But with 2 cameras, we need the keypoint 2D coordinates to
+    # be interpolated. In both cases, not relying on garbage keypoints for
+    # interpolation matters when computing keypoint speeds, which are used
+    # for synchronization.            
+    key2D_out[nanInds] = np.nan
+    
+    # Interpolate keypoints with nans, all markers and coordinates at once.
+    # Note: with linear interpolation, values are carried over backward and 
+    # forward for inleading and exiting nans. With cubic interpolation, values
+    # are garbage for inleading and exiting nans.
+    series = np.moveaxis(key2D_out, 2, 1).reshape(-1, nFrames)
+    nans = np.isnan(series)
+    interpolateMissingSamples(series, nans, linearInterp=linearInterp)
+    series[np.all(nans, axis=1)] = 0 # only nans
+    key2D_out[...] = np.moveaxis(series.reshape(nMkrs, 2, nFrames), 1, 2)
                         
     # Keep track of inleading and exiting nans when less than 3 cameras.
     if nCams>2:
         nans_in_out = np.array([np.nan, np.nan])        
     else:
-        _, idxFaceMarkers = getOpenPoseFaceMarkers()       
-        nans_in = []
-        nans_out = []
-        for i in range(nMkrs):
-            if i not in idxFaceMarkers:
-                idx_nans = np.isnan(confidence_out[i,:])
-                if False in idx_nans:
-                    nans_in.append(np.where(idx_nans==False)[0][0])
-                    nans_out.append(np.where(idx_nans==False)[0][-1])
-                else:
-                    nans_in.append(np.nan)
-                    nans_out.append(np.nan)                    
-        in_max = np.max(np.asarray(nans_in))
-        out_min = np.min(np.asarray(nans_out))        
-        nans_in_out = np.array([in_max, out_min])
-    
+        nans_in_out = getNansInOut(confidence_out)
 
     return key2D_out, confidence_out, nans_in_out, confidence_sync_out
 
 # %%
-def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=None, frameRate=60):
+def getNansInOut(confidence):
+    # Inleading and exiting nans of the nMkrs x nFrames confidence cleaned
+    # for 2 cameras (see clean2Dkeypoints): the latest first and the earliest
+    # last frame with a non-nan confidence over the body markers, nan if a
+    # body marker only has nans.
+    _, idxFaceMarkers = getOpenPoseFaceMarkers()
+    nFrames = confidence.shape[1]
+    bodyMarkers = np.setdiff1d(np.arange(confidence.shape[0]), idxFaceMarkers)
+    idx_nonnans = ~np.isnan(confidence[bodyMarkers,:])
+    allNans = ~np.any(idx_nonnans, axis=1)
+    nans_in = np.argmax(idx_nonnans, axis=1).astype(float)
+    nans_out = (nFrames - 1 - np.argmax(idx_nonnans[:,::-1], axis=1)
+                ).astype(float)
+    nans_in[allNans] = np.nan
+    nans_out[allNans] = np.nan
+    
+    return np.array([np.max(nans_in), np.min(nans_out)])
+
+# %%
+def normalizedCrossCorrelation(Y1, Y2, maxLag=None):
+    # Normalized cross correlation of each row of Y1 with the same row of Y2,
+    # for all rows at once with one batched rfft. Same values as
+    # np.correlate(y1, y2, mode='same') divided by the unbiased sample size
+    # (N - |lag|) and by the root of the product of the auto-correlations.
+    # Y1, Y2: nSignals x nSamples. The shorter one is padded with 0s.
+    # maxLag: if not None, only lags within +/- maxLag are returned, or only
+    # lags within [maxLag[0], maxLag[1]] if it is a (min, max) pair.
+    # Returns corr (nSignals x nLags), lags (nLags), and the padded length N.
+    Y1 = np.atleast_2d(np.asarray(Y1, dtype=float))
+    Y2 = np.atleast_2d(np.asarray(Y2, dtype=float))
+    N = np.max([Y1.shape[1], Y2.shape[1]])
+    
+    # Lags of np.correlate(mode='same'): index i is lag i - N//2.
+    firstLag = -(N//2)
+    lastLag = N - 1 - N//2
+    if maxLag is not None:
+        if np.isscalar(maxLag):
+            maxLag = (-maxLag, maxLag)
+        firstLag = int(np.max([firstLag, maxLag[0]]))
+        lastLag = int(np.min([lastLag, maxLag[1]]))
+    lags = np.arange(firstLag, lastLag+1)
+    
+    # Circular correlation without wrap-around: corr[lag] = sum_n y1[n+lag]*y2[n].
+    nFFT = scipy.fft.next_fast_len(2*N-1, real=True)
+    corr = scipy.fft.irfft(
+        scipy.fft.rfft(Y1, nFFT, axis=1) * 
+        np.conj(scipy.fft.rfft(Y2, nFFT, axis=1)), nFFT, axis=1)
+    corr = corr[:, np.mod(lags, nFFT)]
+    
+    # The unbiased sample size is N - lag.
+    unbiased_sample_size = N - np.abs(lags)
+    y1_auto_corr = np.sum(Y1**2, axis=1) / N
+    y2_auto_corr = np.sum(Y2**2, axis=1) / N
+    corr = (corr / unbiased_sample_size / 
+            np.sqrt(y1_auto_corr * y2_auto_corr)[:, np.newaxis])
+    
+    return corr, lags, N
+
+# %%
+def gaussianLagPrior(lags, N, std):
+    # Same weights as scipy.signal.gaussian(N, std) on a correlation curve of
+    # length N, evaluated at the given lags only.
+    n = (lags + N//2) - (N - 1.0) / 2.0
+    
+    return np.exp(-n**2 / (2*std*std))
+
+# %%
+def syncCorrelation(Y1, Y2, maxLag=None):
+    # Normalized cross correlation of the sync signals of two cameras,
+    # averaged over signals (e.g., markers). Returns corr (nLags) and lags
+    # (nLags), or (None, None) if one of the cameras has no signal.
+    Y1 = np.atleast_2d(Y1)
+    Y2 = np.atleast_2d(Y2)
+    if not np.any(Y1) or not np.any(Y2):
+        return None, None
+    corr, corrLags, _ = normalizedCrossCorrelation(Y1, Y2, maxLag=maxLag)
+
+    return np.nanmean(corr, axis=0), corrLags
+
+# %%
+def syncLagFromPrior(corr, corrLags, priorLag, priorWindow, dataForReproj=None,
+                     minCorr=0.5):
+    # Lag of the correlation peak within +/- priorWindow of priorLag, e.g.,
+    # the lag of the same camera in a previous trial of the session. Returns
+    # (None, None) if the best lag in the window is on its edge (i.e., not a
+    # local peak) or if its correlation is below minCorr. The full lag search
+    # should then be used instead. With dataForReproj (see
+    # prepareReprojectionForSync), the peak must also have a clearly smaller
+    # reprojection error than the (up to 2) closest other correlation peaks,
+    # since periodic motions have several similar peaks.
+    if corr is None:
+        return None, None
+    inds = np.flatnonzero(np.abs(corrLags - priorLag) <= priorWindow)
+    if len(inds) < 3:
+        return None, None
+    iPeak = inds[np.argmax(np.nan_to_num(corr[inds], nan=-np.inf))]
+    if iPeak in (inds[0], inds[-1]) or not corr[iPeak] >= minCorr:
+        return None, None
+    
+    if dataForReproj is not None:
+        peaks, _ = find_peaks(np.nan_to_num(corr), height=minCorr)
+        otherPeaks = peaks[peaks != iPeak]
+        otherPeaks = otherPeaks[np.argsort(np.abs(otherPeaks - iPeak))[:2]]
+        if len(otherPeaks) > 0:
+            reprojError, reprojSuccess = calcReprojectionErrorsForSync(
+                dataForReproj, corrLags[np.append(iPeak, otherPeaks)])
+            if (not np.all(reprojSuccess) or 
+                    not reprojError[0] < .6*np.min(reprojError[1:])):
+                return None, None
+
+    return corr[iPeak], corrLags[iPeak]
+
+# %%
+def checkSyncLag(dataForReproj, lag, frameRate, maxShiftSteps, 
+                 maxErrorRatio=1.25):
+    # Short reprojection check of a lag found without the keypoints, e.g.,
+    # from the audio tracks. The reprojection error at lag (see
+    # prepareReprojectionForSync) should not be larger than maxErrorRatio 
+    # times the error at lags +/- .1 and .25 seconds away and at lags every 
+    # .25 seconds within +/- maxShiftSteps. All lags are scored in one pass.
+    # Static trials have similar errors at all lags and pass. Lags for which 
+    # the cameras do not overlap enough to be scored are left out of the 
+    # comparison; the check fails if lag itself or all others cannot be scored.
+    offsets = np.round(np.array([.1, .25]) * frameRate).astype(int)
+    gridStep = int(np.max([1, np.round(.25 * frameRate)]))
+    lagGrid = np.arange(-(maxShiftSteps // gridStep) * gridStep,
+                        maxShiftSteps + 1, gridStep)
+    lags = np.concatenate(([lag], lag + offsets, lag - offsets, 
+                           lagGrid[lagGrid != lag])).astype(int)
+    reprojError, reprojSuccess = calcReprojectionErrorsForSync(
+        dataForReproj, lags)
+    
+    if not reprojSuccess[0] or not np.any(reprojSuccess[1:]):
+        return False
+    
+    return bool(reprojError[0] <= maxErrorRatio * 
+                np.min(reprojError[1:][reprojSuccess[1:]]))
+
+# %%
+def loadAudioTrack(videoPath, sampleRate=16000):
+    # Mono audio track of a video, decoded in one ffmpeg call and resampled
+    # to sampleRate. Returns the audio (nSamples) and the time of its first
+    # sample relative to the first video frame (s), or (None, None) if the
+    # video has no audio track or cannot be read.
+    try:
+        meta = probeVideo(videoPath)
+    except ffmpeg.Error:
+        return None, None
+    audioStreams = [stream for stream in meta['streams'] 
+                    if stream['codec_type'] == 'audio']
+    videoStreams = [stream for stream in meta['streams'] 
+                    if stream['codec_type'] == 'video']
+    if not audioStreams or not videoStreams:
+        return None, None
+    audioOffset = (float(audioStreams[0].get('start_time', 0)) - 
+                   float(videoStreams[0].get('start_time', 0)))
+    
+    try:
+        out, _ = (ffmpeg.input(videoPath)
+                  .output('pipe:', format='f32le', acodec='pcm_f32le', ac=1,
+                          ar=sampleRate)
+                  .run(capture_stdout=True, capture_stderr=True))
+    except ffmpeg.Error:
+        return None, None
+    audio = np.frombuffer(out, dtype=np.float32)
+    
+    return audio, audioOffset
+
+# %%
+def getAudioOnsetEnvelope(audio, sampleRate=16000, envelopeRate=200):
+    # Onset strength envelope of an audio signal at envelopeRate (Hz): 
+    # spectral flux, i.e., the positive change of the log-magnitude spectrum
+    # between consecutive windows, summed over frequencies. Windows are 2 
+    # hops long. The mean is removed such that the envelopes can be cross
+    # correlated.
+    hop = int(np.round(sampleRate / envelopeRate))
+    nWindow = 2*hop
+    if len(audio) < 2*nWindow:
+        return np.zeros(0)
+    windows = np.lib.stride_tricks.sliding_window_view(audio, nWindow)[::hop]
+    spectrum = np.log1p(np.abs(
+        scipy.fft.rfft(windows * np.hanning(nWindow), axis=1)))
+    envelope = np.sum(np.maximum(np.diff(spectrum, axis=0), 0), axis=1)
+    envelope = np.concatenate(([0], envelope))
+    
+    return envelope - np.mean(envelope)
+
+# %%
+def getAudioLags(audioList, audioOffsets, frameRate, sampleRate=16000,
+                 envelopeRate=200, maxShift=2, minCorr=0.3):
+    # Lags of each camera relative to the first camera from the cross
+    # correlation of the onset envelopes of their audio tracks (see
+    # loadAudioTrack), in video frames with the sign convention of
+    # synchronizeVideoKeypoints. Lags are not rounded: the correlation peak
+    # is refined with a parabola for sub-frame resolution. A lag is None if
+    # a camera has no audio, if the peak is weaker than minCorr, or if it is 
+    # at +/- maxShift seconds.
+    if audioList[0] is None:
+        return [None] * len(audioList)
+    envelopes = [getAudioOnsetEnvelope(audio, sampleRate, envelopeRate) 
+                 if audio is not None else np.zeros(0) for audio in audioList]
+    
+    lags = [0.]
+    for envelope, audioOffset in zip(envelopes[1:], audioOffsets[1:]):
+        if not np.any(envelope) or not np.any(envelopes[0]):
+            lags.append(None)
+            continue
+        corr, corrLags, _ = normalizedCrossCorrelation(
+            envelope, envelopes[0], maxLag=int(maxShift*envelopeRate))
+        corr = np.nan_to_num(corr[0], nan=-np.inf)
+        iPeak = np.argmax(corr)
+        if iPeak in (0, len(corr)-1) or not corr[iPeak] >= minCorr:
+            lags.append(None)
+            continue
+        y0, y1, y2 = corr[iPeak-1:iPeak+2]
+        delta = .5 * (y0 - y2) / (y0 - 2*y1 + y2) if y0 - 2*y1 + y2 < 0 else 0
+        lagTime = ((corrLags[iPeak] + delta) / envelopeRate + 
+                   audioOffset - audioOffsets[0])
+        lags.append(lagTime * frameRate)
+        
+    return lags
+
+# %%
+def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=None, frameRate=60,
+               maxLag=None):
     """Calculates the cross correlation and lags without normalization.
     
     The definition of the discrete cross-correlation is in:
@@ -2047,23 +2704,10 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
     max_corr: Maximum correlation without normalization.
     lag: The lag in terms of the index.
     """
-    # Pad shorter signal with 0s
-    if len(y1) > len(y2):
-        temp = np.zeros(len(y1))
-        temp[0:len(y2)] = y2
-        y2 = np.copy(temp)
-    elif len(y2)>len(y1):
-        temp = np.zeros(len(y2))
-        temp[0:len(y1)] = y1
-        y1 = np.copy(temp)
-        
-    y1_auto_corr = np.dot(y1, y1) / len(y1)
-    y2_auto_corr = np.dot(y2, y2) / len(y1)
-    corr = np.correlate(y1, y2, mode='same')
-    # The unbiased sample size is N - lag.
-    unbiased_sample_size = np.correlate(np.ones(len(y1)), np.ones(len(y1)), mode='same')
-    corr = corr / unbiased_sample_size / np.sqrt(y1_auto_corr * y2_auto_corr)
-    shift = len(y1) // 2
+    # Shorter signal gets padded with 0s
+    corr, corrLags, N = normalizedCrossCorrelation(y1, y2, maxLag=maxLag)
+    corr = corr[0]
+    shift = -corrLags[0]
     max_corr = np.max(corr)
     argmax_corr = np.argmax(corr)    
 
@@ -2074,7 +2718,7 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
         # inject no delay so it doesn't throw an error for static trials
         if len(peaks['peak_heights']) == 0:
             peaks['peak_heights'] = np.ndarray((1,1))
-            peaks['peak_heights'][0] = corr[int(len(corr)/2)]
+            peaks['peak_heights'][0] = corr[np.argmin(np.abs(corrLags))]
             print('There were no peaks in the vert vel cross correlation. Using 0 lag.')
         idxPeaks = np.squeeze(np.asarray([np.argwhere(peaks['peak_heights'][i]==corr) for i in range(len(peaks['peak_heights']))]))
         lags = idxPeaks-shift
@@ -2085,15 +2729,11 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
         if len(lags)>3:
             lags = lags[np.argsort(np.abs(lags))[:3]]
         
-        reprojError = np.empty((len(lags),1))
-        reprojSuccess = []
-        for iPeak,lag in enumerate(lags):
-            # calculate reprojection error for each potential lag
-            reprojError[iPeak,0], reprojSuccessi = calcReprojectionErrorForSync(
-                dataForReproj['CamParamList'], dataForReproj['keypointList'],
-                lag, dataForReproj['cams2UseReproj'], 
-                dataForReproj['confidence'], dataForReproj['cameras2Use'])
-            reprojSuccess.append(reprojSuccessi)
+        # calculate reprojection error for each potential lag
+        reprojError, reprojSuccess = calcReprojectionErrorsForSync(
+            dataForReproj, lags)
+        reprojError = reprojError[:,np.newaxis]
+        reprojSuccess = list(reprojSuccess)
         
         # find if min reproj error is clearly smaller than other peaks. If it is not,
         # don't use reproj error min for sync. E.g. with treadmill walking, reproj error may not work as
@@ -2103,7 +2743,7 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
         if reprojErrorRatio < 0.6 and not False in reprojSuccess: # tunable parameter. Usually around 0.25 for overground walking
             # find idx with minimum reprojection error 
             lag_corr = lags[np.argmin(reprojError)]
-            max_corr = corr[lag+shift]
+            max_corr = corr[lag_corr+shift]
             
             if multCorrGaussianStd is not None:
                 print('For {}, used reprojection error minimization to sync.'.format(dataForReproj['cameras2Use'][dataForReproj['cams2UseReproj'][1]]))
@@ -2115,13 +2755,10 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
             # Create a list of lags to test that is +/- .2 seconds around the selected lag based on frameRate
             numFrames = int(.2*frameRate)
             lags = np.arange(lag_corr-numFrames,lag_corr+numFrames+1)
-            reprojErrors = np.empty((len(lags),1))
-
-            for iLag,lag in enumerate(lags):            
-                reprojErrors[iLag,0], _ = calcReprojectionErrorForSync(
-                    dataForReproj['CamParamList'], dataForReproj['keypointList'],
-                    lag, dataForReproj['cams2UseReproj'], 
-                    dataForReproj['confidence'], dataForReproj['cameras2Use'])
+            if maxLag is not None: # stay within the searched lags
+                lags = lags[(lags >= corrLags[0]) & (lags <= corrLags[-1])]
+            reprojErrors, _ = calcReprojectionErrorsForSync(dataForReproj, lags)
+            reprojErrors = reprojErrors[:,np.newaxis]
                 
             # Select the lag with the lowest reprojection error
             lag = lags[np.argmin(reprojErrors)]
@@ -2148,7 +2785,7 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
         
     # Multiply correlation curve by gaussian (prioritizing lag solution closest to 0)
     if multCorrGaussianStd is not None:
-        corr = np.multiply(corr,gaussian(len(corr),multCorrGaussianStd))
+        corr = np.multiply(corr,gaussianLagPrior(corrLags,N,multCorrGaussianStd))
         if visualize: 
             plt.plot(corr,color=[.4,.4,.4])
             plt.legend(['corr','corr*gaussian'])  
@@ -2162,7 +2799,8 @@ def cross_corr(y1, y2,multCorrGaussianStd=None,visualize=False, dataForReproj=No
 
 
 # %%
-def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj=None,visualize=False,frameRate=60):
+def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj=None,visualize=False,frameRate=60,
+                                   maxLag=None):
     
     # SHAPE OF Y1,Y2 is nMkrs by nSamples
     """Calculates the cross correlation and lags without normalization.
@@ -2178,28 +2816,9 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
     lag: The lag in terms of the index.
     """
     nMkrs = Y1.shape[0]
-    corrMat = np.empty(Y1.shape)
-    for iMkr in range(nMkrs):
-        y1=Y1[iMkr,:]
-        y2=Y2[iMkr,:]
-        # Pad shorter signal with 0s
-        if len(y1) > len(y2):
-            temp = np.zeros(len(y1))
-            temp[0:len(y2)] = y2
-            y2 = np.copy(temp)
-        elif len(y2)>len(y1):
-            temp = np.zeros(len(y2))
-            temp[0:len(y1)] = y1
-            y1 = np.copy(temp)
-            
-        y1_auto_corr = np.dot(y1, y1) / len(y1)
-        y2_auto_corr = np.dot(y2, y2) / len(y1)
-        corr = np.correlate(y1, y2, mode='same')
-        # The unbiased sample size is N - lag
-        unbiased_sample_size = np.correlate(np.ones(len(y1)), np.ones(len(y1)), mode='same')
-        corr = corr / unbiased_sample_size / np.sqrt(y1_auto_corr * y2_auto_corr)
-        shift = len(y1) // 2
-        corrMat[iMkr,:] = corr  
+    # All markers at once. Shorter signals get padded with 0s.
+    corrMat, corrLags, N = normalizedCrossCorrelation(Y1, Y2, maxLag=maxLag)
+    shift = -corrLags[0]
     
     if visualize:
         plt.figure()
@@ -2216,9 +2835,11 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
     
     summedCorr = np.nansum(corrMat,axis=0)
     
-    # find correlation peak with minimum reprojection error
+    # find correlation peak with minimum reprojection error, if there are
+    # peaks (there may be none within a narrow lag window)
     if dataForReproj is not None:
         _,peaks = find_peaks(summedCorr, height=.75)
+    if dataForReproj is not None and len(peaks['peak_heights']) > 0:
         idxPeaks = np.squeeze(np.asarray([np.argwhere(peaks['peak_heights'][i]==summedCorr) for i in range(len(peaks['peak_heights']))]))
         lags = idxPeaks-shift
         # look at 3 lags closest to 0
@@ -2228,15 +2849,11 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
         if len(lags)>3:
             lags = lags[np.argsort(np.abs(lags))[:3]]
         
-        reprojError = np.empty((len(lags),1))
-        reprojSuccess = []
-        for iPeak,lag in enumerate(lags):
-            # calculate reprojection error for each potential lag
-            reprojError[iPeak,0], reprojSuccessi = calcReprojectionErrorForSync(
-                dataForReproj['CamParamList'], dataForReproj['keypointList'],
-                lag, dataForReproj['cams2UseReproj'], 
-                dataForReproj['confidence'], dataForReproj['cameras2Use'])
-            reprojSuccess.append(reprojSuccessi)
+        # calculate reprojection error for each potential lag
+        reprojError, reprojSuccess = calcReprojectionErrorsForSync(
+            dataForReproj, lags)
+        reprojError = reprojError[:,np.newaxis]
+        reprojSuccess = list(reprojSuccess)
         
         # find if min reproj error is clearly smaller than other peaks. If it is not,
         # don't use reproj error min for sync. E.g. with treadmill walking, reproj error may not work as
@@ -2246,7 +2863,7 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
         if reprojErrorRatio < 0.6 and not False in reprojSuccess: # tunable parameter. Usually around 0.25 for overground walking
             # find idx with minimum reprojection error 
             lag_corr = lags[np.argmin(reprojError)]
-            max_corr = summedCorr[lag+shift]
+            max_corr = summedCorr[lag_corr+shift]
             
             if multCorrGaussianStd is not None:
                 print('For {}, used reprojection error minimization to sync.'.format(dataForReproj['cameras2Use'][dataForReproj['cams2UseReproj'][1]]))
@@ -2258,13 +2875,10 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
             # Create a list of lags to test that is +/- .2 seconds around the selected lag based on frameRate
             numFrames = int(.2*frameRate)
             lags = np.arange(lag_corr-numFrames,lag_corr+numFrames+1)
-            reprojErrors = np.empty((len(lags),1))
-
-            for iLag,lag in enumerate(lags):            
-                reprojErrors[iLag,0], _ = calcReprojectionErrorForSync(
-                    dataForReproj['CamParamList'], dataForReproj['keypointList'],
-                    lag, dataForReproj['cams2UseReproj'], 
-                    dataForReproj['confidence'], dataForReproj['cameras2Use'])
+            if maxLag is not None: # stay within the searched lags
+                lags = lags[(lags >= corrLags[0]) & (lags <= corrLags[-1])]
+            reprojErrors, _ = calcReprojectionErrorsForSync(dataForReproj, lags)
+            reprojErrors = reprojErrors[:,np.newaxis]
                 
             # Select the lag with the lowest reprojection error
             lag = lags[np.argmin(reprojErrors)]
@@ -2285,7 +2899,7 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
         
     # Multiply correlation curve by gaussian (prioritizing lag solution closest to 0)
     if multCorrGaussianStd is not None:
-        summedCorr = np.multiply(summedCorr,gaussian(len(summedCorr),multCorrGaussianStd))
+        summedCorr = np.multiply(summedCorr,gaussianLagPrior(corrLags,N,multCorrGaussianStd))
         if visualize: 
             plt.plot(summedCorr,color=(.4,.4,.4))
     
@@ -2299,176 +2913,324 @@ def cross_corr_multiple_timeseries(Y1, Y2,multCorrGaussianStd=None,dataForReproj
 # If you set ignoreMissingMarkers to True, and pass the DISTORTED keypoints
 # as keypoints2D, the triangulation will ignore data from cameras that
 # returned (0,0) as marker coordinates.
-def triangulateMultiview(CameraParamList, points2dUndistorted, 
+def triangulateMultiview(cameraRig, points2dUndistorted, 
                           imageScaleFactor=1, useRotationEuler=False,
                           ignoreMissingMarkers=False,selectCamerasMinReprojError = False,
                           ransac = False, keypoints2D=[],confidence=None):
-    # create a list of cameras (says sequence in documentation) from CameraParamList
-    cameraList = []    
-    nCams = len(CameraParamList) 
-    nMkrs = np.shape(points2dUndistorted[0])[0]
-    
-    for camParams in CameraParamList:
-        # get rotation matrix
-        if useRotationEuler:
-            rotMat = cv2.Rodrigues(camParams['rotation_EulerAngles'])[0]
-        else:
-            rotMat = camParams['rotation']
-        
-        c = Camera()
-        c.set_K(camParams['intrinsicMat'])
-        c.set_R(rotMat)
-        c.set_t(np.reshape(camParams['translation'],(3,1)))
-        cameraList.append(c)
-           
+    # cameraRig is a CameraRig; a list of camera parameter dicts is also
+    # accepted, but then the rig gets rebuilt at every call.
+    if not isinstance(cameraRig, CameraRig):
+        cameraRig = CameraRig.from_camera_params(
+            cameraRig, use_rotation_euler=useRotationEuler)
+    nCams = len(cameraRig) 
    
     # triangulate
     stackedPoints = np.stack(points2dUndistorted)
-    pointsInput = []
-    for i in range(stackedPoints.shape[1]):
-        pointsInput.append(stackedPoints[:,i,0,:].T)
     
-   
-    points3d,confidence3d = nview_linear_triangulations(cameraList,pointsInput,weights=confidence)
-
+    if confidence is not None:
+        confidence = np.stack([np.atleast_1d(c) for c in confidence])
+    if ignoreMissingMarkers and nCams>2:
+        missingObservations = getMissingObservations(keypoints2D)[:,:,0]
+    else:
+        missingObservations = None
+    points3d,confidence3d = triangulateKeypoints(
+        cameraRig, stackedPoints[:,:,0,:], confidence=confidence, 
+        missingObservations=missingObservations,
+        selectCamerasMinReprojError=selectCamerasMinReprojError, ransac=ransac)
+    confidence3d = confidence3d[np.newaxis,:]
     
-    # Below are some outlier rejection methods
+    return points3d, confidence3d
+
+
+# %%
+def triangulateViewedCameras(cameraRig, points2D, points3D, missingObservations,
+                             confidence=None):
+    # Re-triangulates the points that were not identified by certain cameras
+    # with the cameras that could identify them only. Rather than 
+    # triangulating each point with its own camera subset, the missing 
+    # observations get 0 weight in one batched DLT over all points, which is
+    # equivalent (and points seen by less than 2 cameras are returned as 0).
+    # points2D: nCams x ... x 2 undistorted keypoints. points3D: 3 x ...
+    # triangulation with all cameras, kept for points without missing 
+    # observations. missingObservations: nCams x ... mask, see 
+    # getMissingObservations. confidence: nCams x ..., None for equal weights.
+    if confidence is None:
+        confidence = np.ones(missingObservations.shape)
+    points3DViewed, _ = cameraRig.triangulate(
+        points2D, weights=np.where(missingObservations, 0, confidence))
+    
+    return np.where(missingObservations.any(axis=0), points3DViewed, points3D)
+
+# %%
+def getCameraSubsets(nCams, minCams=2):
+    # All subsets of at least minCams cameras, as a boolean nSubsets x nCams
+    # mask matrix: all cameras first, then all combinations of nCams-1 
+    # cameras, and so on down to minCams (in itertools.combinations order).
+    subsets = []
+    for k in range(nCams, minCams-1, -1):
+        for camCombo in combinations(range(nCams), k):
+            subset = np.zeros(nCams, dtype=bool)
+            subset[list(camCombo)] = True
+            subsets.append(subset)
+            
+    return np.array(subsets).reshape(-1, nCams)
+
+# %%
+def triangulateMinReprojError(cameraRig, points2D, confidence=None,
+                              maxBatchSize=2**17):
+    # Select the combination of cameras that minimize mean reprojection error
+    # for all cameras, per point. Every subset of at least 2 cameras is 
+    # triangulated (weights of the other cameras set to 0), all subsets and
+    # points at once, and each point gets the 3D position of the subset with
+    # the smallest confidence-weighted reprojection error in all cameras
+    # (the first subset in getCameraSubsets order in case of ties).
+    # points2D: nCams x ... x 2 undistorted keypoints, e.g., nCams x nMkrs x 
+    # nFrames x 2. confidence: nCams x ..., None for equal weights.
+    # maxBatchSize: max number of (subset, point) pairs solved at once, to 
+    # bound memory.
+    # Returns the 3 x ... selected 3D points.
+    nCams = len(cameraRig)
+    points2D = np.asarray(points2D, dtype=float)
+    batchShape = points2D.shape[1:-1]
+    points2D = points2D.reshape(nCams, -1, 2)
+    nPoints = points2D.shape[1]
+    if confidence is None:
+        confidence = np.ones((nCams, nPoints))
+    else:
+        confidence = np.reshape(confidence, (nCams, nPoints))
+    
+    subsets = getCameraSubsets(nCams)
+    nSubsets = subsets.shape[0]
+    chunkSize = max(1, maxBatchSize // nSubsets)
+    points3D = np.empty((3, nPoints))
+    for start in range(0, nPoints, chunkSize):
+        chunk = slice(start, min(start+chunkSize, nPoints))
+        points2D_c = points2D[:,chunk]
+        conf_c = confidence[:,chunk]
+        
+        # Triangulate for all camera combinations: 3 x nSubsets x nChunk.
+        subsetWeights = np.where(subsets.T[:,:,np.newaxis], 
+                                 conf_c[:,np.newaxis,:], 0)
+        subsetPoints3D, _ = cameraRig.triangulate(
+            np.broadcast_to(points2D_c[:,np.newaxis], 
+                            (nCams, nSubsets) + points2D_c.shape[1:]),
+            weights=subsetWeights)
+        
+        # Per-point, confidence-weighted reprojection errors in all cameras
+        # (as calcReprojectionError): nSubsets x nChunk.
+        reproj = cameraRig.project(np.moveaxis(subsetPoints3D, 0, -1))
+        reprojError = np.linalg.norm(
+            (reproj - points2D_c[:,np.newaxis]) * 
+            conf_c[:,np.newaxis,:,np.newaxis], axis=-1)
+        meanReprojError = np.mean(reprojError, axis=0)
+        
+        # Select the triangulated point from camera set that minimized 
+        # reprojection error.
+        iBest = np.argmin(meanReprojError, axis=0)
+        points3D[:,chunk] = np.take_along_axis(
+            subsetPoints3D, iBest[np.newaxis,np.newaxis,:], axis=1)[:,0]
+    
+    return points3D.reshape((3,) + batchShape)
+
+# %%
+def triangulateRansac(cameraRig, points2D, confidence=None, seed=0, 
+                      errorUB=20, nGoodModel=3, maxBatchSize=2**17):
+    # RANSAC-like outlier rejection, on a per-point (not per-camera) basis.
+    # Each iteration draws a random camera pair (iteration i shuffles the
+    # cameras with seed seed+i, so results are reproducible), triangulates
+    # all points with it, and adds the cameras where the reprojection error 
+    # is below errorUB (pixels) as inliers. For each point, the first 
+    # iteration with the most inliers (at least nGoodModel cameras) is kept
+    # and the point is triangulated again with its inliers. Points without a
+    # good model keep their triangulation with all cameras. All hypotheses,
+    # and then all refits, are solved as batched DLTs.
+    # points2D: nCams x ... x 2 undistorted keypoints. confidence: nCams x 
+    # ..., None for equal weights.
+    # Returns the 3 x ... triangulated points.
+    nCams = len(cameraRig)
+    points2D = np.asarray(points2D, dtype=float)
+    batchShape = points2D.shape[1:-1]
+    points2D = points2D.reshape(nCams, -1, 2)
+    nPoints = points2D.shape[1]
+    if confidence is None:
+        confidence = np.ones((nCams, nPoints))
+    else:
+        confidence = np.reshape(confidence, (nCams, nPoints))
+    
+    # log(1 - prob of getting optimal set) / log(1-(n_inliers/n_points)^minPtsForModel)
+    nIter = int(np.round(np.log(.01)/np.log(1-np.power(.75,2))))
+    
+    # Camera pairs (maybe inliers) of all iterations: nIter x nCams.
+    maybeInliers = np.zeros((nIter, nCams), dtype=bool)
+    for iIter in range(nIter):
+        camCombo = np.arange(nCams)
+        np.random.RandomState(seed + iIter).shuffle(camCombo)
+        maybeInliers[iIter, camCombo[:2]] = True
+    
+    chunkSize = max(1, maxBatchSize // nIter)
+    points3D = np.empty((3, nPoints))
+    for start in range(0, nPoints, chunkSize):
+        chunk = slice(start, min(start+chunkSize, nPoints))
+        points2D_c = points2D[:,chunk]
+        conf_c = confidence[:,chunk]
+        
+        # Triangulate the maybe inliers of all iterations: 3 x nIter x nChunk.
+        hypotheses, _ = cameraRig.triangulate(
+            np.broadcast_to(points2D_c[:,np.newaxis], 
+                            (nCams, nIter) + points2D_c.shape[1:]),
+            weights=np.where(maybeInliers.T[:,:,np.newaxis], 
+                             conf_c[:,np.newaxis,:], 0))
+        
+        # Confidence-weighted reprojection error in each camera: the other
+        # cameras are inliers if it is below errorUB. nCams x nIter x nChunk.
+        reproj = cameraRig.project(np.moveaxis(hypotheses, 0, -1))
+        reprojError = np.linalg.norm(
+            (reproj - points2D_c[:,np.newaxis]) * 
+            conf_c[:,np.newaxis,:,np.newaxis], axis=-1)
+        inliers = maybeInliers.T[:,:,np.newaxis] | (reprojError < errorUB)
+        
+        # First iteration with the most inliers, if it is a good model.
+        nInliers = np.count_nonzero(inliers, axis=0)
+        nInliers[nInliers < nGoodModel] = 0
+        iBest = np.argmax(nInliers, axis=0)
+        goodModel = nInliers[iBest, np.arange(nInliers.shape[1])] > 0
+        bestInliers = np.take_along_axis(
+            inliers, iBest[np.newaxis,np.newaxis,:], axis=1)[:,0]
+        
+        # Triangulate with the inliers of the selected model, or with all
+        # cameras if there is no good model.
+        bestInliers[:,~goodModel] = True
+        points3D[:,chunk], _ = cameraRig.triangulate(
+            points2D_c, weights=np.where(bestInliers, conf_c, 0))
+    
+    return points3D.reshape((3,) + batchShape)
+
+# %%
+def triangulateKeypoints(cameraRig, keypoints, confidence=None,
+                         missingObservations=None, 
+                         selectCamerasMinReprojError=False, ransac=False):
+    # Batched triangulation of undistorted keypoints (nCams x ... x 2), with
+    # the optional outlier rejection methods (>2 cameras). confidence: 
+    # nCams x ..., None for equal weights. missingObservations: nCams x ... 
+    # mask of the observations to ignore (see getMissingObservations), None
+    # to use all of them.
+    # Returns the 3 x ... points and the ... confidence.
+    points3D, confidence3D = cameraRig.triangulate(keypoints, weights=confidence)
+    if len(cameraRig) <= 2:
+        return points3D, confidence3D
     
     # A slow, hacky way of rejecting outliers, like RANSAC. 
     # Select the combination of cameras that minimize mean reprojection error for all cameras
-    if selectCamerasMinReprojError and nCams>2:
-        
-        # Function definitions
-        def generateCameraCombos(nCams):
-            comb = [] ;
-            k=nCams-1 ;           
-            comb.append(tuple(range(nCams)))
-            while k>=2:
-                comb = comb + list(combinations(np.arange(nCams),k))
-                k=k-1
-            return comb
-        
-
-        # generate a list of all possible camera combinations down to 2
-        camCombos = generateCameraCombos(len(cameraList))
-        
-        # triangulate for all camera combiations
-        points3DList = []
-        nMkrs = confidence[0].shape[0]
-        reprojError = np.empty((nMkrs,len(camCombos)))
-                
-        for iCombo,camCombo in enumerate(camCombos):
-            camList = [cameraList[i] for i in camCombo]
-            points2DList = [pts[:,camCombo] for pts in pointsInput]
-            conf = [confidence[i] for i in camCombo]
-            
-            points3DList.append(nview_linear_triangulations(camList,points2DList,weights=conf))
-        
-            # compute per-marker, confidence-weighted reprojection errors for all camera combinations
-            # reprojError[:,iCombo] = calcReprojectionError(camList,points2DList,points3DList[-1],weights=conf)
-            reprojError[:,iCombo] = calcReprojectionError(cameraList,pointsInput,points3DList[-1],weights=confidence)
-
-        # select the triangulated point from camera set that minimized reprojection error
-        new3Dpoints = np.empty((3,nMkrs))
-        for iMkr in range(nMkrs):
-            new3Dpoints[:,iMkr] = points3DList[np.argmin(reprojError[iMkr,:])][:,iMkr]
-        
-        points3d = new3Dpoints
+    if selectCamerasMinReprojError:
+        points3D = triangulateMinReprojError(cameraRig, keypoints,
+                                             confidence=confidence)
         
     #RANSAC for outlier rejection - on a per-marker basis, not a per-camera basis. Could be part of the problem
     #Not clear that this is helpful 4/23/21
-    if ransac and nCams>2:
-        nIter = np.round(np.log(.01)/np.log(1-np.power(.75,2))) # log(1 - prob of getting optimal set) / log(1-(n_inliers/n_points)^minPtsForModel)
-        #TODO make this a function of image resolution
-        errorUB = 20 # pixels, below this reprojection error, another camera gets added. 
-        nGoodModel =3  # model must have this many cameras to be considered good
-        
-        #functions
-        def triangulateLimitedCameras(cameraList,pointsInput,confidence,cameraNumList):
-            camList = [cameraList[i] for i in cameraNumList]
-            points2DList = [pts[:,cameraNumList] for pts in pointsInput]
-            conf = [confidence[i] for i in cameraNumList]
-            points3D = nview_linear_triangulations(camList,points2DList,weights=conf)
-            return points3D
-        
-        def reprojErrorLimitedCameras(cameraList,pointsInput,points3D,confidence,cameraNumList):
-            if type(cameraNumList) is not list: cameraNumList = [cameraNumList]
-            camList = [cameraList[i] for i in cameraNumList]
-            points2DList = [pts[:,cameraNumList] for pts in pointsInput]
-            conf = [confidence[i] for i in cameraNumList]
-            reprojError = calcReprojectionError(camList,points2DList,points3D,weights=conf)
-            return reprojError
-
-        
-        #initialize
-        bestReprojError = 1000 * np.ones(nMkrs) # initial, large value
-        best3Dpoint = np.empty((points3d.shape))
-        camComboList = [[] for _ in range(nMkrs)]
-        
-        for iIter in range(int(nIter)):
-            np.random.seed(iIter)
-            camCombo = np.arange(nCams)
-            np.random.shuffle(camCombo) # Seed setting should give same combos every run
-            maybeInliers = list(camCombo[:2])
-            alsoInliers = [[] for _ in range(nMkrs)]
-            
-            
-            # triangulate maybe inliers
-            points3D = triangulateLimitedCameras(cameraList,pointsInput,confidence,maybeInliers)
-            
-            #error on next camera
-            for iMkr in range(nMkrs):
-                for j in range(nCams-2):
-                    er = reprojErrorLimitedCameras(cameraList,pointsInput,points3D,confidence,camCombo[2+j])
-                    # print(er[iMkr])
-                    if er[iMkr] < errorUB:
-                        alsoInliers[iMkr].append(camCombo[2+j])
-                # see if error is bigger than previous, if not, use this combo to triangulate
-                # just 1 marker
-                if (len(maybeInliers) + len(alsoInliers[iMkr])) >= nGoodModel:
-                    thisConf = [np.atleast_1d(c[iMkr]) for c in confidence]
-                    point3D = triangulateLimitedCameras(cameraList,[pointsInput[iMkr]],thisConf,maybeInliers + alsoInliers[iMkr])
-                    er3D = reprojErrorLimitedCameras(cameraList,[pointsInput[iMkr]],point3D,thisConf,maybeInliers + alsoInliers[iMkr])    
-                    # if er3D<bestReprojError[iMkr]:
-                    if (len(maybeInliers) + len(alsoInliers[iMkr])) > len(camComboList[iMkr]):
-                        best3Dpoint[:,iMkr] = point3D.T
-                        bestReprojError[iMkr] = er3D
-                        camComboList[iMkr] = maybeInliers.copy() + alsoInliers[iMkr].copy()
-
-        points3d = best3Dpoint
-                                    
-    
-    if ignoreMissingMarkers and nCams>2:        
+    if ransac:
+        points3D = triangulateRansac(cameraRig, keypoints, 
+                                     confidence=confidence)
+    
+    if missingObservations is not None:        
         # For markers that were not identified by certain cameras,
         # we re-compute their 3D positions but only using cameras that could
         # identify them (ie cameras that did not return (0,0) as coordinates).
-        missingCams, missingMarkers = getMissingMarkersCameras(keypoints2D)     
+        points3D = triangulateViewedCameras(
+            cameraRig, keypoints, points3D, missingObservations, 
+            confidence=confidence)
     
-        for missingMarker in np.unique(missingMarkers):
-            idx_missingMarker = np.where(missingMarkers == missingMarker)[0]
-            idx_missingCam = missingCams[idx_missingMarker]
-            
-            idx_viewedCams = list(range(0, len(cameraList)))
-            for i in idx_missingCam:
-                idx_viewedCams.remove(i)
-                
-            CamParamList_viewed = [cameraList[i] for i in idx_viewedCams]
-            c_pointsInput = copy.deepcopy(pointsInput)
-            for count, pointInput in enumerate(c_pointsInput):
-                c_pointsInput[count] = pointInput[:,idx_viewedCams]
-            
-            points3d_missingMarker = nview_linear_triangulations(
-                CamParamList_viewed, c_pointsInput,weights=confidence)
-            
-            # overwritte marker
-            points3d[:, missingMarker] = points3d_missingMarker[:, missingMarker]
+    return points3D, confidence3D
+
+# %%
+def triangulateKeypointsChunked(cameraRig, keypoints, confidence=None,
+                                missingObservations=None, chunkFrames=None,
+                                memoryBudget=2**28, nWorkers=1, **kwargs):
+    # triangulateKeypoints of nCams x nMkrs x nFrames x 2 keypoints, in 
+    # blocks of chunkFrames frames that are stitched into the preallocated
+    # outputs. If chunkFrames is None, it is chosen such that the solver
+    # intermediates of a block take about memoryBudget bytes. Blocks are
+    # processed in this process if nWorkers is 1, otherwise in a pool of
+    # nWorkers processes (None for one per CPU) that share the inputs and
+    # outputs through shared memory. kwargs are passed to 
+    # triangulateKeypoints.
+    # Returns the 3 x nMkrs x nFrames points and the nMkrs x nFrames 
+    # confidence.
+    nCams, nMkrs, nFrames = keypoints.shape[:3]
+    if chunkFrames is None:
+        # D matrices (2*nCams x 4) and the 4 x 4 eigendecompositions, float64.
+        bytesPerFrame = nMkrs * (64 * nCams + 512)
+        chunkFrames = max(1, int(memoryBudget // bytesPerFrame))
+    blocks = [slice(start, min(start+chunkFrames, nFrames)) 
+              for start in range(0, nFrames, chunkFrames)]
+    
+    arrays = {'keypoints': keypoints, 
+              'confidence': confidence,
+              'missingObservations': missingObservations,
+              'points3D': np.empty((3, nMkrs, nFrames)),
+              'confidence3D': np.empty((nMkrs, nFrames))}
+    arrays = {name: array for name, array in arrays.items() if array is not None}
+    
+    if nWorkers == 1 or len(blocks) == 1:
+        for block in blocks:
+            triangulateKeypointsBlock(cameraRig, arrays, block, kwargs)
+        return arrays['points3D'], arrays['confidence3D']
+    
+    # Copy the inputs to, and allocate the outputs in, shared memory. The
+    # workers get the names, shapes and dtypes of the shared blocks only.
+    sharedMemories = {}
+    try:
+        sharedArrays = {}
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            sharedMemories[name] = shared_memory.SharedMemory(
+                create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, 
+                       buffer=sharedMemories[name].buf)[...] = array
+            sharedArrays[name] = (sharedMemories[name].name, array.shape, 
+                                  array.dtype.str)
+        with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+            list(executor.map(triangulateSharedKeypointsBlock, 
+                              [cameraRig]*len(blocks), 
+                              [sharedArrays]*len(blocks), blocks, 
+                              [kwargs]*len(blocks)))
+        points3D, confidence3D = [
+            np.ndarray(arrays[name].shape, buffer=sharedMemories[name].buf).copy()
+            for name in ['points3D', 'confidence3D']]
+    finally:
+        for sharedMemory in sharedMemories.values():
+            sharedMemory.close()
+            sharedMemory.unlink()
     
-    return points3d, confidence3d
+    return points3D, confidence3D
 
+def triangulateKeypointsBlock(cameraRig, arrays, block, kwargs):
+    # Triangulates the frames in block of the arrays of 
+    # triangulateKeypointsChunked, writing to its outputs.
+    inputs = {name: arrays[name][:,:,block] if name in arrays else None
+              for name in ['keypoints', 'confidence', 'missingObservations']}
+    (arrays['points3D'][:,:,block], 
+     arrays['confidence3D'][:,block]) = triangulateKeypoints(
+         cameraRig, inputs['keypoints'], confidence=inputs['confidence'],
+         missingObservations=inputs['missingObservations'], **kwargs)
+
+def triangulateSharedKeypointsBlock(cameraRig, sharedArrays, block, kwargs):
+    # triangulateKeypointsBlock in a worker process, on the arrays in the 
+    # shared memory blocks described by sharedArrays.
+    sharedMemories = {name: shared_memory.SharedMemory(name=sharedName)
+                      for name, (sharedName, _, _) in sharedArrays.items()}
+    try:
+        arrays = {name: np.ndarray(shape, dtype=dtype, 
+                                   buffer=sharedMemories[name].buf)
+                  for name, (_, shape, dtype) in sharedArrays.items()}
+        triangulateKeypointsBlock(cameraRig, arrays, block, kwargs)
+        del arrays
+    finally:
+        for sharedMemory in sharedMemories.values():
+            sharedMemory.close()
 
 # %% Get 3D keypoints by triangulation.
 # If you set ignoreMissingMarkers to True, and pass the DISTORTED keypoints
-# as keypoints2D, the triangulation will ignore data from cameras that
+# (list of nMkrs x nFrames x 2 arrays, same cameras) as keypoints2D, the triangulation will ignore data from cameras that
 # returned (0,0) as marker coordinates.
 # TODO: imageScaleFactor isn't used for now.
 def triangulateMultiviewVideo(CameraParamDict,keypointDict,imageScaleFactor=1,
@@ -2477,10 +3239,20 @@ def triangulateMultiviewVideo(CameraParamDict,keypointDict,imageScaleFactor=1,
                               spline3dZeros = False, splineMaxFrames=5, nansInOut=[],
                               CameraDirectories = None, trialName = None,
                               startEndFrames=None, trialID='',
-                              outputMediaFolder=None):
+                              outputMediaFolder=None,
+                              selectCamerasMinReprojError=False,
+                              ransac=False, chunkFrames=None, 
+                              memoryBudget=2**28, nWorkers=1):
     # cams2Use is a list of cameras that you want to use in triangulation. 
     # if first entry of list is ['all'], will use all
     # otherwise, ['Cam0','Cam2']
+    # If selectCamerasMinReprojError, each point is triangulated with the 
+    # subset of cameras that minimizes its reprojection error (>2 cameras).
+    # If ransac, outlier cameras are rejected per point (see 
+    # triangulateRansac, >2 cameras).
+    # Frames are triangulated in blocks of chunkFrames frames (default: as 
+    # many as fit in memoryBudget bytes), in nWorkers processes, see 
+    # triangulateKeypointsChunked.
     CameraParamList = [CameraParamDict[i] for i in CameraParamDict]
     if cams2Use[0] == 'all' and not None in CameraParamList:
         keypointDict_selectedCams = keypointDict
@@ -2507,22 +3279,151 @@ def triangulateMultiviewVideo(CameraParamDict,keypointDict,imageScaleFactor=1,
     keypointList_selectedCams = [keypointDict_selectedCams[i] for i in keypointDict_selectedCams]
     confidenceList_selectedCams = [confidenceDict_selectedCams[i] for i in confidenceDict_selectedCams]
     CameraParamList_selectedCams = [CameraParamDict_selectedCams[i] for i in CameraParamDict_selectedCams]
-    unpackedKeypoints = unpackKeypointList(keypointList_selectedCams)
-    points3D = np.zeros((3,keypointList_selectedCams[0].shape[0],keypointList_selectedCams[0].shape[1]))
-    confidence3D = np.zeros((1,keypointList_selectedCams[0].shape[0],keypointList_selectedCams[0].shape[1]))
-    
+    cameraRig = CameraRig.from_camera_params(
+        CameraParamList_selectedCams, names=list(CameraParamDict_selectedCams))
+    
+    # Stacked keypoints and confidences (used if confidenceDict is provided)
+    # of the selected cameras. MultiCamKeypoints already hold them.
+    if isinstance(keypointDict, MultiCamKeypoints):
+        keypoints_selectedCams = keypointDict.subset(
+            CameraParamDict_selectedCams)
+        keypointsStacked = keypoints_selectedCams.keypoints
+        confidenceStacked = keypoints_selectedCams.confidence
+    else:
+        keypointsStacked = np.stack(keypointList_selectedCams)
+        if confidenceDict:
+            confidenceStacked = np.stack(confidenceList_selectedCams)
+    if not confidenceDict:
+        confidenceStacked = None
+    if ignoreMissingMarkers and len(cameraRig) > 2:
+        missingObservations = getMissingObservations(keypoints2D)
+    else:
+        missingObservations = None
+    # Triangulate in blocks of frames, see triangulateKeypointsChunked.
+    points3D, confidence3D = triangulateKeypointsChunked(
+        cameraRig, keypointsStacked, confidence=confidenceStacked,
+        missingObservations=missingObservations, chunkFrames=chunkFrames,
+        memoryBudget=memoryBudget, nWorkers=nWorkers,
+        selectCamerasMinReprojError=selectCamerasMinReprojError, ransac=ransac)
+    confidence3D = confidence3D[np.newaxis]
+        
+    points3D, confidence3D = postprocessTriangulatedVideo(
+        points3D, confidence3D, keypointDict, cams2Use=cams2Use, 
+        trimTrial=trimTrial, spline3dZeros=spline3dZeros, 
+        splineMaxFrames=splineMaxFrames, nansInOut=nansInOut, 
+        CameraDirectories=CameraDirectories, trialName=trialName, 
+        startEndFrames=startEndFrames, trialID=trialID, 
+        outputMediaFolder=outputMediaFolder)
     
-    for iFrame,points2d in enumerate(unpackedKeypoints):
-        # If confidence weighting
+    return points3D, confidence3D
+
+# %%
+def triangulateMultiviewVideoSubsets(CameraParamDict, keypointDict, 
+                                     cameraSubsets, confidenceDict={}, 
+                                     nansInOut=[], nansInOutTwoCameras=None,
+                                     CameraDirectories=None, chunkFrames=None, memoryBudget=2**28, 
+                                     nWorkers=1, **kwargs):
+    # Validation mode of triangulateMultiviewVideo: triangulates the keypoints
+    # with each camera subset in cameraSubsets (dict of lists of camera names,
+    # e.g., {'2-cameras': ['Cam1','Cam3'], '3-cameras': ['Cam1','Cam2','Cam3']})
+    # in a single batched pass over the stacked keypoints of their cameras.
+    # The cameras that are not in a subset get 0 weight, which gives the same
+    # points as triangulating with the subset only. The points of each subset
+    # are then postprocessed with postprocessTriangulatedVideo (kwargs) and 
+    # the nansInOut of its cameras, or for subsets of 2 cameras, the 
+    # nansInOutTwoCameras of its cameras if provided (see synchronizeVideos): 
+    # nansInOut are only set when syncing 2 cameras. All subsets share the 
+    # folder of the synchronized videos, which are only rewritten for the 
+    # last subset.
+    # Returns dicts with the 3D points and confidence of each subset.
+    subsetNames = list(cameraSubsets)
+    cameras = [camName for camName in keypointDict 
+               if CameraParamDict[camName] is not None and 
+               any(camName in cameraSubsets[name] for name in subsetNames)]
+    cameraRig = CameraRig.from_camera_params(
+        [CameraParamDict[camName] for camName in cameras], names=cameras)
+    if isinstance(keypointDict, MultiCamKeypoints):
+        keypoints = keypointDict.subset(cameras)
+        keypointsStacked = keypoints.keypoints
+        confidenceStacked = keypoints.confidence
+    else:
+        keypointsStacked = np.stack([keypointDict[cam] for cam in cameras])
         if confidenceDict:
-            thisConfidence = [c[:,iFrame] for c in confidenceList_selectedCams]
+            confidenceStacked = np.stack([confidenceDict[cam] for cam in cameras])
+    if not confidenceDict:
+        confidenceStacked = np.ones(keypointsStacked.shape[:-1])
+    
+    # Subsets are stacked along the marker dimension: nCams x 
+    # (nSubsets*nMkrs) x nFrames.
+    nCams, nMkrs, nFrames = keypointsStacked.shape[:3]
+    inSubset = np.array([[cam in cameraSubsets[name] for name in subsetNames]
+                         for cam in cameras]).reshape(nCams, len(subsetNames))
+    weights = np.where(inSubset[:,:,np.newaxis,np.newaxis], 
+                       confidenceStacked[:,np.newaxis], 0)
+    # Subsets of 2 cameras follow the 2-camera convention of 
+    # clean2Dkeypoints, see confidenceToTwoCameras.
+    for iSubset in np.flatnonzero(np.count_nonzero(inSubset, axis=0) == 2):
+        weights[:,iSubset] = confidenceToTwoCameras(weights[:,iSubset])
+    points3D, confidence3D = triangulateKeypointsChunked(
+        cameraRig,
+        np.broadcast_to(keypointsStacked[:,np.newaxis], 
+                        (nCams, len(subsetNames)) + keypointsStacked.shape[1:]
+                        ).reshape(nCams, -1, nFrames, 2), 
+        confidence=weights.reshape(nCams, -1, nFrames), 
+        chunkFrames=chunkFrames, memoryBudget=memoryBudget, nWorkers=nWorkers)
+    points3D = points3D.reshape(3, len(subsetNames), nMkrs, nFrames)
+    confidence3D = confidence3D.reshape(len(subsetNames), nMkrs, nFrames)
+    
+    points3DSubsets, confidence3DSubsets = {}, {}
+    for iSubset, name in enumerate(subsetNames):
+        subsetCameras = [cam for cam in cameras if cam in cameraSubsets[name]]
+        if len(subsetCameras) == 2 and nansInOutTwoCameras:
+            subsetNansInOut = {cam: nansInOutTwoCameras[cam] 
+                               for cam in subsetCameras}
+        elif nansInOut:
+            subsetNansInOut = {cam: nansInOut[cam] for cam in subsetCameras}
         else:
-            thisConfidence = None
-        
-        points3D[:,:,iFrame], confidence3D[:,:,iFrame] = triangulateMultiview(CameraParamList_selectedCams, points2d, 
-                          imageScaleFactor=1, useRotationEuler=False,
-                          ignoreMissingMarkers=ignoreMissingMarkers, keypoints2D=keypoints2D,confidence=thisConfidence)
-        
+            subsetNansInOut = nansInOut
+        lastSubset = iSubset == len(subsetNames) - 1
+        points3DSubsets[name], confidence3DSubsets[name] = (
+            postprocessTriangulatedVideo(
+                np.ascontiguousarray(points3D[:,iSubset]), 
+                np.ascontiguousarray(confidence3D[np.newaxis,iSubset]), 
+                keypointDict, cams2Use=subsetCameras, 
+                nansInOut=subsetNansInOut,
+                CameraDirectories=CameraDirectories if lastSubset else None,
+                **kwargs))
+    
+    return points3DSubsets, confidence3DSubsets
+
+def confidenceToTwoCameras(confidence):
+    # Confidences (... x nFrames) cleaned for more than 2 cameras, where low 
+    # confidence values are 0s, in the convention of clean2Dkeypoints for 
+    # 2 cameras: internal 0s (between the first and last frame with >0 
+    # confidence) become nans, so that these frames are triangulated from 
+    # the interpolated keypoints with a confidence of 0.5.
+    nonzero = confidence != 0
+    frames = np.arange(confidence.shape[-1])
+    idx_first = np.argmax(nonzero, axis=-1)[...,np.newaxis]
+    idx_last = (confidence.shape[-1] - 1 - 
+                np.argmax(nonzero[...,::-1], axis=-1))[...,np.newaxis]
+    
+    internal = (frames > idx_first) & (frames < idx_last)
+    
+    return np.where(~nonzero & internal & np.any(nonzero, axis=-1, keepdims=True),
+                    np.nan, confidence)
+
+# %%
+def postprocessTriangulatedVideo(points3D, confidence3D, keypointDict, 
+                                 cams2Use=['all'], trimTrial=True,
+                                 spline3dZeros=False, splineMaxFrames=5, 
+                                 nansInOut=[], CameraDirectories=None, 
+                                 trialName=None, startEndFrames=None, 
+                                 trialID='', outputMediaFolder=None):
+    # Trimming, rewriting of the synchronized videos and splining of the 
+    # 3 x nMkrs x nFrames points and 1 x nMkrs x nFrames confidence 
+    # triangulated with the cameras in cams2Use, see 
+    # triangulateMultiviewVideo.
     if trimTrial:
         # Delete confidence and 3D keypoints if markers, except for face 
         # markers, have 0 confidence (they're garbage b/c <2 cameras saw them).
@@ -2611,94 +3512,81 @@ def triangulateMultiviewVideo(CameraParamDict,keypointDict,imageScaleFactor=1,
     if spline3dZeros:
     # Spline across positions with 0 3D confidence (i.e., there weren't 2 cameras
     # to use for triangulation).
-        points3D = spline3dPoints(points3D, confidence3D, splineMaxFrames)
+        points3D = spline3dPoints(points3D, confidence3D, splineMaxFrames,
+                                  inPlace=True)
     
     return points3D, confidence3D
 
 # %% 
-def spline3dPoints(points3D, confidence3D, splineMaxFrames=5):
-    c_p3d = copy.deepcopy(points3D)
-    c_conf = copy.deepcopy(confidence3D)
+def spline3dPoints(points3D, confidence3D, splineMaxFrames=5, inPlace=False):
+    # Spline internal stretches of 0 confidence shorter than splineMaxFrames,
+    # for all markers and coordinates at once. The other frames, including
+    # longer stretches of 0s, are used as knots.
+    if inPlace:
+        c_p3d = points3D
+    else:
+        c_p3d = np.copy(points3D)
     
     # Find internal stretches of 0 that are shorter than splineMaxFrames
-    for iPt in np.arange(c_p3d.shape[1]):
-        thisConf = c_conf[0,iPt,:]        
-        zeroInds, nonZeroInds = findInternalZeroInds(thisConf,splineMaxFrames)
-        
-        # spline these internal zero stretches
-        if zeroInds is not None and zeroInds.shape[0] > 0:
-            c_p3d[:,iPt,zeroInds] = pchip_interpolate(nonZeroInds,
-                                                  c_p3d[:,iPt,nonZeroInds],
-                                                  zeroInds,axis=1)    
+    zeroInds = findInternalZeroRuns(confidence3D[0], splineMaxFrames)
+    
+    # spline these internal zero stretches
+    if np.any(zeroInds):
+        nCoords, nMkrs, nFrames = c_p3d.shape
+        # View for contiguous and for trimmed (sliced along frames) arrays.
+        series = c_p3d.reshape(nCoords*nMkrs, nFrames)
+        interpolateMissingSamples(series, np.tile(zeroInds, (nCoords, 1)))
+        if not np.may_share_memory(series, c_p3d):
+            c_p3d[...] = series.reshape(c_p3d.shape)
 
     return c_p3d
 
+# %%
+def findInternalZeroRuns(x, maxLength):
+    # Boolean mask of the internal stretches of 0s (i.e., not at the 
+    # beginning or end) shorter than maxLength in each row of x 
+    # (nRows x nSamples), found for all rows at once with run-length encoding.
+    zero = np.atleast_2d(x) == 0
+    nRows, nSamples = zero.shape
+    
+    # Starts and ends (exclusive) of the stretches of 0s, row by row.
+    padded = np.zeros((nRows, nSamples+2), dtype=np.int8)
+    padded[:,1:-1] = zero
+    dZero = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(dZero == 1)
+    _, ends = np.nonzero(dZero == -1)
+    
+    # Keep internal stretches shorter than maxLength.
+    keep = (starts > 0) & (ends < nSamples) & (ends - starts < maxLength)
+    rows, starts, ends = rows[keep], starts[keep], ends[keep]
+    runs = np.zeros((nRows, nSamples+1), dtype=np.int32)
+    np.add.at(runs, (rows, starts), 1)
+    np.add.at(runs, (rows, ends), -1)
+    
+    return np.cumsum(runs[:,:-1], axis=1) > 0
+
 # %%
 def findInternalZeroInds(x,maxLength):
+    # Indices of the internal stretches of 0s shorter than maxLength in x,
+    # and of all other samples. None, None if x is all 0.
        
     # skip splining if x is all 0
     if all(x==0):
         return None, None
     
-    zeroInds = np.argwhere(x==0)
-    dZeroInds = np.diff(zeroInds,axis=0,prepend=-1)
-    
-    # check if first/last values are 0, don't spline the beginning and end
-    start0 = x[0] == 0
-    end0 = x[-1] == 0
-    
-    if start0:
-        # delete string of 0s at beginning
-        while(dZeroInds.shape[0] > 0 and dZeroInds[0] == 1):
-            zeroInds = np.delete(zeroInds,0)
-            dZeroInds = np.delete(dZeroInds,0)
-    if end0: 
-        while(dZeroInds.shape[0] > 0 and dZeroInds[-1] == 1):
-            # keep deleting end inds if there is a string of 0s before end
-            zeroInds = np.delete(zeroInds,-1)
-            dZeroInds = np.delete(dZeroInds,-1)
-        # delete last index before jump - value will be greater than 1
-        zeroInds = np.delete(zeroInds,-1)
-        dZeroInds = np.delete(dZeroInds,-1)
-    
-    # check if any stretches are longer than maxLength
-    thisStretch = np.array([0]) # initialize with first value b/c dZeroInds[0] ~=1
-    indsToDelete = np.array([])
-    for iIdx,d in enumerate(dZeroInds):
-        if d == 1:
-            thisStretch = np.append(thisStretch,iIdx)
-        else:
-            if len(thisStretch) >= maxLength:
-                indsToDelete = np.append(indsToDelete,np.copy(thisStretch))
-            thisStretch = np.array([iIdx])
-    # if final stretch is too long, add it too
-    if len(thisStretch) >= maxLength:
-        indsToDelete = np.append(indsToDelete,np.copy(thisStretch))
-        
-    if len(indsToDelete) > 0:
-        zeroInds = np.delete(zeroInds,indsToDelete.astype(int))
-        dZeroInds = np.delete(dZeroInds,indsToDelete.astype(int))
-            
-    nonZeroInds = np.delete(np.arange(len(x)),zeroInds)
-
+    zeroMask = findInternalZeroRuns(x, maxLength)[0]
+    zeroInds = np.flatnonzero(zeroMask)
+    nonZeroInds = np.flatnonzero(~zeroMask)
         
     return zeroInds, nonZeroInds
     
 # %% 
-def calcReprojectionErrorForSync(CamParamList, keypointList, lagVal,
-                                 cams2UseReproj, confidence, cameras2Use):
-    
-    # Number of timesteps to triangulate. Will average reprojection error over all nTimesteps.
-    nTimesteps = 5 
-    
-    keypoints2D = copy.deepcopy(keypointList)
-    conf = copy.deepcopy(confidence)
-    CamParamListCopy = copy.deepcopy(CamParamList)
-    
-    # Find the range of overlapping confidence for this lag value
-    confSel = []
-    for cam in cams2UseReproj:
-        confSel.append(conf[cam])
+def prepareReprojectionForSync(cameraRig, keypointList, cams2UseReproj,
+                               confidence):
+    # Prepares the camera pair used to score candidate lags with the
+    # reprojection error, so it can be reused for all lags. Keypoints and
+    # confidences are not copied.
+    confSel = [confidence[cam] for cam in cams2UseReproj]
         
     # find confidence ranges in original indices
     confThresh = [.5*np.nanmax(c) for c in confSel] # Threshold for saying this camera confidently sees the person
@@ -2709,93 +3597,114 @@ def calcReprojectionErrorForSync(CamParamList, keypointList, lagVal,
     for i,c in enumerate(avgConf):
         temp = c > confThresh[i]
         if True in temp:
-            confRanges.append(np.array([np.argwhere(temp)[0], np.argwhere(temp)[-1]+1]))
+            confRanges.append([np.argwhere(temp)[0,0], np.argwhere(temp)[-1,0]+1])
         else:
-            reprojErrorAcrossFrames = 0.1
-            reprojSuccess = False
-            return reprojErrorAcrossFrames, reprojSuccess
+            confRanges = None
+            break
+    
+    reprojData = {'cameraRig': cameraRig.subset(cams2UseReproj),
+                  'keypointList': [keypointList[cam] for cam in cams2UseReproj],
+                  'confidence': confSel,
+                  'confRanges': confRanges,
+                  'cams2UseReproj': cams2UseReproj}
+    
+    return reprojData
+
+# %%
+def calcReprojectionErrorsForSync(reprojData, lags):
+    # Confidence-weighted reprojection error of the camera pair in reprojData
+    # (see prepareReprojectionForSync) for each candidate lag of the second
+    # camera. All lags are triangulated and reprojected in one pass over a
+    # 2 cameras x nMkrs x nLags x nTimesteps tensor.
+    
+    # Number of timesteps to triangulate. Will average reprojection error over all nTimesteps.
+    nTimesteps = 5 
+    
+    lags = np.atleast_1d(np.asarray(lags, dtype=int))
+    nLags = len(lags)
+    
+    if reprojData['confRanges'] is None:
+        # One of the cameras never confidently sees the person.
+        reprojErrorAcrossFrames = 0.1 * np.ones(nLags)
+        reprojSuccess = np.zeros(nLags, dtype=bool)
+        return reprojErrorAcrossFrames, reprojSuccess
         
     # shift second camera based on lag, so indices are "aligned," then find overlapping range
-    shiftedConfRanges = copy.deepcopy(confRanges)
-    shiftedConfRanges[1] = shiftedConfRanges[1] - lagVal # shift the indices for second camera
+    confRanges = reprojData['confRanges']
     # Ignore the first and last few timesteps here as confidence drops
-    shiftedOverlapInds = [np.max((shiftedConfRanges[0][0],shiftedConfRanges[1][0]))+3,
-                          np.min((shiftedConfRanges[0][1],shiftedConfRanges[1][1]))-3]
-    
-    # Sample nTimesteps between the shifted Overlap Inds
-    shiftedSampleInds = np.linspace(shiftedOverlapInds[0],shiftedOverlapInds[1],nTimesteps).astype(int)
-    
-    sampleInds = []
-    sampleInds.append(shiftedSampleInds) # no shift for first camera
-    sampleInds.append(shiftedSampleInds + lagVal) # unshifts the indices for second camera
-    
-    # Select keypoints and confidence at appropriate timesteps
-    keypoints2DSelected = []
-    cameraListSelected = []
-    confListSelected = []
-    for iCam, cam in enumerate(cams2UseReproj):
-        keypoints2D[cam] = keypoints2D[cam][:,sampleInds[iCam],:]
-        conf[cam] = conf[cam][:,sampleInds[iCam]]
-        keypoints2DSelected.append(keypoints2D[cam])
-        cameraListSelected.append(CamParamListCopy[cam])
-        confListSelected.append(conf[cam])
-        
-    # Triangulate at each of the nTimesteps
-    # We here need to turn the lists back into dicts.
-    CamParamListCopy_dict = {}
-    keypoints2D_dict = {}
-    conf_dict = {}
-    for iCam, cam in enumerate(cameras2Use):
-        CamParamListCopy_dict[cam] = CamParamListCopy[iCam]
-        keypoints2D_dict[cam] = keypoints2D[iCam]
-        conf_dict[cam] = conf[iCam]
-    cameras2UseReproj = [cameras2Use[i] for i in cams2UseReproj]
-    keypoints3D, _ = triangulateMultiviewVideo(
-        CamParamListCopy_dict, keypoints2D_dict, ignoreMissingMarkers=False, 
-        cams2Use=cameras2UseReproj, confidenceDict=conf_dict,trimTrial=False)
-    
-    # Make list of camera objects
-    cameraObjList = []       
-    for camParams in cameraListSelected:
-        c = Camera()
-        c.set_K(camParams['intrinsicMat'])
-        c.set_R(camParams['rotation'])
-        c.set_t(np.reshape(camParams['translation'],(3,1)))
-        cameraObjList.append(c)
-        
-    # Compute confidence-weighted reprojection error for each of nTimesteps
-    reprojErrorVec = []
-    for tStep in range(nTimesteps):
-       
-        # Organize points for reprojectionError function
-        stackedPoints = np.stack([k[:,None,tStep,:] for k in keypoints2DSelected])
-        pointsInput = []
-        for i in range(stackedPoints.shape[1]):
-            pointsInput.append(stackedPoints[:,i,0,:].T)
-        
-        confForWeights = [c[:,None,tStep].T for c in confListSelected] # needs transpose for reprojection error function
-        confForWeights = [np.nan_to_num(c,nan=0) for c in confForWeights] # sometimes confidence has nans, don't want to use as weights in this case
-        
-        # Calculate combined reprojection error
-        key3D = np.squeeze(keypoints3D[:,:,tStep])
-        reprojErrors = calcReprojectionError(cameraObjList,pointsInput,key3D,
-                                             weights=confForWeights,normalizeError=True)
-        
-        # multiply minimum confidence between cameras times marker-wise reproj errors
-        # so we don't include errors for markers that had low confidence in one of the cameras
-        minConfVec = np.min(np.asarray(confForWeights), axis=0)
-        minConfVec[np.where(minConfVec<0.5)] = 0 # Set low conf markers to 0
-        weightedReprojErrors = np.multiply(reprojErrors,minConfVec)
-        if np.any(weightedReprojErrors):
-            reprojErrorVec.append(np.mean(weightedReprojErrors[minConfVec>0]))
-        else:
-            reprojErrorVec.append(1000) # in cases where no position is confident set to large reproj error. typical values are on the order of  0.1
-        
-    reprojErrorAcrossFrames = np.mean(reprojErrorVec)
-    reprojSuccess = True    
+    shiftedOverlapStart = np.maximum(confRanges[0][0], confRanges[1][0] - lags) + 3
+    shiftedOverlapEnd = np.minimum(confRanges[0][1], confRanges[1][1] - lags) - 3
+    
+    # Lags for which the cameras see the person confidently for less than 
+    # nTimesteps common frames cannot be scored (and would index outside of
+    # the keypoints). They get a large error and reprojSuccess = False.
+    validLags = shiftedOverlapEnd - shiftedOverlapStart >= nTimesteps
+    reprojErrorAcrossFrames = 1000 * np.ones(nLags)
+    reprojSuccess = validLags
+    if not np.any(validLags):
+        return reprojErrorAcrossFrames, reprojSuccess
+    lags = lags[validLags]
+    shiftedOverlapStart = shiftedOverlapStart[validLags]
+    shiftedOverlapEnd = shiftedOverlapEnd[validLags]
+    
+    # Sample nTimesteps between the shifted Overlap Inds: nLags x nTimesteps
+    shiftedSampleInds = np.linspace(shiftedOverlapStart, shiftedOverlapEnd,
+                                    nTimesteps, axis=1).astype(int)
+    sampleInds = [shiftedSampleInds, # no shift for first camera
+                  shiftedSampleInds + lags[:,np.newaxis]] # unshifts the indices for second camera
+    
+    # Select keypoints and confidence at appropriate timesteps:
+    # 2 x nMkrs x nLags x nTimesteps (x 2)
+    keypoints2DSelected = np.stack([k[:,inds,:] for k,inds in zip(
+        reprojData['keypointList'], sampleInds)])
+    confSelected = np.stack([c[:,inds] for c,inds in zip(
+        reprojData['confidence'], sampleInds)])
+        
+    # Triangulate all lags and timesteps at once
+    pairRig = reprojData['cameraRig']
+    keypoints3D, _ = pairRig.triangulate(keypoints2DSelected,
+                                         weights=confSelected)
+    
+    # Confidence-weighted reprojection errors, normalized by the height of
+    # the bounding box, as in calcReprojectionError.
+    confForWeights = np.nan_to_num(confSelected,nan=0) # sometimes confidence has nans, don't want to use as weights in this case
+    reproj = pairRig.project(np.moveaxis(keypoints3D,0,-1))
+    reprojErrors = np.linalg.norm(
+        (reproj - keypoints2DSelected) * confForWeights[...,np.newaxis],axis=-1)
+    yVals = keypoints2DSelected[...,1]
+    with np.errstate(invalid='ignore'):
+        nonZeroY = yVals > 0
+    boxHeight = (np.max(np.where(nonZeroY,yVals,-np.inf),axis=1) - 
+                 np.min(np.where(nonZeroY,yVals,np.inf),axis=1))
+    reprojErrors = np.mean(reprojErrors / boxHeight[:,np.newaxis], axis=0)
+    
+    # multiply minimum confidence between cameras times marker-wise reproj errors
+    # so we don't include errors for markers that had low confidence in one of the cameras
+    minConfVec = np.min(confForWeights, axis=0)
+    minConfVec[minConfVec<0.5] = 0 # Set low conf markers to 0
+    weightedReprojErrors = np.multiply(reprojErrors,minConfVec)
+    confidentMkrs = minConfVec>0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        reprojErrorVec = (np.sum(np.where(confidentMkrs,weightedReprojErrors,0),axis=0) / 
+                          np.count_nonzero(confidentMkrs,axis=0))
+    # in cases where no position is confident set to large reproj error. typical values are on the order of  0.1
+    reprojErrorVec[~np.any(weightedReprojErrors,axis=0)] = 1000
+        
+    reprojErrorAcrossFrames[validLags] = np.mean(reprojErrorVec,axis=1)
     
     return reprojErrorAcrossFrames, reprojSuccess
 
+# %% 
+def calcReprojectionErrorForSync(cameraRig, keypointList, lagVal,
+                                 cams2UseReproj, confidence):
+    # Reprojection error of the camera pair cams2UseReproj for a single lag.
+    reprojData = prepareReprojectionForSync(cameraRig, keypointList,
+                                            cams2UseReproj, confidence)
+    reprojErrors, reprojSuccess = calcReprojectionErrorsForSync(reprojData,
+                                                                [lagVal])
+    
+    return reprojErrors[0], reprojSuccess[0]
+
 # %%
 def getMissingMarkersCameras(keypoints2D):
     # Identify cameras that returned (0,0) as marker coordinates, ie that could
@@ -2812,14 +3721,23 @@ def getMissingMarkersCameras(keypoints2D):
     
     return missingCams, missingMarkers
 
+def getMissingObservations(keypoints2D):
+    # Mask of the observations (nCams x ...) where cameras returned (0,0) as 
+    # marker coordinates, ie that could not identify the keypoints. Works 
+    # for keypoints2D of single frames (nMkrs x 1 x 2 arrays) and of videos
+    # (nMkrs x nFrames x 2 arrays).
+    return np.sum(np.stack(keypoints2D), axis=-1) == 0
+
 #%%
-def calcReprojectionError(cameraList,points2D,points3D,weights=None,normalizeError=False):
-    reprojError = np.empty((points3D.shape[1],len(cameraList)))
-    
-    if weights==None:
-        weights = [1 for i in range(len(cameraList))]
-    for iCam,cam in enumerate(cameraList):
-        reproj = cam.world_to_image(points3D)[:2,:]
+def calcReprojectionError(cameraRig,points2D,points3D,weights=None,normalizeError=False):
+    reprojError = np.empty((points3D.shape[1],len(cameraRig)))
+    
+    if weights is None:
+        weights = [1 for i in range(len(cameraRig))]
+    # Project all points into all cameras at once: nCams x nPoints x 2.
+    reprojAll = cameraRig.project(points3D.T)
+    for iCam in range(len(cameraRig)):
+        reproj = reprojAll[iCam].T
         this2D = np.array([pt2D[:,iCam] for pt2D in points2D]).T
         reprojError[:,iCam] = np.linalg.norm(np.multiply((reproj-this2D),weights[iCam]),axis=0)
         
@@ -2868,11 +3786,22 @@ def writeTRCfrom3DKeypoints(keypoints3D, pathOutputFile, keypointNames,
 
 # %% Find indices with high confidence that overlap between cameras.
 def findOverlap(confidenceList, markers4VertVel):    
-    c_confidenceList = copy.deepcopy(confidenceList)
+    
+    return findOverlapSyncConfidence(
+        getSyncConfidence(confidenceList, markers4VertVel))
+
+# %%
+def getSyncConfidence(confidenceList, markers4VertVel):
+    # Mean confidence of the sync markers of each camera. Computed once per
+    # camera such that combinations of cameras can be scored with
+    # findOverlapSyncConfidence without going back to the confidence matrices.
+    
+    return [np.mean(cMat[markers4VertVel,:],axis=0) for cMat in confidenceList]
+
+# %%
+def findOverlapSyncConfidence(confMean):
     
     # Find overlapping indices.
-    confMean = [
-        np.mean(cMat[markers4VertVel,:],axis=0) for cMat in c_confidenceList]
     minConfLength = np.min(np.array([len(x) for x in confMean]))
     confArray = np.array([x[0:minConfLength] for x in confMean])
     minConfidence = np.nanmin(confArray,axis=0)
@@ -2919,30 +3848,13 @@ def loadPklVideo(pklPath, videoFullPath, imageBasedTracker=False, poseDetector='
 
     nFrames = len(frames)
 
-    # Read in JSON files.
-    allPeople = []
-    iPerson = 0
-    anotherPerson = True
-    
-    while anotherPerson is True:             
-        anotherPerson = False
-        res = np.zeros((nFrames, 75))
-        res[:] = np.nan
-        
-        for c_frame, frame in enumerate(frames):    
-            # Get this persons keypoints if they exist.
-            if len(frame) > iPerson:
-                person = frame[iPerson]
-                keypoints = person['pose_keypoints_2d']
-                res[c_frame,:] = keypoints
-            
-            # See if there are more people.
-            if len(frame) > iPerson+1:
-                # If there was someone else in any frame, loop again.
-                anotherPerson = True 
-        
-        allPeople.append(res.copy())
-        iPerson +=1     
+    # Read in the keypoints of all people at once: nPeople x nFrames x 75,
+    # nan if a person is not detected in a frame.
+    nPeople = np.max([1] + [len(frame) for frame in frames])
+    allPeople = np.full((nPeople, nFrames, 75), np.nan)
+    for c_frame, frame in enumerate(frames):
+        for iPerson, person in enumerate(frame):
+            allPeople[iPerson, c_frame, :] = person['pose_keypoints_2d']
         
     # Creates a browser animation of the data in each person detected. This
     # may not be continuous yet. That happens later with person tracking.
@@ -2982,20 +3894,20 @@ def loadPklVideo(pklPath, videoFullPath, imageBasedTracker=False, poseDetector='
     # Track People, or if only one person, skip tracking
     if len(allPeople) >1: 
         # Select the largest keypoint-based bounding box as the subject of interest
-        bbFromKeypoints = [keypointsToBoundingBox(data,confidenceThreshold=confidenceThresholdForBB) for data in allPeople]
-        maxArea, maxIdx = zip(*[getLargestBoundingBox(data,bbox) for data,bbox in zip(allPeople,bbFromKeypoints)]) # may want to find largest bounding box size in future instead of height
+        # All people and frames at once.
+        bbFromKeypoints = keypointsToBoundingBox(allPeople,confidenceThreshold=confidenceThresholdForBB)
+        maxArea, maxIdx = getLargestBoundingBox(allPeople,bbFromKeypoints) # may want to find largest bounding box size in future instead of height
         
         # Check if a person has been detected, ie maxArea >= 0.0. If not, set
         # keypoints and confidence scores to 0, such that the camera is later
         # kicked out of the synchronization and triangulation.
-        maxArea_np = np.array(maxArea)
-        if np.max(maxArea_np) == 0.0:
+        if np.max(maxArea) == 0.0:
             key2D = np.zeros((25,nFrames,2))
             confidence = np.zeros((25,nFrames))
             return key2D, confidence
         
         startPerson = np.nanargmax(maxArea)
-        startFrame = maxIdx[startPerson]
+        startFrame = int(maxIdx[startPerson])
         startBb = bbFromKeypoints[startPerson][startFrame]
         
         # initialize output data
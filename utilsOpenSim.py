@@ -4,7 +4,7 @@ import opensim
 import numpy as np
 import glob
 import json
-from utils import storage2numpy
+from utils import storage2numpy, getSlidingWindowExtent
 
 # %% Scaling.
 def runScaleTool(pathGenericSetupFile, pathGenericModel, subjectMass,
@@ -253,19 +253,19 @@ def getScaleTimeRange(pathTRCFile, thresholdPosition=0.005, thresholdTime=0.3,
     # Corresponding number of frames.
     nf = int(timeRange_min*sf + 1)
     
+    # Look for the first window of nf frames during which no marker coordinate
+    # changes by thresholdPosition or more, with all windows of a given
+    # duration tested at once. The duration is reduced until a window is found.
     detectedWindow = False
-    i = 0
     while not detectedWindow:
-        c_window = trc_data[i:i+nf,:]
-        c_window_max = np.max(c_window, axis=0)
-        c_window_min = np.min(c_window, axis=0)
-        c_window_diff = np.abs(c_window_max - c_window_min)
-        detectedWindow = np.alltrue(c_window_diff<thresholdPosition)
-        if not detectedWindow:
-            i += 1
-            if i > c_trc_time.shape[0]-nf:
-                i = 0
-                nf -= int(0.1*sf) 
+        if nf <= c_trc_time.shape[0]:
+            isStatic = np.all(getSlidingWindowExtent(trc_data, nf) < 
+                              thresholdPosition, axis=1)
+            detectedWindow = np.any(isStatic)
+        if detectedWindow:
+            i = np.argmax(isStatic)
+        else:
+            nf -= int(0.1*sf) 
             if np.round((nf-1)/sf,2) < thresholdTime: # number of frames got too small without detecting a window
                 exception = "Musculoskeletal model scaling failed; could not detect a static phase of at least %.2fs. After you press record, make sure the subject stands still until the message tells you they can relax . Visit https://www.opencap.ai/best-pratices to learn more about data collection." % thresholdTime
                 raise Exception(exception, exception)